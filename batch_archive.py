@@ -0,0 +1,241 @@
+# batch_archive.py
+# Append-only Archiv für Batch-Dateien mit SQLite-Index: job_id -> (Archiv, Member, Byte-Offset)
+#
+# Pro Monat eine Datei batches/archive/<YYYY-MM>.gz aus aneinandergehängten gzip-Membern (zcat liest sie komplett).
+# Jeder Member ist ein Block aus höchstens ARCHIVE_BLOCK_KB unkomprimierten JSONL-Zeilen einer Datei;
+# eine Abfrage dekomprimiert nur den Block, in dem die gesuchte Zeile liegt.
+
+import os
+import json
+import time
+import gzip
+import sqlite3
+import logging
+import threading
+import zipfile
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from result_parser import loads
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+BATCH_DIR = "batches"
+ARCHIVE_DIR = os.path.join(BATCH_DIR, "archive")
+ARCHIVE_INDEX_PATH = os.getenv("ARCHIVE_INDEX_PATH", os.path.join(ARCHIVE_DIR, "index.sqlite"))
+ARCHIVE_BLOCK_BYTES = int(float(os.getenv("ARCHIVE_BLOCK_KB", 64)) * 1024)
+
+MEMBERS = ("input", "output", "error", "status")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    block_id    INTEGER PRIMARY KEY,
+    archive     TEXT NOT NULL,
+    offset      INTEGER NOT NULL,
+    length      INTEGER NOT NULL,
+    batch_id    TEXT NOT NULL,
+    member      TEXT NOT NULL,
+    archived_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_blocks_batch ON blocks (batch_id);
+
+CREATE TABLE IF NOT EXISTS entries (
+    job_id    TEXT NOT NULL,
+    custom_id TEXT NOT NULL,
+    block_id  INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entries_job ON entries (job_id);
+"""
+
+
+def custom_id_of(line: bytes) -> Optional[str]:
+    try:
+        custom_id = loads(line).get("custom_id")
+    except (ValueError, AttributeError):
+        return None
+    return str(custom_id) if custom_id is not None else None
+
+
+def iter_blocks(lines: Iterable[bytes], block_bytes: int = ARCHIVE_BLOCK_BYTES) -> Iterator[List[bytes]]:
+    block: List[bytes] = []
+    size = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        if not line.endswith(b"\n"):
+            line += b"\n"
+        if block and size + len(line) > block_bytes:
+            yield block
+            block, size = [], 0
+        block.append(line)
+        size += len(line)
+    if block:
+        yield block
+
+
+class BatchArchive:
+    """Schreibt Batch-Dateien blockweise ins Monatsarchiv und beantwortet Abfragen über den Index."""
+
+    def __init__(self, archive_dir: str = ARCHIVE_DIR, index_path: str = ARCHIVE_INDEX_PATH,
+                 block_bytes: int = ARCHIVE_BLOCK_BYTES):
+        os.makedirs(archive_dir, exist_ok=True)
+        self.archive_dir = archive_dir
+        self.block_bytes = block_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(index_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def archive_path(self, archive: str) -> str:
+        return os.path.join(self.archive_dir, archive)
+
+    def add_batch(self, batch_id: str, files: Dict[str, Any], rows: Optional[Dict[str, List[str]]] = None) -> int:
+        """Hängt die Dateien eines Batches an; `files` bildet Member ('input', 'output', 'error') auf Pfade ab,
+        'status' auf den JSON-Text. `rows` ordnet custom_ids die Sheet-IDs zu (Duplikate). Liefert die Zeilenzahl."""
+        rows = rows or {}
+        archive = f"{time.strftime('%Y-%m')}.gz"
+        now = time.time()
+        count = 0
+        with self._lock, open(self.archive_path(archive), "ab") as out, self._conn:
+            for member in MEMBERS:
+                source = files.get(member)
+                if not source:
+                    continue
+                if member == "status":
+                    count += self._append(out, archive, batch_id, member, [source.encode("utf-8")], rows, now)
+                    continue
+                if not os.path.exists(source):
+                    continue
+                with open(source, "rb") as f:
+                    count += self._append(out, archive, batch_id, member, f, rows, now)
+            out.flush()
+            os.fsync(out.fileno())
+        return count
+
+    def _append(self, out, archive: str, batch_id: str, member: str, lines: Iterable[bytes],
+                rows: Dict[str, List[str]], now: float) -> int:
+        count = 0
+        for block in iter_blocks(lines, self.block_bytes):
+            data = gzip.compress(b"".join(block), compresslevel=6)
+            offset = out.tell()
+            out.write(data)
+            block_id = self._conn.execute(
+                "INSERT INTO blocks (archive, offset, length, batch_id, member, archived_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (archive, offset, len(data), batch_id, member, now)
+            ).lastrowid
+            entries = []
+            for line in block:
+                custom_id = custom_id_of(line) if member != "status" else None
+                if custom_id:
+                    entries.extend((job_id, custom_id, block_id) for job_id in rows.get(custom_id) or [custom_id])
+            self._conn.executemany("INSERT INTO entries (job_id, custom_id, block_id) VALUES (?, ?, ?)", entries)
+            count += len(block)
+        return count
+
+    def read_block(self, archive: str, offset: int, length: int) -> List[bytes]:
+        with open(self.archive_path(archive), "rb") as f:
+            f.seek(offset)
+            return gzip.decompress(f.read(length)).splitlines()
+
+    def lookup(self, job_id: str, member: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Alle archivierten Zeilen zu einer Sheet-ID, älteste zuerst (Retries erscheinen als weitere Treffer)."""
+        query = (
+            "SELECT e.custom_id, b.archive, b.offset, b.length, b.batch_id, b.member, b.archived_at "
+            "FROM entries e JOIN blocks b ON b.block_id = e.block_id WHERE e.job_id = ?"
+        )
+        params: Tuple[Any, ...] = (job_id,)
+        if member:
+            query += " AND b.member = ?"
+            params += (member,)
+        with self._lock:
+            hits = self._conn.execute(query + " ORDER BY b.archived_at, b.block_id", params).fetchall()
+
+        results = []
+        for custom_id, archive, offset, length, batch_id, hit_member, archived_at in hits:
+            for line in self.read_block(archive, offset, length):
+                if custom_id_of(line) == custom_id:
+                    results.append({"batch_id": batch_id, "member": hit_member, "archived_at": archived_at,
+                                    "record": loads(line)})
+        return results
+
+    def status(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            hit = self._conn.execute(
+                "SELECT archive, offset, length FROM blocks WHERE batch_id = ? AND member = 'status' "
+                "ORDER BY block_id DESC LIMIT 1", (batch_id,)
+            ).fetchone()
+        return loads(self.read_block(*hit)[0]) if hit else None
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def import_zip_archives(archive: BatchArchive, archive_dir: str = ARCHIVE_DIR) -> int:
+    """Überführt alte <batch_id>.zip-Archive ins neue Format (zeilenweise aus dem Zip gestreamt)."""
+    imported = 0
+    for fname in sorted(os.listdir(archive_dir)):
+        if not fname.endswith(".zip"):
+            continue
+        path = os.path.join(archive_dir, fname)
+        batch_id = fname[:-len(".zip")]
+        with zipfile.ZipFile(path) as zipf, archive._lock, \
+                open(archive.archive_path(f"{time.strftime('%Y-%m')}.gz"), "ab") as out, archive._conn:
+            for name in zipf.namelist():
+                if name.endswith("_status.json"):
+                    member = "status"
+                elif name.endswith("_errors.jsonl"):
+                    member = "error"
+                elif name.endswith(".jsonl"):
+                    member = "output"
+                else:
+                    member = "input"
+                with zipf.open(name) as f:
+                    lines = [f.read().replace(b"\n", b"")] if member == "status" else f
+                    archive._append(out, os.path.basename(out.name), batch_id, member, lines, {}, os.path.getmtime(path))
+        os.remove(path)
+        imported += 1
+    if imported:
+        logger.info(f"📥 {imported} Zip-Archive ins indizierte Archiv übernommen")
+    return imported
+
+
+_archive: Optional[BatchArchive] = None
+_archive_lock = threading.Lock()
+
+
+def get_batch_archive() -> BatchArchive:
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            _archive = BatchArchive()
+        return _archive
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Indiziertes Batch-Archiv")
+    parser.add_argument("job_id", nargs="?", help="Sheet-ID, deren archivierte Requests/Antworten ausgegeben werden")
+    parser.add_argument("--member", choices=MEMBERS[:3], help="Nur Eingabe, Output oder Fehler zeigen")
+    parser.add_argument("--status", metavar="BATCH_ID", help="Archivierten Batch-Status ausgeben")
+    parser.add_argument("--import-zips", action="store_true", help="Alte .zip-Archive einmalig übernehmen")
+    args = parser.parse_args()
+
+    batch_archive = get_batch_archive()
+    if args.import_zips:
+        import_zip_archives(batch_archive)
+    if args.status:
+        print(json.dumps(batch_archive.status(args.status), ensure_ascii=False, indent=2))
+    if args.job_id:
+        hits = batch_archive.lookup(args.job_id, args.member)
+        if not hits:
+            logger.info(f"📭 Keine archivierten Einträge für {args.job_id}")
+        for hit in hits:
+            archived = time.strftime("%Y-%m-%d %H:%M", time.localtime(hit["archived_at"]))
+            print(f"# {hit['batch_id']} [{hit['member']}] archiviert {archived}")
+            print(json.dumps(hit["record"], ensure_ascii=False, indent=2))
@@ -0,0 +1,581 @@
+# benchmark.py
+# Offline-Benchmarks für einzelne Pipeline-Stufen (nutzt fake_services statt echter Dienste)
+
+import os
+import time
+import logging
+import argparse
+import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+import markdown_cache
+from fake_services import FakeHttpServer, FakeClock, FakeOpenAIClient, FakeWorksheet, fake_completion_line
+
+logger = logging.getLogger("benchmark")
+
+
+def report(name: str, count: int, seconds: float, extra: str = "") -> None:
+    rate = count / seconds if seconds else float("inf")
+    print(f"{name:<28} {count:>7} Einheiten  {seconds:>8.3f}s  {rate:>10.1f}/s  {extra}")
+
+
+def use_temp_markdown_cache(tmp_dir: str) -> None:
+    markdown_cache._cache = markdown_cache.MarkdownCache(os.path.join(tmp_dir, "markdown_cache.sqlite"))
+
+
+def reset_fetch_backends(tmp_dir: str, name: str) -> None:
+    """Frische Breaker, frisches Domain-Routing (eigener Zustandsspeicher) und leerer Session-Pool."""
+    import fetch_backends
+    import state_store
+
+    if fetch_backends._pool is not None:
+        fetch_backends._pool.close()
+    state_store._store = state_store.StateStore(os.path.join(tmp_dir, f"state_{name}.sqlite"))
+    fetch_backends._breakers.clear()
+    fetch_backends._router = None
+    fetch_backends._pool = None
+
+
+def bench_fetch(args) -> None:
+    import extract_job_details as ejd
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_fetch_")
+    use_temp_markdown_cache(tmp_dir)
+
+    urls = [f"https://jobs{i % args.hosts}.example.com/stelle/{i}" for i in range(args.rows)]
+    # Blockierte Job-Boards kann Jina nie lesen, dazu einzelne unlesbare Seiten auf allen anderen
+    failing = {url for i, url in enumerate(urls)
+               if i % args.hosts < args.blocked_hosts or (args.fallback_every and i % args.fallback_every == 0)}
+
+    with FakeHttpServer(jina_latency=args.latency, flaresolverr_latency=args.latency * 4, failing_urls=failing,
+                        jina_down=args.jina_down, flaresolverr_cold_start=args.cold_start) as server:
+        ejd.JINA_URL = server.url
+        ejd.FLARESOLVERR_URL = server.url
+
+        if not args.skip_serial:
+            reset_fetch_backends(tmp_dir, "serial")
+            start = time.perf_counter()
+            serial = [ejd.fetch_markdown(url, refresh=True) for url in urls]
+            report("fetch seriell", len(urls), time.perf_counter() - start, f"{dict(server.calls)}")
+            server.calls.clear()
+
+        reset_fetch_backends(tmp_dir, "parallel")
+        start = time.perf_counter()
+        concurrent = ejd.fetch_markdown_many(urls, max_workers=args.workers, refresh=True)
+        report(f"fetch parallel ({args.workers} Worker)", len(urls), time.perf_counter() - start, f"{dict(server.calls)}")
+        server.calls.clear()
+
+        start = time.perf_counter()
+        ejd.fetch_markdown_many(urls, max_workers=args.workers)
+        report("fetch aus Cache", len(urls), time.perf_counter() - start, f"{dict(server.calls)}")
+        reset_fetch_backends(tmp_dir, "done")
+
+        if not args.skip_serial and serial != concurrent:
+            logger.error("❌ Reihenfolge/Inhalt der parallelen Ergebnisse weicht ab")
+
+
+def bench_prompts(args) -> None:
+    from jinja2 import Template
+    from prompt_loader import load_prompt, render_template
+
+    context = {"job_posting_in_markdown": "## Aufgaben\n- Entwickeln\n" * (args.markdown_kb * 50)}
+    name = "user_prompt_template.txt"
+
+    start = time.perf_counter()
+    for _ in range(args.renders):
+        Template(load_prompt(name)).render(context)
+    before = time.perf_counter() - start
+    report("render ohne Registry", args.renders, before, f"{before / args.renders * 1e6:.1f} µs/Render")
+
+    start = time.perf_counter()
+    for _ in range(args.renders):
+        render_template(name, context)
+    after = time.perf_counter() - start
+    report("render mit Registry", args.renders, after, f"{after / args.renders * 1e6:.1f} µs/Render")
+
+
+def check(condition: bool, message: str) -> None:
+    """Prüfung, die auch mit `python -O` greift; ein Fehlschlag beendet den Benchmark mit Exit-Code 1."""
+    if not condition:
+        raise AssertionError(message)
+
+
+def run_poll_scenario(durations: Dict[str, float], requests: int, flaky: Dict[str, int] = None,
+                      missing: List[str] = ()) -> Dict[str, Any]:
+    """Pollt geskriptete Fake-Batches in simulierter Zeit und protokolliert jede Abfrage, das jeweils geplante
+    Intervall und den Abschluss. `flaky` lässt die Abfrage eines Batches jedes n-te Mal fehlschlagen,
+    `missing` sind Batch-IDs, die der Provider nicht kennt (404)."""
+    import openai_batch_poller as poller
+
+    clock = FakeClock()
+    fake = FakeOpenAIClient(clock=clock)
+    for batch_id, duration in durations.items():
+        fake.schedule(batch_id, total=requests, duration=duration)
+    flaky = flaky or {}
+    polls: Dict[str, List[float]] = {batch_id: [] for batch_id in list(durations) + list(missing)}
+    planned: Dict[str, float] = {}  # Batch -> Zeitpunkt der nächsten geplanten Abfrage
+    lateness: List[float] = []
+    finished: Dict[str, List[float]] = {}
+    lost: Dict[str, List[float]] = {}
+    retrieve = fake.batches.retrieve
+
+    def recording_retrieve(batch_id: str):
+        now = clock()
+        if batch_id in planned:
+            lateness.append(now - planned.pop(batch_id))
+        polls[batch_id].append(now)
+        if flaky.get(batch_id) and len(polls[batch_id]) % flaky[batch_id] == 0:
+            # Nach einem Fehler plant der Poller ohne next_interval neu, diese Abfrage wird nicht gemessen
+            raise ConnectionError("geskripteter Abfragefehler")
+        return retrieve(batch_id)
+
+    next_interval = poller.BatchSchedule.next_interval
+
+    def recording_next_interval(schedule, batch, now):
+        interval = next_interval(schedule, batch, now)
+        planned[schedule.batch_id] = now + interval
+        return interval
+
+    fake.batches.retrieve = recording_retrieve
+    poller.BatchSchedule.next_interval = recording_next_interval
+    start = time.perf_counter()
+    try:
+        poller.poll_batches({batch_id: None for batch_id in polls}, batches_client=fake, sleep=clock.sleep,
+                            clock=clock, on_finished=lambda batch, _: finished.setdefault(batch.id, []).append(clock()),
+                            on_lost=lambda batch_id, _, e: lost.setdefault(batch_id, []).append(clock()))
+    finally:
+        poller.BatchSchedule.next_interval = next_interval
+    elapsed = time.perf_counter() - start
+
+    completion = {batch_id: d + fake.validating + fake.finalizing for batch_id, d in durations.items()}
+    return {"polls": polls, "finished": finished, "lost": lost, "completion": completion, "elapsed": elapsed,
+            "calls": fake.calls["batches.retrieve"], "lateness": lateness}
+
+
+def check_poll_scenario(result: Dict[str, Any], max_interval: float) -> None:
+    """Jeder Batch wird genau einmal abgeschlossen, und zwar bei der ersten Abfrage nach seinem geskripteten Ende,
+    also höchstens ein (geplantes) Intervall später; keine Abfrage findet nach ihrem geplanten Zeitpunkt statt."""
+    for batch_id, completed_at in result["completion"].items():
+        finished = result["finished"].get(batch_id, [])
+        check(len(finished) == 1, f"{batch_id} wurde {len(finished)}-mal abgeschlossen")
+        polls = result["polls"][batch_id]
+        check(len(polls) >= 2, f"{batch_id} wurde nur {len(polls)}-mal abgefragt")
+        last, previous = polls[-1], polls[-2]
+        check(finished[0] == last, f"{batch_id} nicht bei der letzten Abfrage abgeschlossen")
+        check(previous < completed_at <= last,
+              f"{batch_id}: Ende {completed_at:.0f}s liegt nicht zwischen den letzten Abfragen {previous:.0f}s/{last:.0f}s")
+        check(last - previous <= max_interval,
+              f"{batch_id}: letztes Intervall {last - previous:.0f}s über POLL_MAX_INTERVAL {max_interval:.0f}s")
+    late = max(result["lateness"], default=0.0)
+    check(late <= 1e-6, f"Abfrage {late:.1f}s nach ihrem geplanten Zeitpunkt")
+
+
+def bench_poll(args) -> None:
+    import openai_batch_poller as poller
+
+    durations = {f"batch_{i:04d}": args.max_hours * 3600 * (i + 1) / args.batches for i in range(args.batches)}
+    result = run_poll_scenario(durations, args.requests)
+    check_poll_scenario(result, poller.POLL_MAX_INTERVAL)
+
+    fixed = sum(int(completed_at // poller.POLL_INTERVAL) + 1 for completed_at in result["completion"].values())
+    delays = [result["finished"][batch_id][0] - completed_at for batch_id, completed_at in result["completion"].items()]
+    report("poll adaptiv (Abfragen)", result["calls"], result["elapsed"],
+           f"fest alle {poller.POLL_INTERVAL:.0f}s: {fixed} Abfragen, max. Verzögerung {max(delays):.0f}s")
+
+    # Ein sehr langsamer Batch, dessen Abfragen zudem regelmäßig fehlschlagen, darf die anderen nicht verzögern
+    slow = dict(durations, batch_slow=24 * 3600)
+    with_slow = run_poll_scenario(slow, args.requests, flaky={"batch_slow": 3})
+    check_poll_scenario(with_slow, poller.POLL_MAX_INTERVAL)
+    for batch_id in durations:
+        check(with_slow["finished"][batch_id] == result["finished"][batch_id],
+              f"{batch_id} wird durch den langsamen Batch verzögert: {with_slow['finished'][batch_id][0]:.0f}s "
+              f"statt {result['finished'][batch_id][0]:.0f}s")
+        check(with_slow["polls"][batch_id] == result["polls"][batch_id], f"{batch_id} wird anders abgefragt")
+    report("poll mit langsamem Batch", with_slow["calls"], with_slow["elapsed"],
+           f"{len(durations)} Batches unverändert abgeschlossen, alle Prüfungen bestanden")
+
+    # Ein gelöschter Batch (404) wird nach einer Abfrage aufgegeben, einer, dessen Abfragen immer scheitern,
+    # nach POLL_MAX_ERRORS; der Poller endet, und die übrigen Batches laufen unverändert
+    broken = dict(durations, batch_down=24 * 3600)
+    with_broken = run_poll_scenario(broken, args.requests, flaky={"batch_down": 1}, missing=["batch_deleted"])
+    check(with_broken["lost"] == {"batch_deleted": [0.0]}, f"404 nicht sofort aufgegeben: {with_broken['lost']}")
+    check(len(with_broken["polls"]["batch_deleted"]) == 1, "Gelöschter Batch wurde mehrfach abgefragt")
+    check(len(with_broken["polls"]["batch_down"]) == poller.POLL_MAX_ERRORS,
+          f"Dauerhaft fehlschlagender Batch {len(with_broken['polls']['batch_down'])}-mal statt "
+          f"{poller.POLL_MAX_ERRORS}-mal abgefragt")
+    check("batch_down" not in with_broken["finished"], "Dauerhaft fehlschlagender Batch wurde abgeschlossen")
+    del with_broken["completion"]["batch_down"]
+    check_poll_scenario(with_broken, poller.POLL_MAX_INTERVAL)
+    for batch_id in durations:
+        check(with_broken["polls"][batch_id] == result["polls"][batch_id], f"{batch_id} wird anders abgefragt")
+    report("poll mit defekten Batches", with_broken["calls"], with_broken["elapsed"],
+           f"404 nach 1, Dauerfehler nach {poller.POLL_MAX_ERRORS} Abfragen aufgegeben, alle Prüfungen bestanden")
+
+
+def write_synthetic_output(path: str, lines: int) -> None:
+    """Batch-Output mit überwiegend reinen JSON-Antworten, dazu Codeblöcke, Nachtext und abgeschnittene Antworten."""
+    import json
+
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(lines):
+            entry = fake_completion_line(f"10001-{i:010d}-S", i)
+            message = entry["response"]["body"]["choices"][0]["message"]
+            if i % 10 == 1:
+                message["content"] = f"```json\n{message['content']}\n```"
+            elif i % 10 == 2:
+                message["content"] = f"Hier ist das Ergebnis:\n{message['content']}\nViel Erfolg!"
+            elif i % 50 == 3:
+                message["content"] = message["content"][:-40]
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def bench_parse(args) -> None:
+    import re
+    import json
+    from collections import Counter
+    import result_parser
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_parse_")
+    path = os.path.join(tmp_dir, "output.jsonl")
+    write_synthetic_output(path, args.lines)
+
+    # Bisheriges Verfahren: json.loads pro Zeile und Regex über jede Antwort
+    start = time.perf_counter()
+    parsed = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            content = json.loads(line)["response"]["body"]["choices"][0]["message"]["content"]
+            match = re.search(r"```(?:json)?\n(.*?)\n```", content, re.DOTALL)
+            try:
+                parsed += bool(json.loads((match.group(1) if match else content).strip()))
+            except Exception:
+                pass
+    report("parse alt (Regex)", args.lines, time.perf_counter() - start, f"{parsed} verwertbar")
+
+    start = time.perf_counter()
+    failures: Counter = Counter()
+    parsed = 0
+    for entry in result_parser.iter_jsonl(path, failures):
+        content = entry["response"]["body"]["choices"][0]["message"]["content"]
+        parsed += bool(result_parser.parse_response_content(content, failures))
+    report(f"parse neu ({result_parser.JSON_BACKEND})", args.lines, time.perf_counter() - start,
+           f"{parsed} verwertbar, Fehler: {dict(failures)}")
+
+
+def bench_sync(args) -> None:
+    import json
+    import asyncio
+    from openai import AsyncOpenAI
+    import openai_sync_runner
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_sync_")
+    input_path = os.path.join(tmp_dir, "input.json")
+    output_path = os.path.join(tmp_dir, "output.jsonl")
+    with open(input_path, "w", encoding="utf-8") as f:
+        for i in range(args.requests):
+            body = {"model": "gpt-4o", "messages": [{"role": "user", "content": f"Stelle {i}"}]}
+            f.write(json.dumps({"custom_id": f"job-{i}", "method": "POST", "url": "/v1/chat/completions", "body": body}) + "\n")
+
+    with FakeHttpServer(chat_latency=args.latency, rate_limit_every=args.rate_limit_every) as server:
+        client = AsyncOpenAI(api_key="sk-bench", base_url=f"{server.url}/v1", max_retries=0)
+        start = time.perf_counter()
+        written = asyncio.run(openai_sync_runner.run_requests(
+            input_path, output_path, client, max_concurrency=args.concurrency, requests_per_minute=args.rpm
+        ))
+        elapsed = time.perf_counter() - start
+
+    with open(output_path, "r", encoding="utf-8") as f:
+        ok = sum(1 for line in f if json.loads(line)["error"] is None)
+    report(f"sync ({args.concurrency} parallel)", written, elapsed, f"{ok} ok, Server: {dict(server.calls)}")
+
+
+def load_html_corpus(args) -> List[str]:
+    """Gespeicherte Seiten aus --dir (*.html), sonst synthetische Job-Board-Seiten, jede zweite mit JSON-LD."""
+    from fake_services import fake_job_page
+
+    if args.dir:
+        pages = []
+        for fname in sorted(os.listdir(args.dir)):
+            if fname.endswith((".html", ".htm")):
+                with open(os.path.join(args.dir, fname), "r", encoding="utf-8", errors="replace") as f:
+                    pages.append(f.read())
+        return pages
+    return [fake_job_page(f"Stelle {i}", with_jsonld=i % 2 == 0, script_kb=20 + (i % 5) * 40) for i in range(args.pages)]
+
+
+def bench_html(args) -> None:
+    import html_to_markdown
+
+    pages = load_html_corpus(args)
+    if not pages:
+        logger.error("❌ Keine Seiten gefunden")
+        return
+    html_bytes = sum(len(page) for page in pages)
+
+    try:
+        from markdownify import markdownify
+    except ImportError:
+        print("markdownify nicht installiert, Vergleich übersprungen")
+    else:
+        start = time.perf_counter()
+        size = sum(len(markdownify(page)) for page in pages)
+        elapsed = time.perf_counter() - start
+        report("markdownify (ganze Seite)", len(pages), elapsed, f"{html_bytes / elapsed / 1e6:.1f} MB/s, Ø {size // len(pages)} Zeichen")
+
+    start = time.perf_counter()
+    results = [html_to_markdown.extract_markdown(page) for page in pages]
+    elapsed = time.perf_counter() - start
+    methods = Counter(method for _, method in results)
+    size = sum(len(markdown) for markdown, _ in results)
+    report("Extraktion + Umwandlung", len(pages), elapsed,
+           f"{html_bytes / elapsed / 1e6:.1f} MB/s, Ø {size // len(pages)} Zeichen, {dict(methods)}")
+
+    if args.workers:
+        html_to_markdown.CONVERT_WORKERS = args.workers
+        html_to_markdown.convert_page(pages[0])  # Pool starten, nicht mitmessen
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(html_to_markdown.convert_page, pages))
+        report(f"über Prozesspool ({args.workers})", len(pages), time.perf_counter() - start, "aus 8 Fetch-Threads")
+
+
+def parse_importtime(stderr: str) -> Dict[str, int]:
+    """Kumulierte Importzeit (µs) je Top-Level-Modul aus der Ausgabe von `python -X importtime`."""
+    totals: Dict[str, int] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith("  "):
+            totals[name.strip()] = int(cumulative)
+    return totals
+
+
+def bench_startup(args) -> None:
+    import sys
+    import subprocess
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, STATE_DB_PATH=os.path.join(tempfile.mkdtemp(prefix="bench_startup_"), "state.sqlite"))
+    stages = {"poll": "openai_batch_poller", "fetch": "openai_batch_fetcher", "apply": "openai_batch_results",
+              "archive": "openai_batch_results", "submit": "openai_batch_submitter"}
+
+    for command, module in stages.items():
+        for label, cmd in ((f"import {module}", ["-c", f"import {module}"]), (f"pipeline.py {command}", ["pipeline.py", command])):
+            best, imports = float("inf"), {}
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                proc = subprocess.run([sys.executable, "-X", "importtime", *cmd], cwd=here, env=env,
+                                      capture_output=True, text=True)
+                best = min(best, time.perf_counter() - start)
+                imports = parse_importtime(proc.stderr)
+            heaviest = sorted(imports.items(), key=lambda item: -item[1])[:3]
+            top = ", ".join(f"{name} {us / 1000:.0f}ms" for name, us in heaviest)
+            report(label, 1, best, f"Importe {sum(imports.values()) / 1000:.0f}ms ({top})")
+
+
+def build_fake_sheet(rows: int, hosts: int, markdown_share: float, **sheet_options) -> FakeWorksheet:
+    """Sheet mit `rows` neuen Zeilen; ein Anteil `markdown_share` hat sein Markdown schon in der Zelle."""
+    import extract_job_details as ejd
+    import openai_batch_results as results
+
+    fields = list(dict.fromkeys(list(ejd.FIELD_MAPPING.values()) + list(results.FIELD_MAPPING.values())))
+    header = ["id", "Status", "Source", "markdown"] + [name for name in fields if name not in ("id", "Status", "Source", "markdown")]
+    with_markdown = int(rows * markdown_share)
+    values = []
+    for i in range(rows):
+        url = f"https://jobs{i % hosts}.example.com/stelle/{i}"
+        markdown = f"# Stelle {i}\n\nAufgaben:\n- Entwickeln\n- Testen\n" if i < with_markdown else ""
+        values.append([f"10001-{i:010d}-S", "neu", url, markdown])
+    return FakeWorksheet(header, values, **sheet_options)
+
+
+def api_call_counts(sheet: FakeWorksheet, server: FakeHttpServer, client: FakeOpenAIClient) -> Counter:
+    counts = Counter({f"sheets.{op}": n for op, n in sheet.calls.items()})
+    counts.update({f"http.{backend}": n for backend, n in server.calls.items()})
+    counts.update({f"openai.{op}": n for op, n in client.calls.items()})
+    return counts
+
+
+def run_stage(results: List[Dict[str, Any]], stage: str, rows: int, calls: Callable[[], Counter],
+              fn: Callable, *args, **kwargs) -> Any:
+    """Führt eine Stufe aus und hält Laufzeit, Speicherspitze (tracemalloc) und API-Aufrufe fest."""
+    import tracemalloc
+
+    before = calls()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    value = fn(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    made = calls() - before
+    results.append({"stage": stage, "rows": rows, "seconds": round(seconds, 4),
+                    "rows_per_second": round(rows / seconds, 1) if seconds else None,
+                    "peak_mb": round(peak / 1024 / 1024, 2), "api_calls": sum(made.values()), "calls": dict(made)})
+    report(f"{stage} ({rows} Zeilen)", rows, seconds, f"Peak {peak / 1024 / 1024:.1f} MB, {sum(made.values())} Aufrufe {dict(made)}")
+    return value
+
+
+def run_e2e(rows: int, args) -> List[Dict[str, Any]]:
+    """Ein kompletter Durchlauf extract → submit → poll → fetch → apply gegen Attrappen in einem frischen Verzeichnis."""
+    import batch_archive
+    import openai_client
+    import extract_job_details as ejd
+    import openai_batch_submitter as submitter
+    import openai_batch_poller as poller
+    import openai_batch_fetcher as fetcher
+    import openai_batch_results as results_stage
+    from token_scheduler import get_scheduler
+    from metrics import metrics
+
+    tmp_dir = tempfile.mkdtemp(prefix=f"bench_e2e_{rows}_")
+    os.chdir(tmp_dir)  # batches/ ist relativ zum Arbeitsverzeichnis
+    batch_archive._archive = batch_archive.BatchArchive(os.path.join(tmp_dir, "archive"), os.path.join(tmp_dir, "archive.sqlite"))
+    use_temp_markdown_cache(tmp_dir)
+    reset_fetch_backends(tmp_dir, "e2e")
+    metrics.reset()
+
+    clock = FakeClock()
+    client = FakeOpenAIClient(clock=clock, default_duration=args.batch_minutes * 60)
+    openai_client._client = client
+    sheet = build_fake_sheet(rows, args.hosts, args.markdown_share, latency=args.sheet_latency,
+                             quota_per_minute=args.sheet_quota)
+    ejd.init_gsheet = results_stage.init_gsheet = lambda: sheet
+    ejd.MAX_ROWS = rows
+    ejd.MAX_BATCH_REQUESTS = args.shard_requests
+
+    captured: Dict[str, Any] = {}
+
+    def capture_submit(shards, **kwargs):
+        captured.update(shards=shards, **kwargs)
+        return []
+
+    def submit_and_claim() -> List[str]:
+        return submitter.submit_shards(captured.pop("shards"), **captured)
+
+    # Einige Stufen bringen eigene Handler/Level mit; Einzelzeilen-Logs würden die Messung dominieren
+    for name in ("extract_job_details", "openai_batch_submitter", "openai_batch_poller", "openai_batch_fetcher",
+                 "openai_batch_results", "token_scheduler", "batch_archive", "markdown_cleaner"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    stats: List[Dict[str, Any]] = []
+    with FakeHttpServer(jina_latency=args.latency, flaresolverr_latency=args.latency * 4) as server:
+        ejd.JINA_URL = ejd.FLARESOLVERR_URL = server.url
+        calls = lambda: api_call_counts(sheet, server, client)
+
+        ejd.submit_shards = capture_submit
+        try:
+            run_stage(stats, "extract", rows, calls, ejd.process, dry_run=False, mode="batch")
+        finally:
+            ejd.submit_shards = submitter.submit_shards
+        if not captured:
+            logger.error("❌ extract hat keine Requests erzeugt")
+            return stats
+        run_stage(stats, "submit", rows, calls, submit_and_claim)
+        run_stage(stats, "poll", rows, calls, poller.poll_batches, poller.list_submitted_batches(), batches_client=client,
+                  sleep=clock.sleep, clock=clock, refill=get_scheduler().release)
+        run_stage(stats, "fetch", rows, calls, fetcher.fetch_all, files_client=client)
+        run_stage(stats, "apply", rows, calls, results_stage.apply_all)
+
+    status_col = sheet.values[0].index("Status")
+    reviewed = sum(1 for line in sheet.values[1:] if len(line) > status_col and line[status_col] == "AI reviewed")
+    total = sum(stage["seconds"] for stage in stats)
+    report(f"gesamt ({rows} Zeilen)", rows, total,
+           f"{reviewed} Zeilen 'AI reviewed', Sheets-Quota-Wartezeit {sheet.quota_wait:.0f}s, "
+           f"simulierte Batch-Zeit {clock() / 3600:.1f}h")
+    if reviewed != rows:
+        logger.error(f"❌ Nur {reviewed} von {rows} Zeilen wurden übernommen")
+    stats.append({"stage": "total", "rows": rows, "seconds": round(total, 4), "reviewed": reviewed,
+                  "sheet_quota_wait_seconds": round(sheet.quota_wait, 1)})
+    return stats
+
+
+def bench_e2e(args) -> None:
+    import json
+    import tracemalloc
+
+    cwd = os.getcwd()
+    tracemalloc.start()
+    all_stats = []
+    try:
+        for rows in args.rows:
+            all_stats.extend(run_e2e(rows, args))
+    finally:
+        tracemalloc.stop()
+        os.chdir(cwd)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(all_stats, f, indent=2)
+        print(f"Ergebnisse gespeichert: {args.json}")
+
+
+BENCHMARKS: Dict[str, Callable] = {
+    "fetch": bench_fetch,
+    "prompts": bench_prompts,
+    "poll": bench_poll,
+    "parse": bench_parse,
+    "sync": bench_sync,
+    "startup": bench_startup,
+    "e2e": bench_e2e,
+    "html": bench_html,
+}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Offline-Benchmarks der Pipeline")
+    sub = parser.add_subparsers(dest="benchmark", required=True)
+
+    p_fetch = sub.add_parser("fetch", help="Markdown-Abruf gegen lokalen Jina/FlareSolverr-Ersatz")
+    p_fetch.add_argument("--rows", type=int, default=200)
+    p_fetch.add_argument("--hosts", type=int, default=10, help="Anzahl unterschiedlicher Job-Boards")
+    p_fetch.add_argument("--workers", type=int, default=8)
+    p_fetch.add_argument("--latency", type=float, default=0.05, help="Simulierte Jina-Latenz in Sekunden")
+    p_fetch.add_argument("--fallback-every", type=int, default=10, help="Jede n-te URL scheitert bei Jina (0 = nie)")
+    p_fetch.add_argument("--blocked-hosts", type=int, default=2, help="Job-Boards, die Jina nie lesen kann")
+    p_fetch.add_argument("--jina-down", action="store_true", help="Jina antwortet durchgehend mit 503")
+    p_fetch.add_argument("--cold-start", type=float, default=0.5, help="Browserstart in FlareSolverr in Sekunden")
+    p_fetch.add_argument("--skip-serial", action="store_true")
+
+    p_prompts = sub.add_parser("prompts", help="Kosten pro Prompt-Render vorher/nachher")
+    p_prompts.add_argument("--renders", type=int, default=2000)
+    p_prompts.add_argument("--markdown-kb", type=int, default=10, help="Ungefähre Markdown-Größe pro Render")
+
+    p_poll = sub.add_parser("poll", help="Adaptiver Poller gegen geskriptete Fake-Batches (simulierte Zeit)")
+    p_poll.add_argument("--batches", type=int, default=5)
+    p_poll.add_argument("--requests", type=int, default=1000, help="Requests pro Batch")
+    p_poll.add_argument("--max-hours", type=float, default=20, help="Laufzeit des langsamsten Batches")
+
+    p_parse = sub.add_parser("parse", help="Zeilen/s beim Parsen einer synthetischen Batch-Output-Datei")
+    p_parse.add_argument("--lines", type=int, default=50000)
+
+    p_sync = sub.add_parser("sync", help="Direktmodus gegen lokalen Chat-Completions-Ersatz")
+    p_sync.add_argument("--requests", type=int, default=100)
+    p_sync.add_argument("--concurrency", type=int, default=8)
+    p_sync.add_argument("--rpm", type=float, default=6000, help="Token-Bucket: Requests pro Minute")
+    p_sync.add_argument("--latency", type=float, default=0.2, help="Simulierte Antwortzeit in Sekunden")
+    p_sync.add_argument("--rate-limit-every", type=int, default=15, help="Jede n-te Anfrage liefert 429 (0 = nie)")
+
+    p_startup = sub.add_parser("startup", help="Startzeit der Stufen ohne Arbeit (python -X importtime)")
+    p_startup.add_argument("--repeat", type=int, default=3, help="Bester von n Läufen")
+
+    p_e2e = sub.add_parser("e2e", help="Alle Stufen gegen Attrappen: Durchsatz, Laufzeit, Speicherspitze, API-Aufrufe")
+    p_e2e.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000])
+    p_e2e.add_argument("--hosts", type=int, default=20, help="Anzahl unterschiedlicher Job-Boards")
+    p_e2e.add_argument("--markdown-share", type=float, default=0.5, help="Anteil der Zeilen mit Markdown im Sheet")
+    p_e2e.add_argument("--latency", type=float, default=0.01, help="Simulierte Jina-Latenz in Sekunden")
+    p_e2e.add_argument("--sheet-latency", type=float, default=0.05, help="Latenz pro Sheets-Aufruf in Sekunden")
+    p_e2e.add_argument("--sheet-quota", type=int, default=60, help="Sheets-Aufrufe pro Minute (0 = unbegrenzt)")
+    p_e2e.add_argument("--shard-requests", type=int, default=2500, help="Requests pro Batch-Shard")
+    p_e2e.add_argument("--batch-minutes", type=float, default=30, help="Simulierte Laufzeit pro Batch")
+    p_e2e.add_argument("--json", type=str, help="Ergebnisse zusätzlich als JSON speichern")
+
+    p_html = sub.add_parser("html", help="HTML→Markdown: markdownify gegen Hauptinhalt-Extraktion")
+    p_html.add_argument("--dir", type=str, help="Verzeichnis mit gespeicherten Seiten (*.html)")
+    p_html.add_argument("--pages", type=int, default=200, help="Anzahl synthetischer Seiten ohne --dir")
+    p_html.add_argument("--workers", type=int, default=2, help="Prozesse für den Pool-Lauf (0 = überspringen)")
+
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
@@ -4,18 +4,33 @@ import sys
 import time
 import json
 import logging
-from typing import Dict, Any, List
-from prompt_loader import load_prompt, render_prompt
+import threading
+from collections import deque
+from queue import Queue, Full
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+from prompt_loader import render_template
 
 import requests
+from requests.adapters import HTTPAdapter
 import gspread
 from dotenv import load_dotenv
-from markdownify import markdownify as md
 from oauth2client.service_account import ServiceAccountCredentials
 from gspread import Worksheet
+from gspread.utils import rowcol_to_a1
 
+import metrics
 from logger_config import setup_logger
-from openai_batch_submitter import submit_batch
+from markdown_cache import get_markdown_cache, normalize_url, content_hash
+from markdown_cleaner import BoilerplateStripper, domain_of
+from html_to_markdown import convert_page
+from fetch_backends import (get_breaker, get_domain_router, get_flaresolverr_pool, is_service_failure,
+                            retry_after_seconds, FLARESOLVERR_CONCURRENCY, FLARESOLVERR_SESSION_TTL_MINUTES)
+from openai_batch_submitter import (build_system_prompt, render_request_lines, write_line_shards, submit_shards,
+                                    MAX_BATCH_REQUESTS, MAX_BATCH_BYTES)
+from state_store import get_state_store, claim_key, watermark_key as scan_watermark_key, CLAIM_PREFIX
 
 # === Load Environment Variables ===
 load_dotenv()
@@ -24,8 +39,29 @@ load_dotenv()
 GOOGLE_SHEET_ID = os.getenv("GOOGLE_SHEET_ID")
 SHEET_NAME = os.getenv("SHEET_NAME", "JOB_COLLECTOR")
 FLARESOLVERR_URL = os.getenv("FLARESOLVERR_URL", "http://localhost:8191")
+JINA_URL = os.getenv("JINA_URL", "https://r.jina.ai")
 GOOGLE_SERVICE_ACCOUNT_FILE = os.getenv("GOOGLE_SERVICE_ACCOUNT_FILE")
 MAX_ROWS = int(os.getenv("MAX_ROWS", 999))
+MARKDOWN_CELLS_PER_CALL = int(os.getenv("MARKDOWN_CELLS_PER_CALL", 200))
+# Claims ohne Ergebnis werden nach dieser Zeit wieder auf "neu" gesetzt (Batch-Fenster: 24h)
+CLAIM_TTL_HOURS = float(os.getenv("CLAIM_TTL_HOURS", 26))
+
+# === Fetch Concurrency ===
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", 8))
+FETCH_PER_HOST_LIMIT = int(os.getenv("FETCH_PER_HOST_LIMIT", 2))
+JINA_TIMEOUT = float(os.getenv("JINA_TIMEOUT", 10))
+FLARESOLVERR_MAX_TIMEOUT_MS = int(os.getenv("FLARESOLVERR_MAX_TIMEOUT_MS", 180000))
+
+# === Streaming-Pipeline (Zeilen → Fetch → Bereinigen → Rendern → JSONL) ===
+# Zeilen, deren Markdown gemeinsam gelesen bzw. geladen wird; Dokumente zwischen zwei Stufen;
+# Dokumente, die die Boilerplate-Erkennung vorausschaut, bevor ein Dokument bereinigt wird
+PIPELINE_WINDOW_ROWS = int(os.getenv("PIPELINE_WINDOW_ROWS", MARKDOWN_CELLS_PER_CALL))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 100))
+PIPELINE_LOOKAHEAD_DOCS = int(os.getenv("PIPELINE_LOOKAHEAD_DOCS", 200))
+# Nach so vielen geschriebenen Requests wird der Stand gesichert (ein abgebrochener Lauf setzt dort fort)
+PIPELINE_CHECKPOINT_ROWS = int(os.getenv("PIPELINE_CHECKPOINT_ROWS", 200))
+# Weitere Zeilen einer schon vergebenen Sheet-ID bekommen keinen eigenen Request, nur diesen Status
+DUPLICATE_ID_STATUS = "duplicate id"
 
 # Field mapping from GPT output to Google Sheet columns
 FIELD_MAPPING = {
@@ -58,65 +94,475 @@ def init_gsheet() -> Worksheet:
     gclient = gspread.authorize(creds)
     return gclient.open_by_key(GOOGLE_SHEET_ID).worksheet(SHEET_NAME)
 
-def fetch_markdown(source_url: str) -> str:
-    try:
-        url = f"https://r.jina.ai/{source_url}"
-        response = requests.get(url, headers={"X-Retain-Images": "none", "User-Agent": "Mozilla/5.0"}, timeout=10)
-        response.raise_for_status()
-        logger.debug(f"Fetched markdown from r.jina.ai for URL: {source_url}")
-        return response.text
-    except Exception as e:
-        logger.warning(f"r.jina.ai failed for {source_url}, trying FlareSolverr: {e}")
+# === HTTP Sessions & Limits ===
+_thread_local = threading.local()
+_host_limits: Dict[str, threading.BoundedSemaphore] = {}
+_host_limits_lock = threading.Lock()
+
+def get_http_session() -> requests.Session:
+    """Keep-Alive-Session pro Worker-Thread (requests.Session ist nicht threadsicher)."""
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(FETCH_PER_HOST_LIMIT, FLARESOLVERR_CONCURRENCY))
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _thread_local.session = session
+    return session
+
+def host_limit(source_url: str) -> threading.BoundedSemaphore:
+    host = urlsplit(source_url).hostname or ""
+    with _host_limits_lock:
+        if host not in _host_limits:
+            _host_limits[host] = threading.BoundedSemaphore(FETCH_PER_HOST_LIMIT)
+        return _host_limits[host]
+
+def fetch_from_jina(session: requests.Session, source_url: str) -> str:
+    with host_limit(source_url):
+        response = session.get(f"{JINA_URL}/{source_url}", headers={"X-Retain-Images": "none", "User-Agent": "Mozilla/5.0"},
+                               timeout=JINA_TIMEOUT)
+    response.raise_for_status()
+    if not response.text.strip():
+        raise ValueError("leere Antwort")
+    return response.text
+
+def fetch_from_flaresolverr(session: requests.Session, source_url: str) -> str:
+    """Lädt die Seite in einer wiederverwendeten Browser-Session der Domain (kein Kaltstart pro Stelle)."""
+    with get_flaresolverr_pool().session(session, FLARESOLVERR_URL, domain_of(source_url)) as browser:
+        payload = {"cmd": "request.get", "url": source_url, "maxTimeout": FLARESOLVERR_MAX_TIMEOUT_MS,
+                   "session": browser, "session_ttl_minutes": FLARESOLVERR_SESSION_TTL_MINUTES}
+        resp = session.post(f"{FLARESOLVERR_URL}/v1", json=payload, headers={"Content-Type": "application/json"},
+                            timeout=FLARESOLVERR_MAX_TIMEOUT_MS / 1000 + 10)
+        resp.raise_for_status()
+    page_html = resp.json().get("solution", {}).get("response", "")
+    # Hauptinhalt extrahieren und umwandeln (in einem Worker-Prozess, nicht im Fetch-Thread)
+    with metrics.timer("html_convert_seconds"):
+        markdown, method = convert_page(page_html)
+    metrics.inc("html_extract_total", method=method)
+    metrics.inc("html_bytes_total", len(page_html))
+    if not markdown.strip():
+        raise ValueError("leere Seite")
+    return markdown
+
+BACKENDS = {"jina": fetch_from_jina, "flaresolverr": fetch_from_flaresolverr}
+
+def download_markdown(source_url: str) -> Tuple[str, str]:
+    """Lädt Markdown ohne Cache; liefert (Inhalt, Backend) mit Backend 'jina', 'flaresolverr' oder ''.
+
+    Die Reihenfolge der Backends kommt vom Domain-Routing; Backends mit offenem Circuit Breaker werden
+    übersprungen, statt bei jeder Zeile erneut in den Timeout zu laufen."""
+    session = get_http_session()
+    domain = domain_of(source_url)
+    router = get_domain_router()
+    jina_failed = False  # Jina hat geantwortet, nur diese Seite ging nicht (Grundlage fürs Routing)
+    jina_tried = False   # Jina wurde für diese URL versucht und ist gescheitert (egal woran)
+    for backend in router.route(domain):
+        breaker = get_breaker(backend)
+        if not breaker.allow():
+            metrics.inc("markdown_breaker_skips_total", backend=backend)
+            continue
         try:
-            payload = {"cmd": "request.get", "url": source_url, "maxTimeout": 180000}
-            resp = requests.post(f"{FLARESOLVERR_URL}/v1", json=payload, headers={"Content-Type": "application/json"}, timeout=120)
-            resp.raise_for_status()
-            return md(resp.json().get("solution", {}).get("response", ""))
-        except Exception as fe:
-            logger.error(f"Both markdown sources failed for {source_url}: {fe}")
-            return ""
-
-def get_relevant_rows(sheet: Worksheet) -> List[Dict[str, Any]]:
-    all_rows = sheet.get_all_records()
-    logger.info(f"🟡 {len(all_rows)} Zeilen im Sheet geladen.")
-    return [
-        {"row_index": idx, "data": row}
-        for idx, row in enumerate(all_rows)
-        if row.get("Status") == "neu"
-    ]
-
-def process(dry_run: bool = True):
-    sheet = init_gsheet()
-    rows = get_relevant_rows(sheet)
-    batch_items = []
-    processed_count = 0
+            markdown = BACKENDS[backend](session, source_url)
+        except Exception as e:
+            if is_service_failure(e):
+                breaker.record_failure(retry_after_seconds(e))
+            else:
+                breaker.record_success()  # Dienst hat geantwortet, nur diese Seite ging nicht
+                jina_failed = jina_failed or backend == "jina"
+            jina_tried = jina_tried or backend == "jina"
+            logger.warning(f"{backend} failed for {source_url}: {e}")
+            continue
+        breaker.record_success()
+        if backend == "jina":
+            router.note_success(domain)
+        elif jina_failed:
+            router.note_fallback(domain)
+        if backend == "flaresolverr" and jina_tried:
+            # Fallback-Rate = markdown_fallback_total / markdown_fetch_total ohne Cache
+            metrics.inc("markdown_fallback_total")
+        logger.debug(f"Fetched markdown from {backend} for URL: {source_url}")
+        return markdown, backend
+
+    logger.error(f"Both markdown sources failed or are paused for {source_url}")
+    metrics.inc("markdown_failures_total")
+    return "", ""
+
+def fetch_markdown(source_url: str, refresh: bool = False) -> str:
+    """Liefert Markdown aus dem lokalen Cache; bei Fehltreffer oder `refresh` wird neu geladen."""
+    cache = get_markdown_cache()
+    if not refresh:
+        cached = cache.get(source_url)
+        if cached:
+            logger.debug(f"Markdown-Cache-Treffer ({cached['backend']}) für URL: {source_url}")
+            metrics.inc("markdown_fetch_total", backend="cache")
+            return cached["content"]
+
+    with metrics.timer("markdown_fetch_seconds") as labels:
+        markdown, backend = download_markdown(source_url)
+        labels["backend"] = backend or "failed"
+    metrics.inc("markdown_fetch_total", backend=backend or "failed")
+    metrics.inc("markdown_bytes_total", len(markdown.encode("utf-8")), backend=backend or "failed")
+    if markdown.strip():
+        cache.put(source_url, markdown, backend)
+    return markdown
 
-    for item in rows:
-        if processed_count >= MAX_ROWS:
-            break
+def fetch_markdown_many(source_urls: List[str], max_workers: int = FETCH_WORKERS, refresh: bool = False) -> List[str]:
+    """Lädt mehrere URLs parallel; die Ergebnisliste hat dieselbe Reihenfolge wie die Eingabe."""
+    if not source_urls:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(source_urls)))) as executor:
+        return list(executor.map(partial(fetch_markdown, refresh=refresh), source_urls))
 
-        idx = item["row_index"]
-        row = item["data"]
-        job_id = row["id"]
-        logger.info(f"🔄 Vorbereitung ID: {job_id}")
+def get_header_map(sheet: Worksheet) -> Dict[str, int]:
+    header = sheet.row_values(1)
+    return {name: idx + 1 for idx, name in enumerate(header) if name}
 
-        markdown = row.get("markdown", "").strip() or fetch_markdown(row.get("Source", ""))
+def column_range(col: int, start_row: int) -> str:
+    """Offener A1-Bereich einer Spalte ab `start_row`, z. B. 'C2:C'."""
+    letter = rowcol_to_a1(1, col)[:-1]
+    return f"{letter}{start_row}:{letter}"
 
-        if not markdown:
-            logger.warning(f"⚠️ Kein Markdown für {job_id}, übersprungen.")
+def watermark_key() -> str:
+    return scan_watermark_key(GOOGLE_SHEET_ID, SHEET_NAME)
+
+def get_relevant_rows(sheet: Worksheet, header_map: Dict[str, int], full_scan: bool = False) -> List[Dict[str, Any]]:
+    """Liest nur id/Status/Source ab dem gespeicherten Wasserzeichen und liefert die Zeilen mit Status 'neu'.
+
+    Das Wasserzeichen ist die erste Zeile, die beim letzten Lauf noch 'neu' war (bzw. das Ende des Sheets);
+    alle Zeilen davor waren bereits bearbeitet und werden nicht erneut gelesen.
+    """
+    store = get_state_store()
+    start_row = 2 if full_scan else int(store.get_setting(watermark_key(), 2))
+    columns = ["id", "Status", "Source"]
+    missing = [col for col in columns if col not in header_map]
+    if missing:
+        raise ValueError(f"Spalten fehlen im Sheet: {', '.join(missing)}")
+    # Hinter der letzten Rasterzeile lehnt die API auch offene Bereiche ab ("exceeds grid limits")
+    if start_row > sheet.row_count:
+        logger.info(f"🟡 Keine neuen Zeilen ab Zeile {start_row} (Sheet hat {sheet.row_count} Zeilen).")
+        return []
+
+    ranges = [column_range(header_map[col], start_row) for col in columns]
+    id_values, status_values, source_values = sheet.batch_get(ranges)
+    scanned = max(len(id_values), len(status_values), len(source_values))
+    logger.info(f"🟡 {scanned} Zeilen ab Zeile {start_row} gelesen (id/Status/Source).")
+
+    def cell(values: List[List[Any]], i: int) -> Any:
+        return values[i][0] if i < len(values) and values[i] else ""
+
+    rows = []
+    for i in range(scanned):
+        if cell(status_values, i) != "neu":
             continue
-        user_prompt_template = load_prompt('user_prompt_template.txt')
-        context = {'job_posting_in_markdown': markdown}
-        user_prompt = render_prompt(user_prompt_template, context)
+        rows.append({
+            "row_index": start_row - 2 + i,
+            "data": {"id": cell(id_values, i), "Status": "neu", "Source": cell(source_values, i)},
+        })
+
+    store.set_setting(watermark_key(), rows[0]["row_index"] + 2 if rows else start_row + scanned)
+    return rows
+
+def load_markdown_cells(sheet: Worksheet, header_map: Dict[str, int], rows: List[Dict[str, Any]]) -> None:
+    """Holt die markdown-Zellen nur für die ausgewählten Zeilen (gebündelt in wenige batch_get-Aufrufe)."""
+    col = header_map.get("markdown")
+    if not col or not rows:
+        return
+    for start in range(0, len(rows), MARKDOWN_CELLS_PER_CALL):
+        chunk = rows[start:start + MARKDOWN_CELLS_PER_CALL]
+        values = sheet.batch_get([rowcol_to_a1(row["row_index"] + 2, col) for row in chunk])
+        for row, value in zip(chunk, values):
+            row["data"]["markdown"] = value[0][0] if value and value[0] else ""
+
+def status_updates(header_map: Dict[str, int], row_indices: List[int], status: str) -> List[Dict[str, Any]]:
+    col = header_map["Status"]
+    return [{"range": rowcol_to_a1(idx + 2, col), "values": [[status]]} for idx in row_indices]
+
+def claim_rows(sheet: Worksheet, header_map: Dict[str, int], shard_ids: List[str]) -> None:
+    """Setzt alle Zeilen der gestarteten oder eingereihten Shards in einem Schreibaufruf auf
+    'in_batch:<batch_id>' (bzw. 'in_batch:<shard_id>', solange der Shard noch wartet oder direkt gesendet wird)."""
+    store = get_state_store()
+    updates = []
+    for shard_id in shard_ids:
+        record = store.get(shard_id)
+        if record:
+            indices = list(store.row_indices(shard_id).values())
+            updates.extend(status_updates(header_map, indices, claim_key(record)))
+    if updates:
+        sheet.batch_update(updates, value_input_option="RAW")
+        logger.info(f"🔒 {len(updates)} Zeilen für {len(shard_ids)} Shard(s) beansprucht")
+
+def mark_repeated_rows(sheet: Worksheet, header_map: Dict[str, int], repeated_rows: Dict[str, List[int]]) -> None:
+    """Setzt weitere Zeilen einer schon vergebenen Sheet-ID in einem Schreibaufruf auf DUPLICATE_ID_STATUS,
+    damit sie nicht bei jedem Lauf wieder als 'neu' gelesen und bezahlt werden."""
+    indices = [idx for idxs in repeated_rows.values() for idx in idxs]
+    if indices:
+        sheet.batch_update(status_updates(header_map, indices, DUPLICATE_ID_STATUS), value_input_option="RAW")
+        logger.info(f"🔒 {len(indices)} Zeilen mit doppelter ID auf '{DUPLICATE_ID_STATUS}' gesetzt")
+
+def release_expired_claims(sheet: Worksheet, header_map: Dict[str, int]) -> None:
+    """Gibt Zeilen fehlgeschlagener oder abgelaufener Batches wieder frei (nur, wenn der Claim noch im Sheet steht)."""
+    store = get_state_store()
+    records = store.claims_to_release(CLAIM_TTL_HOURS * 3600)
+    if not records:
+        return
+
+    claims = [(record, store.row_indices(record["shard_id"])) for record in records]
+    all_indices = [idx for _, indices in claims for idx in indices.values()]
+    if not all_indices:
+        for record, _ in claims:
+            store.mark_released(record["shard_id"])
+        return
+
+    first, last = min(all_indices), max(all_indices)
+    col = header_map["Status"]
+    values = sheet.batch_get([f"{rowcol_to_a1(first + 2, col)}:{rowcol_to_a1(last + 2, col)}"])[0]
+
+    released = []
+    for record, indices in claims:
+        claim_values = {claim_key(record), f"{CLAIM_PREFIX}{record['shard_id']}"}
+        for idx in indices.values():
+            offset = idx - first
+            if offset < len(values) and values[offset] and values[offset][0] in claim_values:
+                released.append(idx)
+        store.mark_released(record["shard_id"])
+
+    if released:
+        sheet.batch_update(status_updates(header_map, released, "neu"), value_input_option="RAW")
+        # Freigegebene Zeilen liegen evtl. vor dem Wasserzeichen und müssen wieder gelesen werden
+        store.lower_watermark(watermark_key(), released)
+    logger.info(f"🔓 {len(released)} Zeilen aus {len(records)} fehlgeschlagenen/abgelaufenen Batches freigegeben")
+
+def prepare_markdown(rows: List[Dict[str, Any]], refresh: bool = False) -> List[str]:
+    """Nimmt vorhandenes Markdown aus dem Sheet und lädt nur die fehlenden Einträge parallel nach."""
+    markdowns = [row["data"].get("markdown", "").strip() for row in rows]
+    missing = [i for i, markdown in enumerate(markdowns) if not markdown]
+    fetched = fetch_markdown_many([rows[i]["data"].get("Source", "") for i in missing], refresh=refresh)
+    for i, markdown in zip(missing, fetched):
+        markdowns[i] = markdown
+    return markdowns
 
-        batch_items.append({"custom_id": job_id, "content": user_prompt})
-        processed_count += 1
+_STOP = object()
+
+def buffered(items: Iterable[Any], maxsize: int = PIPELINE_QUEUE_SIZE) -> Iterator[Any]:
+    """Lässt eine Stufe in einem eigenen Thread vorauslaufen, höchstens `maxsize` Elemente weit.
+    Fehler der Stufe werden beim Verbraucher erneut ausgelöst; bricht der Verbraucher ab, hält die Stufe an."""
+    queue: Queue = Queue(maxsize=max(1, maxsize))
+    stopped = threading.Event()
+
+    def put(item: Any) -> bool:
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=0.5)
+                return True
+            except Full:
+                continue
+        return False
+
+    def produce() -> None:
+        iterator = iter(items)
+        try:
+            for item in iterator:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put((_STOP, e))
+            return
+        finally:
+            getattr(iterator, "close", lambda: None)()
+        put((_STOP, None))
+
+    thread = threading.Thread(target=produce, name="pipeline-stage", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = queue.get()
+            if isinstance(item, tuple) and item and item[0] is _STOP:
+                if item[1] is not None:
+                    raise item[1]
+                return
+            yield item
+    finally:
+        stopped.set()
+
+def iter_documents(sheet: Worksheet, header_map: Dict[str, int], rows: List[Dict[str, Any]],
+                   refresh: bool = False) -> Iterator[Tuple[str, str, str, int]]:
+    """Liefert bis zu MAX_ROWS Dokumente (id, Source, Markdown, Zeile) in Sheet-Reihenfolge. Markdown wird
+    fensterweise gelesen bzw. geladen, es liegt immer nur ein Fenster im Speicher; leere Ergebnisse zählen nicht."""
+    produced = 0
+    position = 0
+    while position < len(rows) and produced < MAX_ROWS:
+        window = rows[position:position + min(PIPELINE_WINDOW_ROWS, MAX_ROWS - produced)]
+        position += len(window)
+        load_markdown_cells(sheet, header_map, window)
+
+        for item, markdown in zip(window, prepare_markdown(window, refresh=refresh)):
+            job_id = item["data"]["id"]
+            item["data"].pop("markdown", None)
+            logger.info(f"🔄 Vorbereitung ID: {job_id}")
+
+            if not markdown:
+                logger.warning(f"⚠️ Kein Markdown für {job_id}, übersprungen.")
+                continue
+            produced += 1
+            yield job_id, item["data"].get("Source", ""), markdown, item["row_index"]
+
+def clean_documents(documents: Iterable[Tuple[str, str, str, int]], stripper: BoilerplateStripper,
+                    lookahead: int = PIPELINE_LOOKAHEAD_DOCS) -> Iterator[Tuple[str, str, str, int]]:
+    """Bereinigt jedes Dokument erst, wenn `lookahead` weitere beobachtet wurden: Boilerplate wird aus allen
+    bisherigen und den folgenden Dokumenten des Laufs gelernt, ohne den ganzen Lauf im Speicher zu halten."""
+    pending: deque = deque()
+
+    def clean(document: Tuple[str, str, str, int]) -> Tuple[str, str, str, int]:
+        job_id, source, markdown, row_index = document
+        return job_id, source, stripper.clean(domain_of(source), markdown), row_index
+
+    for document in documents:
+        stripper.observe(domain_of(document[1]), document[2])
+        pending.append(document)
+        if len(pending) > lookahead:
+            yield clean(pending.popleft())
+    while pending:
+        yield clean(pending.popleft())
+
+class PostingDeduplicator:
+    """Erkennt Stellen, die schon im Lauf sind (gleiche normalisierte URL oder gleiches bereinigtes Markdown)."""
+
+    def __init__(self):
+        self._by_key: Dict[int, str] = {}  # Hash des Schlüssels -> job_id, hält den Index pro Stelle klein
+        self.aliases: Dict[str, List[str]] = {}
+        self.repeated_rows: Dict[str, List[int]] = {}  # doppelte Sheet-ID -> weitere Zeilen (row_index)
+
+    def is_repeated_id(self, job_id: str, row_index: int, row_indices: Dict[str, int]) -> bool:
+        """Eine Sheet-ID, die im Lauf schon eine Zeile hat, wäre eine doppelte custom_id im Shard; die erste
+        Zeile behält den Request, die weiteren werden nur vermerkt (wie bei doppelten IDs im Ergebnis-Index)."""
+        if job_id not in row_indices:
+            return False
+        self.repeated_rows.setdefault(job_id, []).append(row_index)
+        logger.warning(f"⚠️ Doppelte ID {job_id} in Zeilen {row_indices[job_id] + 2}, {row_index + 2}, "
+                       f"nutze Zeile {row_indices[job_id] + 2}")
+        return True
+
+    def is_duplicate(self, job_id: str, source_url: str, markdown: str) -> bool:
+        keys = [hash(f"hash:{content_hash(markdown)}")]
+        url_key = normalize_url(source_url)
+        if url_key:
+            keys.append(hash(f"url:{url_key}"))
+
+        canonical = next((self._by_key[key] for key in keys if key in self._by_key), None)
+        for key in keys:
+            self._by_key.setdefault(key, canonical or job_id)
+
+        if canonical is None:
+            return False
+        self.aliases.setdefault(canonical, []).append(job_id)
+        logger.info(f"🔁 {job_id} ist ein Duplikat von {canonical}, kein eigener Request")
+        return True
+
+    def log_summary(self) -> None:
+        duplicates = sum(len(ids) for ids in self.aliases.values())
+        repeated = sum(len(rows) for rows in self.repeated_rows.values())
+        if repeated:
+            logger.warning(f"⚠️ {repeated} Zeilen mit schon vergebener ID übersprungen")
+        if duplicates:
+            logger.info(f"🔁 {duplicates} Duplikate zusammengefasst, {len(self.aliases)} Requests mit Mehrfach-Zeilen")
+
+def render_requests(documents: Iterable[Tuple[str, str, str, int]], deduplicator: "PostingDeduplicator",
+                    row_indices: Dict[str, int]) -> Iterator[Tuple[str, str]]:
+    """(custom_id, User-Prompt) je Stelle; Duplikate landen nur in den Aliassen, ihre Zeilen in `row_indices`.
+    Weitere Zeilen mit derselben Sheet-ID ändern `row_indices` nicht."""
+    for job_id, source, cleaned, row_index in documents:
+        if deduplicator.is_repeated_id(job_id, row_index, row_indices):
+            continue
+        row_indices[job_id] = row_index
+        if deduplicator.is_duplicate(job_id, source, cleaned):
+            continue
+        context = {'job_posting_in_markdown': cleaned}
+        yield job_id, render_template('user_prompt_template.txt', context)
+
+def checkpoint_key() -> str:
+    return f"extract_checkpoint:{GOOGLE_SHEET_ID}:{SHEET_NAME}"
+
+def save_checkpoint(shards: List[Dict[str, Any]], deduplicator: PostingDeduplicator,
+                    row_indices: Dict[str, int]) -> None:
+    """Sichert geschriebene Shards samt Aliassen und Zeilen; Grundlage für das Fortsetzen eines Laufs."""
+    state = {"shards": shards, "aliases": deduplicator.aliases, "repeated_rows": deduplicator.repeated_rows,
+             "row_indices": row_indices}
+    get_state_store().set_setting(checkpoint_key(), json.dumps(state))
+
+def clear_checkpoint() -> None:
+    get_state_store().set_setting(checkpoint_key(), "")
+
+def load_checkpoint(sheet: Worksheet, header_map: Dict[str, int]) -> Optional[Dict[str, Any]]:
+    """Stand eines abgebrochenen Laufs oder None. Wurden dessen Shards schon eingereiht (Abbruch nach dem
+    Einreihen), werden nur noch die Zeilen beansprucht; fehlt eine Datei, beginnt der Lauf neu."""
+    raw = get_state_store().get_setting(checkpoint_key(), "")
+    if not raw:
+        return None
+    state = json.loads(raw)
+    shards = state["shards"]
+    store = get_state_store()
+    records = [store.get(shard["shard_id"]) for shard in shards]
+    if any(records):
+        # Schon übernommene Shards (Direktmodus) nicht erneut beanspruchen, sonst wäre 'AI reviewed' überschrieben
+        claim_rows(sheet, header_map, [record["shard_id"] for record in records
+                                       if record and record["state"] in ("built", "uploaded", "submitted")])
+        clear_checkpoint()
+        return None
+    if not shards or any(not os.path.exists(s["path"]) or os.path.getsize(s["path"]) < s["bytes"] for s in shards):
+        logger.warning("⚠️ Checkpoint ohne vollständige Batch-Dateien verworfen, Lauf beginnt neu")
+        clear_checkpoint()
+        return None
+    return state
+
+def process(dry_run: bool = True, refresh: bool = False, full_scan: bool = False, mode: str = "auto"):
+    """Streamt die Zeilen mit Status 'neu' durch Fetch → Bereinigen → Rendern → JSONL. Zwischen den Stufen
+    liegen begrenzte Warteschlangen, der Speicherbedarf hängt nicht von der Zahl der Zeilen ab. Der Schreibstand
+    wird regelmäßig gesichert; ein abgebrochener Lauf überspringt beim nächsten Start die geschriebenen Zeilen."""
+    sheet = init_gsheet()
+    header_map = get_header_map(sheet)
+    release_expired_claims(sheet, header_map)
+    checkpoint = None if dry_run else load_checkpoint(sheet, header_map)
+    rows = get_relevant_rows(sheet, header_map, full_scan=full_scan)
+
+    deduplicator = PostingDeduplicator()
+    row_indices: Dict[str, int] = {}
+    if checkpoint:
+        # Duplikat-Erkennung beginnt neu; nur Stellen über die Abbruchstelle hinweg werden nicht zusammengefasst
+        deduplicator.aliases = checkpoint["aliases"]
+        deduplicator.repeated_rows = checkpoint.get("repeated_rows", {})
+        row_indices.update(checkpoint["row_indices"])
+        rows = [row for row in rows if row["data"]["id"] not in row_indices]
+
+    stripper = BoilerplateStripper()
+    documents = buffered(iter_documents(sheet, header_map, rows, refresh=refresh))
+    cleaned = buffered(clean_documents(documents, stripper))
+    prompts = render_requests(cleaned, deduplicator, row_indices)
 
     if dry_run:
-        logger.info(f"[DRY-RUN] Würde {len(batch_items)} Elemente in Batch packen.")
-    else:
-        submit_batch(batch_items, job_id)
+        count = sum(1 for _ in prompts)
+        stripper.log_summary()
+        deduplicator.log_summary()
+        logger.info(f"[DRY-RUN] Würde {count} Elemente in Batch packen.")
+        return
+
+    checkpoint_fn = partial(save_checkpoint, deduplicator=deduplicator, row_indices=row_indices)
+    with metrics.timer("extract_stream_seconds"):
+        shards = write_line_shards(render_request_lines(prompts, build_system_prompt()),
+                                   max_requests=MAX_BATCH_REQUESTS, max_bytes=MAX_BATCH_BYTES,
+                                   resume=checkpoint["shards"] if checkpoint else None,
+                                   checkpoint=checkpoint_fn, checkpoint_every=PIPELINE_CHECKPOINT_ROWS)
+    stripper.log_summary()
+    deduplicator.log_summary()
+    if shards:
+        save_checkpoint(shards, deduplicator, row_indices)
+    submit_shards(shards, aliases=deduplicator.aliases, row_indices=row_indices, mode=mode,
+                  claim=partial(claim_rows, sheet, header_map))
+    mark_repeated_rows(sheet, header_map, deduplicator.repeated_rows)
+    clear_checkpoint()
 
 if __name__ == "__main__":
     dry_run_flag = '--live' not in sys.argv
-    process(dry_run=dry_run_flag)
+    refresh_flag = '--refresh' in sys.argv
+    full_scan_flag = '--full-scan' in sys.argv
+    mode_flag = "sync" if '--sync' in sys.argv else "batch" if '--batch' in sys.argv else "auto"
+    process(dry_run=dry_run_flag, refresh=refresh_flag, full_scan=full_scan_flag, mode=mode_flag)
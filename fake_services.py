@@ -0,0 +1,524 @@
+# fake_services.py
+# In-Process-Attrappen für Google Sheets und HTTP-Dienste, damit die Pipeline offline gemessen werden kann
+
+import json
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, List, Optional, Set
+
+
+def _a1_to_rowcol(label: str):
+    col = 0
+    row = ""
+    for ch in label:
+        if ch.isalpha():
+            col = col * 26 + (ord(ch.upper()) - ord("A") + 1)
+        else:
+            row += ch
+    return (int(row) if row else None), (col or None)
+
+
+class FakeCell:
+    def __init__(self, row: int, col: int, value: Any):
+        self.row = row
+        self.col = col
+        self.value = value
+
+
+class FakeWorksheet:
+    """Minimaler Ersatz für gspread.Worksheet, zählt jeden API-Aufruf in `calls`.
+
+    `latency` verzögert jeden Aufruf real. Mit `quota_per_minute` wird das Sheets-Kontingent
+    (gleitendes 60-s-Fenster) nachgebildet: Aufrufe darüber müssten warten. Die Wartezeit wird in
+    `quota_wait` aufsummiert und nur mit `sleep_on_quota` auch wirklich abgewartet.
+    """
+
+    def __init__(self, header: List[str], rows: Optional[List[List[Any]]] = None, latency: float = 0.0,
+                 quota_per_minute: int = 0, sleep_on_quota: bool = False):
+        self.values: List[List[Any]] = [list(header)] + [list(r) for r in (rows or [])]
+        self.calls: Counter = Counter()
+        self.latency = latency
+        self.quota_per_minute = quota_per_minute
+        self.sleep_on_quota = sleep_on_quota
+        self.quota_wait = 0.0
+        self._window: Deque[float] = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def api_calls(self) -> int:
+        return sum(self.calls.values())
+
+    @property
+    def row_count(self) -> int:
+        """Rastergröße wie bei gspread (hier ohne Reservezeilen: genau die belegten Zeilen)."""
+        return len(self.values)
+
+    def _api(self, op: str) -> None:
+        with self._lock:
+            self.calls[op] += 1
+            if self.quota_per_minute:
+                # Ohne echtes Warten läuft die Fensteruhr um die bisher simulierte Wartezeit vor
+                now = time.monotonic() + (0.0 if self.sleep_on_quota else self.quota_wait)
+                while self._window and now - self._window[0] >= 60:
+                    self._window.popleft()
+                if len(self._window) >= self.quota_per_minute:
+                    wait = 60 - (now - self._window.popleft())
+                    self.quota_wait += wait
+                    now += wait
+                    if self.sleep_on_quota:
+                        time.sleep(wait)
+                self._window.append(now)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _cell(self, row: int, col: int) -> Any:
+        if row - 1 < len(self.values) and col - 1 < len(self.values[row - 1]):
+            return self.values[row - 1][col - 1]
+        return ""
+
+    def _set(self, row: int, col: int, value: Any) -> None:
+        while len(self.values) < row:
+            self.values.append([])
+        line = self.values[row - 1]
+        while len(line) < col:
+            line.append("")
+        line[col - 1] = value
+
+    # --- Lesen ---
+    def row_values(self, row: int) -> List[Any]:
+        self._api("row_values")
+        return list(self.values[row - 1]) if row - 1 < len(self.values) else []
+
+    def col_values(self, col: int) -> List[Any]:
+        self._api("col_values")
+        return [self._cell(r + 1, col) for r in range(len(self.values))]
+
+    def get_all_values(self) -> List[List[Any]]:
+        self._api("get_all_values")
+        return [list(r) for r in self.values]
+
+    def get_all_records(self) -> List[Dict[str, Any]]:
+        self._api("get_all_records")
+        header = self.values[0]
+        return [
+            {name: (row[i] if i < len(row) else "") for i, name in enumerate(header)}
+            for row in self.values[1:]
+        ]
+
+    def batch_get(self, ranges: List[str], **kwargs) -> List[List[List[Any]]]:
+        """Unterstützt 'A2:A' (offene Spalte), 'A2:C9' und Einzelzellen 'F12'; leere Zeilen am Ende entfallen wie bei der API."""
+        self._api("batch_get")
+        result = []
+        for label in ranges:
+            start, _, end = label.partition(":")
+            row1, col1 = _a1_to_rowcol(start)
+            row2, col2 = _a1_to_rowcol(end) if end else (row1, col1)
+            if row1 > self.row_count:
+                # Wie die API: 400 "exceeds grid limits", auch für offene Bereiche wie 'C12:C'
+                raise ValueError(f"Range ({label}) exceeds grid limits. Max rows: {self.row_count}")
+            row2 = row2 or len(self.values)
+            block = [[self._cell(r, c) for c in range(col1, col2 + 1)] for r in range(row1, row2 + 1)]
+            while block and all(v == "" for v in block[-1]):
+                block.pop()
+            result.append(block)
+        return result
+
+    def find(self, query: str) -> FakeCell:
+        self._api("find")
+        for r, row in enumerate(self.values):
+            for c, value in enumerate(row):
+                if value == query:
+                    return FakeCell(r + 1, c + 1, value)
+        raise ValueError(f"Zelle '{query}' nicht gefunden")
+
+    # --- Schreiben ---
+    def update_cell(self, row: int, col: int, value: Any) -> None:
+        self._api("update_cell")
+        self._set(row, col, value)
+
+    def batch_update(self, data: List[Dict[str, Any]], **kwargs) -> None:
+        self._api("batch_update")
+        for entry in data:
+            start = entry["range"].split(":")[0]
+            row, col = _a1_to_rowcol(start)
+            for r_off, line in enumerate(entry["values"]):
+                for c_off, value in enumerate(line):
+                    self._set(row + r_off, col + c_off, value)
+
+
+def fake_job_page(title: str, with_jsonld: bool = True, script_kb: int = 60, nav_links: int = 40) -> str:
+    """Gerenderte Job-Board-Seite, wie FlareSolverr sie liefert: Scripts, Inline-SVG, Navigation, Cookie-Banner,
+    Sidebar mit ähnlichen Stellen und Footer rund um den eigentlichen Stellentext (optional mit JSON-LD)."""
+    icon = '<svg viewBox="0 0 24 24"><path d="' + "M12 2L2 7l10 5 10-5-10-5z " * 20 + '"/></svg>'
+    script = "<script>" + "window.__STATE__.push({k:'v',n:1});" * (script_kb * 1024 // 36) + "</script>"
+    nav = "".join(f'<li><a href="/kategorie/{i}">{icon}Kategorie {i}</a></li>' for i in range(nav_links))
+    tasks = "".join(f"<li><p>Aufgabe {i}: Sie entwickeln, testen und betreiben Dienste im Team, mit Verantwortung.</p></li>"
+                    for i in range(8))
+    skills = "".join(f"<li>Erfahrung mit Technologie {i}, idealerweise mehrjährig</li>" for i in range(6))
+    description = (
+        "<p>Wir suchen zum nächstmöglichen Zeitpunkt Verstärkung für unser Plattform-Team in Berlin. "
+        "Sie arbeiten an verteilten Systemen, die täglich Millionen Anfragen verarbeiten, und gestalten die "
+        "Architektur aktiv mit.</p><h2>Ihre Aufgaben</h2><ul>" + tasks + "</ul><h2>Ihr Profil</h2><ul>" + skills +
+        "</ul><h2>Wir bieten</h2><p>Flexible Arbeitszeiten, Homeoffice, Weiterbildungsbudget und ein "
+        "unbefristetes Arbeitsverhältnis.</p>"
+    )
+    related = "".join(f'<div class="job-card"><a href="/stelle/{i}">Ähnliche Stelle {i}</a><span>Berlin</span></div>'
+                      for i in range(15))
+    jsonld = ""
+    if with_jsonld:
+        posting = {
+            "@context": "https://schema.org", "@type": "JobPosting", "title": title, "description": description,
+            "datePosted": "2026-01-15", "employmentType": "FULL_TIME",
+            "hiringOrganization": {"@type": "Organization", "name": "Beispiel GmbH"},
+            "jobLocation": {"@type": "Place", "address": {"@type": "PostalAddress", "addressLocality": "Berlin",
+                                                          "postalCode": "10115", "addressCountry": "DE"}},
+        }
+        jsonld = f'<script type="application/ld+json">{json.dumps(posting, ensure_ascii=False)}</script>'
+    return (
+        f"<!DOCTYPE html><html><head><title>{title}</title><style>body{{margin:0}}" + ".c{color:red}" * 500 +
+        f"</style>{jsonld}{script}</head><body>"
+        f'<div class="cookie-banner">Wir verwenden Cookies, um Ihnen das beste Erlebnis zu bieten. '
+        f"<button>Alle akzeptieren</button></div>"
+        f'<header class="site-header">{icon}<nav><ul>{nav}</ul></nav></header>'
+        f'<main><article class="job-posting"><h1>{title}</h1>'
+        f'<div class="job-meta">Beispiel GmbH · Berlin · Vollzeit</div>'
+        f'<div class="job-description">{description}</div>'
+        f'<form class="apply"><input name="email"><button>Jetzt bewerben</button></form></article>'
+        f'<aside class="sidebar"><h3>Ähnliche Stellen</h3>{related}</aside></main>'
+        f'<footer><ul>{nav}</ul><p>© Beispiel Jobbörse</p></footer>{script}</body></html>'
+    )
+
+
+class _FakeHttpHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-Alive, damit Session-Pooling messbar ist
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server: "FakeHttpServer" = self.server.owner
+        source_url = self.path.lstrip("/")
+        server.record("jina", source_url)
+        time.sleep(server.jina_latency)
+        if server.jina_down:
+            self._send(503, b"unavailable", "text/plain")
+            return
+        if server.is_failing(source_url):
+            self._send(422, b"target not readable", "text/plain")
+            return
+        self._send(200, server.markdown_for(source_url).encode("utf-8"), "text/plain; charset=utf-8")
+
+    def do_POST(self):
+        server: "FakeHttpServer" = self.server.owner
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if self.path.endswith("/chat/completions"):
+            self._chat_completion(server, payload)
+            return
+        command = payload.get("cmd", "request.get")
+        if command in ("sessions.create", "sessions.destroy"):
+            server.record(command, payload.get("session", ""))
+            if command == "sessions.create":
+                time.sleep(server.flaresolverr_cold_start)
+            self._send(200, json.dumps({"status": "ok", "session": payload.get("session")}).encode("utf-8"), "application/json")
+            return
+        source_url = payload.get("url", "")
+        server.record("flaresolverr", source_url)
+        # Ohne Session startet FlareSolverr für jede Anfrage einen neuen Browser
+        time.sleep(server.flaresolverr_latency + (0 if payload.get("session") else server.flaresolverr_cold_start))
+        body = {"status": "ok", "solution": {"url": source_url, "status": 200, "response": server.html_for(source_url)}}
+        self._send(200, json.dumps(body).encode("utf-8"), "application/json")
+
+    def _chat_completion(self, server: "FakeHttpServer", payload: Dict[str, Any]) -> None:
+        index = server.record("chat", payload.get("model", ""))
+        time.sleep(server.chat_latency)
+        if server.rate_limit_every and index % server.rate_limit_every == 0:
+            error = {"error": {"message": "Rate limit reached", "type": "rate_limit_error", "code": "rate_limit_exceeded"}}
+            self._send(429, json.dumps(error).encode("utf-8"), "application/json", {"retry-after": "0"})
+            return
+        body = fake_completion_line(f"chat-{index}", index)["response"]["body"]
+        self._send(200, json.dumps(body).encode("utf-8"), "application/json", {"x-request-id": f"req_{index:06d}"})
+
+
+class FakeHttpServer:
+    """Lokaler Server, der r.jina.ai (GET /<url>), FlareSolverr (POST /v1) und
+    Chat Completions (POST /v1/chat/completions) imitiert.
+
+    URLs in `failing_urls` liefern bei Jina einen 422 (Seite nicht lesbar), mit `jina_down`
+    antwortet Jina immer mit 503; in beiden Fällen greift der FlareSolverr-Fallback.
+    `flaresolverr_cold_start` ist der Browserstart bei sessions.create bzw. bei jeder Anfrage
+    ohne Session. Mit `rate_limit_every` beantwortet der Chat-Endpunkt jede n-te Anfrage mit 429.
+    """
+
+    def __init__(self, jina_latency: float = 0.05, flaresolverr_latency: float = 0.2,
+                 failing_urls: Optional[Set[str]] = None, jina_down: bool = False,
+                 chat_latency: float = 0.2, rate_limit_every: int = 0, flaresolverr_cold_start: float = 0.0):
+        self.jina_latency = jina_latency
+        self.flaresolverr_latency = flaresolverr_latency
+        self.flaresolverr_cold_start = flaresolverr_cold_start
+        self.failing_urls = set(failing_urls or ())
+        self.jina_down = jina_down
+        self.chat_latency = chat_latency
+        self.rate_limit_every = rate_limit_every
+        self.calls: Counter = Counter()
+        self.seen_urls: List[str] = []
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _FakeHttpHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.owner = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record(self, backend: str, source_url: str) -> int:
+        with self._lock:
+            self.calls[backend] += 1
+            self.seen_urls.append(source_url)
+            return self.calls[backend]
+
+    def is_failing(self, source_url: str) -> bool:
+        return source_url in self.failing_urls
+
+    def markdown_for(self, source_url: str) -> str:
+        return f"# Stelle {source_url}\n\nAufgaben:\n- Entwickeln\n- Testen\n"
+
+    def html_for(self, source_url: str) -> str:
+        return fake_job_page(f"Stelle {source_url}")
+
+    def start(self) -> "FakeHttpServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "FakeHttpServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+class FakeClock:
+    """Simulierte Zeit: `sleep` springt vor, statt zu warten."""
+
+    def __init__(self, start: float = 0.0):
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += max(seconds, 0)
+
+
+class FakeAPIError(Exception):
+    """Fehler mit HTTP-Status wie die Fehlerklassen des OpenAI-SDK (Attribut `status_code`)."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _Obj:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def model_dump(self) -> Dict[str, Any]:
+        return {k: (v.model_dump() if isinstance(v, _Obj) else v) for k, v in self.__dict__.items()}
+
+
+class _FakeBatchJob:
+    def __init__(self, batch_id: str, input_file_id: str, total: int, created_at: float,
+                 duration: float, validating: float, finalizing: float, final_status: str):
+        self.batch_id = batch_id
+        self.input_file_id = input_file_id
+        self.total = total
+        self.created_at = created_at
+        self.duration = duration
+        self.validating = validating
+        self.finalizing = finalizing
+        self.final_status = final_status
+
+    def snapshot(self, now: float) -> _Obj:
+        elapsed = now - self.created_at
+        done = 0
+        output_file_id = error_file_id = None
+        if elapsed < self.validating:
+            status = "validating"
+        elif elapsed < self.validating + self.duration:
+            status = "in_progress"
+            done = int(self.total * (elapsed - self.validating) / self.duration)
+        elif elapsed < self.validating + self.duration + self.finalizing:
+            status, done = "finalizing", self.total
+        else:
+            status, done = self.final_status, self.total
+            if status == "completed":
+                output_file_id = f"file-out-{self.batch_id}"
+        counts = _Obj(total=self.total, completed=done if status != "failed" else 0,
+                      failed=self.total if status == "failed" else 0)
+        return _Obj(id=self.batch_id, status=status, input_file_id=self.input_file_id,
+                    output_file_id=output_file_id, error_file_id=error_file_id, request_counts=counts,
+                    endpoint="/v1/chat/completions", completion_window="24h")
+
+
+class _FakeBatches:
+    def __init__(self, owner: "FakeOpenAIClient"):
+        self._owner = owner
+
+    def create(self, input_file_id: str, endpoint: str, completion_window: str, **kwargs) -> _Obj:
+        owner = self._owner
+        with owner._lock:  # Uploads laufen parallel
+            owner.calls["batches.create"] += 1
+            total = owner.file_lines.get(input_file_id, 0)
+            batch_id = f"batch_{len(owner.jobs) + 1:06d}"
+            owner.schedule(batch_id, total=total, input_file_id=input_file_id)
+        return owner.jobs[batch_id].snapshot(owner.clock())
+
+    def retrieve(self, batch_id: str) -> _Obj:
+        self._owner.calls["batches.retrieve"] += 1
+        job = self._owner.jobs.get(batch_id)
+        if job is None:
+            raise FakeAPIError(404, f"No batch found with id '{batch_id}'")
+        return job.snapshot(self._owner.clock())
+
+
+def fake_completion_line(custom_id: str, index: int) -> Dict[str, Any]:
+    """Eine Zeile im Format der Batch-Output-Datei mit plausibler JSON-Antwort."""
+    content = json.dumps({
+        "id": custom_id,
+        "job_title": f"Stelle {custom_id}",
+        "job_description": "Beschreibung der Stelle",
+        "company_name": "Beispiel GmbH",
+        "city": "Berlin",
+        "country": "Deutschland",
+        "responsibilities": ["Entwickeln", "Testen"],
+        "requirements": ["Python"],
+        "employment_type": "Vollzeit",
+        "seniority_level": "Senior",
+        "industry": "IT",
+    }, ensure_ascii=False)
+    return {
+        "id": f"batch_req_{index:06d}",
+        "custom_id": custom_id,
+        "response": {
+            "status_code": 200,
+            "request_id": f"req_{index:06d}",
+            "body": {
+                "id": f"chatcmpl-{index:06d}",
+                "object": "chat.completion",
+                "model": "gpt-4o",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 900, "completion_tokens": 250, "total_tokens": 1150},
+            },
+        },
+        "error": None,
+    }
+
+
+class _FakeStreamingResponse:
+    def __init__(self, data: bytes):
+        self._data = data
+
+    def iter_bytes(self, chunk_size: int = 65536):
+        for start in range(0, len(self._data), chunk_size):
+            yield self._data[start:start + chunk_size]
+
+    def __enter__(self) -> "_FakeStreamingResponse":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+class _FakeStreamingFiles:
+    def __init__(self, owner: "FakeOpenAIClient"):
+        self._owner = owner
+
+    def content(self, file_id: str) -> _FakeStreamingResponse:
+        self._owner.calls["files.content"] += 1
+        return _FakeStreamingResponse(self._owner.file_bytes(file_id))
+
+
+class _FakeFiles:
+    def __init__(self, owner: "FakeOpenAIClient"):
+        self._owner = owner
+        self.with_streaming_response = _FakeStreamingFiles(owner)
+
+    def content(self, file_id: str) -> _Obj:
+        self._owner.calls["files.content"] += 1
+        data = self._owner.file_bytes(file_id)
+        return _Obj(content=data, text=data.decode("utf-8"))
+
+    def create(self, file, purpose: str, **kwargs) -> _Obj:
+        owner = self._owner
+        data = file.read()
+        with owner._lock:
+            owner.calls["files.create"] += 1
+            file_id = f"file-{len(owner.stored_files) + 1:06d}"
+            owner.stored_files[file_id] = data
+            owner.file_lines[file_id] = data.count(b"\n")
+        return _Obj(id=file_id, bytes=len(data), purpose=purpose)
+
+
+class FakeOpenAIClient:
+    """Ersatz für OpenAI().files/.batches mit geskripteten Laufzeiten pro Batch.
+
+    Neue Batches bekommen `default_duration`; mit `schedule()` lassen sich einzelne Batches
+    gezielt langsam, schnell oder fehlschlagend anlegen.
+    """
+
+    def __init__(self, clock: Optional[FakeClock] = None, default_duration: float = 600.0,
+                 validating: float = 30.0, finalizing: float = 60.0):
+        self.clock = clock or FakeClock()
+        self.default_duration = default_duration
+        self.validating = validating
+        self.finalizing = finalizing
+        self.jobs: Dict[str, _FakeBatchJob] = {}
+        self.stored_files: Dict[str, bytes] = {}
+        self.file_lines: Dict[str, int] = {}
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+        self.batches = _FakeBatches(self)
+        self.files = _FakeFiles(self)
+
+    def file_bytes(self, file_id: str) -> bytes:
+        """Hochgeladene Dateien unverändert, Output-Dateien werden aus der Eingabe des Batches erzeugt."""
+        if file_id in self.stored_files:
+            return self.stored_files[file_id]
+        if file_id.startswith("file-out-"):
+            job = self.jobs[file_id[len("file-out-"):]]
+            source = self.stored_files.get(job.input_file_id)
+            if source is not None:
+                custom_ids = [json.loads(line)["custom_id"] for line in source.splitlines() if line.strip()]
+            else:
+                custom_ids = [f"{job.batch_id}-{i}" for i in range(job.total)]
+            lines = (json.dumps(fake_completion_line(cid, i), ensure_ascii=False) for i, cid in enumerate(custom_ids))
+            data = ("\n".join(lines) + "\n").encode("utf-8")
+            self.stored_files[file_id] = data
+            return data
+        raise KeyError(f"Unbekannte Datei {file_id}")
+
+    def schedule(self, batch_id: str, total: int = 100, duration: Optional[float] = None,
+                 final_status: str = "completed", input_file_id: Optional[str] = None) -> None:
+        self.jobs[batch_id] = _FakeBatchJob(
+            batch_id, input_file_id or f"file-in-{batch_id}", total, self.clock(),
+            self.default_duration if duration is None else duration,
+            self.validating, self.finalizing, final_status
+        )
@@ -0,0 +1,256 @@
+# fetch_backends.py
+# Schutz und Routing für die Markdown-Quellen: Circuit Breaker pro Backend, Domain-Routing
+# (Domains, die Jina nicht lesen kann, gehen direkt an FlareSolverr) und ein Pool wiederverwendbarer
+# FlareSolverr-Browser-Sessions, die bevorzugt wieder an dieselbe Domain vergeben werden.
+
+import os
+import json
+import time
+import uuid
+import atexit
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import requests
+from dotenv import load_dotenv
+
+import metrics
+from state_store import get_state_store
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Aufeinanderfolgende Dienstfehler, nach denen ein Backend übersprungen wird, und Dauer der Pause
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", 5))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("BREAKER_COOLDOWN_SECONDS", 60))
+# Domains, die immer zuerst über FlareSolverr geladen werden (kommagetrennt, Subdomains eingeschlossen)
+FLARESOLVERR_DOMAINS = [d.strip().lower() for d in os.getenv("FLARESOLVERR_DOMAINS", "").split(",") if d.strip()]
+# Nach so vielen Jina-Fehlschlägen mit erfolgreichem FlareSolverr-Fallback wird eine Domain direkt geroutet
+ROUTE_LEARN_AFTER = int(os.getenv("ROUTE_LEARN_AFTER", 2))
+FLARESOLVERR_SESSION_TTL_MINUTES = int(os.getenv("FLARESOLVERR_SESSION_TTL_MINUTES", 10))
+FLARESOLVERR_CONCURRENCY = int(os.getenv("FLARESOLVERR_CONCURRENCY", 2))
+
+LEARNED_DOMAINS_KEY = "flaresolverr_domains"
+SERVICE_STATUS_CODES = {429, 502, 503, 504}
+
+
+def is_service_failure(error: Exception) -> bool:
+    """Fehler des Dienstes selbst (nicht erreichbar, überlastet, Rate-Limit) – nur diese zählen für den Breaker.
+    Andere Fehler (z. B. eine Seite, die Jina nicht lesen kann) betreffen die Domain, nicht das Backend."""
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    response = getattr(error, "response", None)
+    return response is not None and response.status_code in SERVICE_STATUS_CODES
+
+
+def retry_after_seconds(error: Exception) -> float:
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after", 0)) if response is not None else 0.0
+    except ValueError:
+        return 0.0
+
+
+class CircuitBreaker:
+    """closed → nach `failure_threshold` Dienstfehlern in Folge open (Backend wird übersprungen) →
+    nach `cooldown` half-open: genau ein Probe-Request entscheidet, ob wieder geschlossen wird."""
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURES,
+                 cooldown: float = BREAKER_COOLDOWN_SECONDS, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.open_for = cooldown
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self.clock() - self.opened_at >= self.open_for else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.clock() - self.opened_at < self.open_for or self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.probing = False
+            if self.opened_at is not None:
+                self.opened_at = None
+                logger.info(f"🟢 {self.name} antwortet wieder, Circuit Breaker geschlossen")
+
+    def record_failure(self, retry_after: float = 0.0) -> None:
+        with self._lock:
+            self.failures += 1
+            if not self.probing and self.failures < self.failure_threshold:
+                return
+            self.probing = False
+            self.opened_at = self.clock()
+            self.open_for = max(self.cooldown, retry_after)
+            metrics.inc("markdown_breaker_open_total", backend=self.name)
+            logger.warning(f"🔴 {self.name}: {self.failures} Fehler in Folge, wird {self.open_for:.0f}s übersprungen")
+
+
+class DomainRouter:
+    """Reihenfolge der Backends pro Domain. Konfigurierte und gelernte FlareSolverr-Domains überspringen Jina;
+    gelernte Domains bleiben im Zustandsspeicher, damit spätere Läufe sie nicht erneut lernen müssen."""
+
+    def __init__(self, static_domains: Optional[List[str]] = None, learn_after: int = ROUTE_LEARN_AFTER):
+        self.static = set(FLARESOLVERR_DOMAINS if static_domains is None else static_domains)
+        self.learn_after = learn_after
+        self.store = get_state_store()
+        self.learned = set(json.loads(self.store.get_setting(LEARNED_DOMAINS_KEY, "[]")))
+        self._fallbacks: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def needs_flaresolverr(self, domain: str) -> bool:
+        if domain in self.learned:
+            return True
+        return any(domain == d or domain.endswith(f".{d}") for d in self.static)
+
+    def route(self, domain: str) -> Tuple[str, ...]:
+        return ("flaresolverr", "jina") if self.needs_flaresolverr(domain) else ("jina", "flaresolverr")
+
+    def note_fallback(self, domain: str) -> None:
+        """Jina konnte die Seite nicht liefern, FlareSolverr schon."""
+        if not domain or not self.learn_after:
+            return
+        with self._lock:
+            self._fallbacks[domain] += 1
+            if self._fallbacks[domain] < self.learn_after or domain in self.learned:
+                return
+            self.learned.add(domain)
+            self.store.set_setting(LEARNED_DOMAINS_KEY, json.dumps(sorted(self.learned)))
+        logger.info(f"🧭 {domain} wird ab jetzt direkt über FlareSolverr geladen")
+
+    def note_success(self, domain: str) -> None:
+        with self._lock:
+            self._fallbacks.pop(domain, None)
+
+
+class FlareSolverrSessionPool:
+    """Hält höchstens `max_sessions` Browser-Sessions (sessions.create). Eine freie Session derselben Domain
+    (mit deren Cookies/Challenge-Lösung) wird bevorzugt, sonst eine neue angelegt, solange Platz ist, sonst
+    irgendeine freie übernommen; erst wenn alle belegt sind, wird gewartet. Fehlgeschlagene Sessions werden verworfen."""
+
+    def __init__(self, max_sessions: int = FLARESOLVERR_CONCURRENCY, timeout: float = 60):
+        self.max_sessions = max(1, max_sessions)
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._sessions: Dict[str, str] = {}  # Session -> zuletzt besuchte Domain
+        self._idle: List[str] = []
+        self._endpoint: Optional[str] = None
+        atexit.register(self.close)
+
+    def _command(self, http: requests.Session, endpoint: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        response = http.post(f"{endpoint}/v1", json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        if data.get("status") != "ok":
+            raise RuntimeError(f"FlareSolverr {payload['cmd']}: {data.get('message')}")
+        return data
+
+    def _destroy(self, http: requests.Session, endpoint: str, name: str) -> None:
+        try:
+            self._command(http, endpoint, {"cmd": "sessions.destroy", "session": name})
+        except Exception as e:
+            logger.debug(f"FlareSolverr-Session {name} ließ sich nicht schließen: {e}")
+
+    def _acquire(self, domain: str) -> Tuple[str, bool]:
+        """Liefert (Session, muss noch angelegt werden)."""
+        with self._cond:
+            while True:
+                same = next((name for name in self._idle if self._sessions[name] == domain), None)
+                if same is None and len(self._sessions) < self.max_sessions:
+                    name = f"jobpipe-{uuid.uuid4().hex[:12]}"
+                    self._sessions[name] = domain
+                    return name, True
+                name = same or (self._idle[0] if self._idle else None)
+                if name is None:
+                    self._cond.wait()
+                    continue
+                self._idle.remove(name)
+                self._sessions[name] = domain
+                return name, False
+
+    def _discard(self, name: str) -> None:
+        with self._cond:
+            self._sessions.pop(name, None)
+            self._cond.notify()
+
+    @contextmanager
+    def session(self, http: requests.Session, endpoint: str, domain: str) -> Iterator[str]:
+        self._endpoint = endpoint
+        name, create = self._acquire(domain)
+        if create:
+            try:
+                self._command(http, endpoint, {"cmd": "sessions.create", "session": name})
+            except Exception:
+                self._discard(name)
+                raise
+            metrics.inc("flaresolverr_sessions_created_total")
+            logger.debug(f"FlareSolverr-Session {name} für {domain} angelegt")
+
+        try:
+            yield name
+        except Exception:
+            self._discard(name)
+            self._destroy(http, endpoint, name)
+            raise
+        with self._cond:
+            self._idle.append(name)
+            self._cond.notify()
+
+    def close(self) -> None:
+        """Schließt alle Sessions (beim Prozessende), damit keine Browser in FlareSolverr liegen bleiben."""
+        with self._cond:
+            names = list(self._sessions)
+            self._sessions.clear()
+            self._idle.clear()
+        if names and self._endpoint:
+            with requests.Session() as http:
+                for name in names:
+                    self._destroy(http, self._endpoint, name)
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_router: Optional[DomainRouter] = None
+_pool: Optional[FlareSolverrSessionPool] = None
+_lock = threading.Lock()
+
+
+def get_breaker(backend: str) -> CircuitBreaker:
+    with _lock:
+        if backend not in _breakers:
+            _breakers[backend] = CircuitBreaker(backend)
+        return _breakers[backend]
+
+
+def get_domain_router() -> DomainRouter:
+    global _router
+    with _lock:
+        if _router is None:
+            _router = DomainRouter()
+        return _router
+
+
+def get_flaresolverr_pool() -> FlareSolverrSessionPool:
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = FlareSolverrSessionPool()
+        return _pool
@@ -0,0 +1,441 @@
+# html_to_markdown.py
+# Hauptinhalt gerenderter Job-Seiten (FlareSolverr) extrahieren und direkt in Markdown umwandeln
+#
+# Reihenfolge: JSON-LD JobPosting (strukturiert, meist vollständig) → Readability-artige Bewertung der
+# Blöcke (Textmenge, Kommas, Linkdichte, class/id-Hinweise) → ganze Seite. Scripts, Styles, SVG,
+# Navigation, Footer und Formulare fließen nie ins Ergebnis ein. Der Konverter arbeitet in einem Durchlauf
+# über einen schlanken Baum aus html.parser (ohne BeautifulSoup/markdownify).
+
+import os
+import re
+import html
+import json
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Größere Seiten werden vor dem Aufbau des Baums abgeschnitten (in Zeichen; HTML_MAX_KB gilt als Altname).
+# JSON-LD wird trotzdem auf der ganzen Seite gesucht, viele Job-Boards setzen es ans Ende
+HTML_MAX_CHARS = int(os.getenv("HTML_MAX_CHARS", float(os.getenv("HTML_MAX_KB", 2048)) * 1024))
+# Obergrenze für das erzeugte Markdown (an einer Absatzgrenze gekürzt)
+EXTRACT_MAX_CHARS = int(os.getenv("EXTRACT_MAX_CHARS", 40000))
+# Kürzere JSON-LD-Beschreibungen gelten als Teaser, dann wird zusätzlich der Seiteninhalt verwendet
+JSONLD_MIN_CHARS = int(os.getenv("JSONLD_MIN_CHARS", 200))
+# Prozesse für die Umwandlung (0 = im aufrufenden Thread)
+CONVERT_WORKERS = int(os.getenv("CONVERT_WORKERS", min(4, os.cpu_count() or 1)))
+
+SKIP_TAGS = {"script", "style", "svg", "noscript", "template", "iframe", "canvas", "object", "select", "button",
+             "title", "math"}
+DROP_TAGS = {"nav", "aside", "footer", "form", "dialog"}
+VOID_TAGS = {"br", "hr", "img", "input", "meta", "link", "area", "base", "col", "embed", "source", "track",
+             "wbr", "param"}
+BLOCK_TAGS = {"p", "div", "section", "article", "main", "header", "ul", "ol", "li", "h1", "h2", "h3", "h4", "h5",
+              "h6", "table", "thead", "tbody", "tr", "td", "th", "pre", "blockquote", "dl", "dt", "dd", "figure",
+              "figcaption", "address"}
+IMPLICIT_CLOSE = {"li": {"li"}, "p": {"p"}, "td": {"td", "th"}, "th": {"td", "th"}, "tr": {"tr"},
+                  "dt": {"dt", "dd"}, "dd": {"dt", "dd"}}
+PARAGRAPH_TAGS = {"p", "li", "td", "pre", "dd", "blockquote"}
+CANDIDATE_TAGS = {"div", "section", "article", "main", "td", "body"}
+SCORED_TAGS = CANDIDATE_TAGS | {"root", "html"}
+HEADINGS = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+MAX_DEPTH = 300
+
+POSITIVE_HINTS = re.compile(r"article|content|job|posting|stelle|vacancy|description|beschreibung|main|entry|text|body",
+                            re.IGNORECASE)
+NEGATIVE_HINTS = re.compile(r"nav|menu|footer|header|sidebar|comment|cookie|consent|banner|social|share|related|"
+                            r"similar|widget|promo|breadcrumb|newsletter|popup|modal|teaser", re.IGNORECASE)
+
+_whitespace = re.compile(r"\s+")
+_blank_lines = re.compile(r"\n{3,}")
+_list_line = re.compile(r"^ +(?:- |\d+\. )")
+_jsonld_script = re.compile(r"<script\b[^>]*\btype\s*=\s*[\"']?application/ld\+json[\"']?[^>]*>(.*?)</script\s*>",
+                            re.IGNORECASE | re.DOTALL)
+
+
+class Node:
+    __slots__ = ("tag", "hints", "children", "parent", "depth")
+
+    def __init__(self, tag: str, hints: str, parent: Optional["Node"]):
+        self.tag = tag
+        self.hints = hints  # class und id, für die Bewertung
+        self.children: List[Union["Node", str]] = []
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent else 0
+
+
+class _TreeBuilder(HTMLParser):
+    """Baut einen schlanken Elementbaum; Inhalte von SKIP_TAGS werden verworfen, JSON-LD-Blöcke gesammelt."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = Node("root", "", None)
+        self.current = self.root
+        self.jsonld: List[str] = []
+        self._skip_tag: Optional[str] = None
+        self._skip_depth = 0
+        self._jsonld_parts: Optional[List[str]] = None
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        if self._skip_depth:
+            self._skip_depth += tag == self._skip_tag
+            return
+        if tag in SKIP_TAGS:
+            self._skip_tag, self._skip_depth = tag, 1
+            if tag == "script" and any(k == "type" and (v or "").lower() == "application/ld+json" for k, v in attrs):
+                self._jsonld_parts = []
+            return
+        if tag in VOID_TAGS:
+            if tag in ("br", "hr"):
+                self.current.children.append(Node(tag, "", self.current))
+            return
+
+        closes = IMPLICIT_CLOSE.get(tag)
+        if closes and self.current.tag in closes:
+            self.current = self.current.parent
+        elif tag in BLOCK_TAGS and self.current.tag == "p":
+            self.current = self.current.parent
+        if self.current.depth >= MAX_DEPTH:
+            return  # extrem tief verschachtelte Seiten: Inhalt bleibt, weitere Ebenen entfallen
+
+        hints = " ".join(v for k, v in attrs if k in ("class", "id") and v)
+        node = Node(tag, hints, self.current)
+        self.current.children.append(node)
+        self.current = node
+
+    def handle_startendtag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        if tag in ("br", "hr") and not self._skip_depth:
+            self.current.children.append(Node(tag, "", self.current))
+
+    def handle_endtag(self, tag: str) -> None:
+        if self._skip_depth:
+            if tag == self._skip_tag:
+                self._skip_depth -= 1
+                if not self._skip_depth and self._jsonld_parts is not None:
+                    self.jsonld.append("".join(self._jsonld_parts))
+                    self._jsonld_parts = None
+            return
+        node = self.current
+        while node is not self.root and node.tag != tag:
+            node = node.parent
+        if node is not self.root:
+            self.current = node.parent
+
+    def handle_data(self, data: str) -> None:
+        if self._skip_depth:
+            if self._jsonld_parts is not None:
+                self._jsonld_parts.append(data)
+            return
+        self.current.children.append(data)
+
+
+def parse_html(page_html: str) -> _TreeBuilder:
+    builder = _TreeBuilder()
+    builder.feed(page_html)
+    builder.close()
+    return builder
+
+
+# === JSON-LD ===
+
+def jsonld_blocks(page_html: str) -> List[str]:
+    """Inhalte aller application/ld+json-Scripts der Seite, ohne sie zu parsen (für zu große Seiten)."""
+    return _jsonld_script.findall(page_html)
+
+
+def find_job_posting(blocks: List[str]) -> Optional[Dict[str, Any]]:
+    for raw in blocks:
+        try:
+            data = json.loads(raw.strip().rstrip(";"))
+        except ValueError:
+            continue
+        stack = [data]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, list):
+                stack.extend(item)
+                continue
+            if not isinstance(item, dict):
+                continue
+            types = item.get("@type")
+            if "JobPosting" in (types if isinstance(types, list) else [types]):
+                return item
+            if "@graph" in item:
+                stack.append(item["@graph"])
+    return None
+
+
+def _name(value: Any) -> str:
+    if isinstance(value, dict):
+        value = value.get("name") or ""
+    if isinstance(value, list):
+        return ", ".join(filter(None, (_name(v) for v in value)))
+    return str(value or "").strip()
+
+
+def _location(value: Any) -> str:
+    if isinstance(value, list):
+        return "; ".join(filter(None, (_location(v) for v in value)))
+    if not isinstance(value, dict):
+        return _name(value)
+    address = value.get("address", value)
+    if not isinstance(address, dict):
+        return _name(address)
+    parts = [address.get("streetAddress"), " ".join(filter(None, [address.get("postalCode"), address.get("addressLocality")])),
+             address.get("addressRegion"), _name(address.get("addressCountry"))]
+    return ", ".join(str(p).strip() for p in parts if p)
+
+
+def _salary(value: Any) -> str:
+    if not isinstance(value, dict):
+        return _name(value)
+    amount = value.get("value", value)
+    currency = value.get("currency", "")
+    if isinstance(amount, dict):
+        low, high, unit = amount.get("minValue"), amount.get("maxValue"), amount.get("unitText", "")
+        amount = f"{low} – {high}" if low and high else low or high or amount.get("value") or ""
+    else:
+        unit = ""
+    return " ".join(str(p) for p in (amount, currency, f"/ {unit}" if unit else "") if p).strip()
+
+
+def job_posting_markdown(posting: Dict[str, Any]) -> Tuple[str, str]:
+    """Liefert (Kopf mit den strukturierten Feldern, Beschreibung als Markdown)."""
+    lines = []
+    title = _name(posting.get("title"))
+    if title:
+        lines.append(f"# {title}")
+    fields = [
+        ("Unternehmen", _name(posting.get("hiringOrganization"))),
+        ("Ort", _location(posting.get("jobLocation"))),
+        ("Remote", "ja" if posting.get("jobLocationType") == "TELECOMMUTE" else ""),
+        ("Anstellungsart", _name(posting.get("employmentType"))),
+        ("Gehalt", _salary(posting.get("baseSalary"))),
+        ("Veröffentlicht", _name(posting.get("datePosted"))),
+        ("Bewerbungsfrist", _name(posting.get("validThrough"))),
+    ]
+    lines.extend(f"**{label}:** {value}" for label, value in fields if value)
+
+    description = str(posting.get("description") or "")
+    if "<" not in description and "&lt;" in description:
+        description = html.unescape(description)
+    body = render(parse_html(description).root) if "<" in description else description.strip()
+    return "\n".join(lines), body
+
+
+# === Hauptinhalt ===
+
+def _is_dropped(node: Node) -> bool:
+    return node.tag in DROP_TAGS or (bool(node.hints) and node.tag not in ("body", "main", "article")
+                                      and NEGATIVE_HINTS.search(node.hints) is not None
+                                      and POSITIVE_HINTS.search(node.hints) is None)
+
+
+def _hint_weight(node: Node) -> float:
+    if not node.hints:
+        return 0.0
+    return 25.0 * ((POSITIVE_HINTS.search(node.hints) is not None) - (NEGATIVE_HINTS.search(node.hints) is not None))
+
+
+def main_content(root: Node) -> Node:
+    """Readability-artig: Absätze geben ihrem Eltern- (voll) und Großelternknoten (halb) Punkte nach Länge
+    und Kommas; die Summe wird um die Linkdichte gekürzt, class/id-Hinweise verschieben sie."""
+    text_len: Dict[int, int] = {}
+    link_len: Dict[int, int] = {}
+    scores: Dict[int, float] = {}
+    nodes: Dict[int, Node] = {}
+
+    # Nachordnung ohne Rekursion: Kinder vor Eltern
+    order: List[Node] = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node.tag in DROP_TAGS:
+            continue
+        order.append(node)
+        stack.extend(child for child in node.children if isinstance(child, Node))
+
+    for node in reversed(order):
+        total = links = 0
+        for child in node.children:
+            if isinstance(child, str):
+                total += len(child.strip())
+            elif id(child) in text_len:
+                total += text_len[id(child)]
+                links += link_len[id(child)]
+        if node.tag == "a":
+            links = total
+        text_len[id(node)], link_len[id(node)] = total, links
+
+        if node.tag in PARAGRAPH_TAGS and total >= 25 and node.parent is not None:
+            text = _text(node)
+            score = 1 + text.count(",") + min(total / 100, 3)
+            for ancestor, share in ((node.parent, 1.0), (node.parent.parent, 0.5)):
+                if ancestor is None or ancestor.tag not in SCORED_TAGS:
+                    continue
+                if id(ancestor) not in scores:
+                    scores[id(ancestor)] = _hint_weight(ancestor)
+                    nodes[id(ancestor)] = ancestor
+                scores[id(ancestor)] += score * share
+
+    if not scores:
+        return root
+    best_id = max(scores, key=lambda key: scores[key] * (1 - link_len[key] / max(text_len[key], 1)))
+    best = nodes[best_id]
+    # Vorfahren übernehmen, solange sie kaum Text hinzufügen (Titel, Eckdaten neben der Beschreibung) oder der
+    # Treffer gegenüber der Seite zu klein ist (dann war es meist ein Teaser-Block)
+    while best.parent is not None and best.parent.tag in CANDIDATE_TAGS and id(best.parent) in text_len:
+        parent_len = text_len[id(best.parent)]
+        if parent_len > 1.3 * text_len[best_id] and text_len[best_id] >= 0.3 * text_len[id(root)]:
+            break
+        best, best_id = best.parent, id(best.parent)
+    return best
+
+
+def _text(node: Node) -> str:
+    parts: List[str] = []
+    stack: List[Union[Node, str]] = [node]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            parts.append(item)
+        elif item.tag not in DROP_TAGS:
+            stack.extend(reversed(item.children))
+    return _whitespace.sub(" ", "".join(parts)).strip()
+
+
+# === Markdown ===
+
+def _render(node: Node, out: List[str], list_depth: int) -> None:
+    for child in node.children:
+        if isinstance(child, str):
+            out.append(_whitespace.sub(" ", child))
+            continue
+        tag = child.tag
+        if _is_dropped(child):
+            continue
+        if tag == "br":
+            out.append("\n")
+        elif tag == "hr":
+            out.append("\n\n---\n\n")
+        elif tag in HEADINGS:
+            text = _text(child)
+            if text:
+                out.append(f"\n\n{'#' * HEADINGS[tag]} {text}\n\n")
+        elif tag in ("ul", "ol"):
+            out.append("\n\n" if not list_depth else "\n")
+            number = 0
+            for item in child.children:
+                if isinstance(item, str) or _is_dropped(item):
+                    continue
+                number += 1
+                marker = f"{number}. " if tag == "ol" else "- "
+                # Absätze im Listenpunkt bleiben in dessen Zeile, verschachtelte Listen behalten ihre Einrückung
+                inner: List[str] = []
+                _render(item, inner, list_depth + 1)
+                out.append(f"\n{'  ' * list_depth}{marker}{_tidy(''.join(inner)).replace(chr(10) * 2, chr(10))}")
+            out.append("\n\n" if not list_depth else "\n")
+        elif tag == "li":
+            out.append(f"\n{'  ' * max(list_depth - 1, 0)}- ")
+            _render(child, out, list_depth)
+        elif tag == "tr":
+            cells = [_text(cell) for cell in child.children if isinstance(cell, Node) and cell.tag in ("td", "th")]
+            out.append("\n" + " | ".join(cell for cell in cells if cell) + "\n")
+        elif tag == "pre":
+            out.append("\n\n```\n" + "".join(_raw_text(child)) + "\n```\n\n")
+        elif tag in ("strong", "b"):
+            text = _text(child)
+            if text:
+                out.append(f" **{text}** ")
+        elif tag in ("em", "i"):
+            text = _text(child)
+            if text:
+                out.append(f" *{text}* ")
+        elif tag in BLOCK_TAGS:
+            out.append("\n\n")
+            _render(child, out, list_depth)
+            out.append("\n\n")
+        else:
+            _render(child, out, list_depth)
+
+
+def _raw_text(node: Node) -> List[str]:
+    parts: List[str] = []
+    for child in node.children:
+        parts.extend([child] if isinstance(child, str) else _raw_text(child))
+    return parts
+
+
+def _tidy(markdown: str) -> str:
+    lines = []
+    for line in markdown.split("\n"):
+        line = line.rstrip()
+        lines.append(line if _list_line.match(line) else _whitespace.sub(" ", line).strip())
+    return _blank_lines.sub("\n\n", "\n".join(lines)).strip()
+
+
+def render(node: Node) -> str:
+    out: List[str] = []
+    _render(node, out, 0)
+    return _tidy("".join(out))
+
+
+def cap(markdown: str, max_chars: int = EXTRACT_MAX_CHARS) -> str:
+    if max_chars <= 0 or len(markdown) <= max_chars:
+        return markdown
+    cut = markdown.rfind("\n\n", 0, max_chars)
+    return markdown[:cut if cut > max_chars // 2 else max_chars].rstrip()
+
+
+def extract_markdown(page_html: str) -> Tuple[str, str]:
+    """Liefert (Markdown, Methode) mit Methode 'jsonld', 'readability' oder 'page'."""
+    builder = parse_html(page_html[:HTML_MAX_CHARS])
+    blocks = jsonld_blocks(page_html) if len(page_html) > HTML_MAX_CHARS else builder.jsonld
+    posting = find_job_posting(blocks)
+    head = ""
+    if posting:
+        head, description = job_posting_markdown(posting)
+        if len(description) >= JSONLD_MIN_CHARS:
+            return cap(f"{head}\n\n{description}".strip()), "jsonld"
+
+    content = main_content(builder.root)
+    body = render(content)
+    method = "page" if content is builder.root else "readability"
+    return cap(f"{head}\n\n{body}".strip() if head else body), method
+
+
+# === Umwandlung außerhalb der Fetch-Threads ===
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_conversion_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn statt fork: der Aufrufer hat laufende Fetch-Threads (Locks würden mitkopiert)
+            _pool = ProcessPoolExecutor(max_workers=CONVERT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+def convert_page(page_html: str) -> Tuple[str, str]:
+    """Wandelt eine Seite in einem Worker-Prozess um, damit die CPU-Arbeit die Fetch-Threads nicht über
+    den GIL ausbremst; ist der Pool defekt, wird im aktuellen Thread umgewandelt."""
+    global _pool
+    if CONVERT_WORKERS <= 0:
+        return extract_markdown(page_html)
+    try:
+        return get_conversion_pool().submit(extract_markdown, page_html).result()
+    except BrokenProcessPool:
+        with _pool_lock:
+            _pool = None
+        return extract_markdown(page_html)
@@ -0,0 +1,159 @@
+# markdown_cache.py
+# Persistenter SQLite-Cache für heruntergeladenes Markdown (Schlüssel: normalisierte Source-URL)
+
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Optional, Dict, Any
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# === Cache Config ===
+MARKDOWN_CACHE_PATH = os.getenv("MARKDOWN_CACHE_PATH", os.path.join("cache", "markdown_cache.sqlite"))
+MARKDOWN_CACHE_TTL_HOURS = float(os.getenv("MARKDOWN_CACHE_TTL_HOURS", 168))
+MARKDOWN_CACHE_MAX_MB = float(os.getenv("MARKDOWN_CACHE_MAX_MB", 500))
+
+# Query-Parameter, die nur Tracking sind und dieselbe Stelle unter anderer URL erscheinen lassen
+TRACKING_PARAMS = {"gclid", "fbclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid", "_hsenc", "_hsmi"}
+TRACKING_PREFIXES = ("utm_",)
+
+
+def normalize_url(url: str) -> str:
+    """Kleinschreibung von Schema/Host, ohne Fragment, Standard-Port und Tracking-Parameter, Query sortiert."""
+    url = (url or "").strip()
+    if not url:
+        return ""
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    port = parts.port
+    netloc = host if port is None or (scheme, port) in (("http", 80), ("https", 443)) else f"{host}:{port}"
+    path = parts.path.rstrip("/") or "/"
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in TRACKING_PARAMS and not k.lower().startswith(TRACKING_PREFIXES)
+    )
+    return urlunsplit((scheme, netloc, path, urlencode(query), ""))
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class MarkdownCache:
+    """SQLite-Cache mit TTL und LRU-Verdrängung nach Gesamtgröße; threadsicher über ein Lock."""
+
+    def __init__(self, path: str = MARKDOWN_CACHE_PATH, ttl_hours: float = MARKDOWN_CACHE_TTL_HOURS,
+                 max_mb: float = MARKDOWN_CACHE_MAX_MB):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS markdown_cache (
+                url_key      TEXT PRIMARY KEY,
+                source_url   TEXT NOT NULL,
+                content      TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                backend      TEXT NOT NULL,
+                fetched_at   REAL NOT NULL,
+                last_access  REAL NOT NULL,
+                size         INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_markdown_cache_last_access ON markdown_cache (last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM markdown_cache").fetchone()[0]
+
+    def get(self, source_url: str) -> Optional[Dict[str, Any]]:
+        key = normalize_url(source_url)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, content_hash, backend, fetched_at FROM markdown_cache WHERE url_key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if self.ttl_seconds and now - row[3] > self.ttl_seconds:
+                self._delete(key)
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE markdown_cache SET last_access = ? WHERE url_key = ?", (now, key))
+            self._conn.commit()
+        return {"content": row[0], "content_hash": row[1], "backend": row[2], "fetched_at": row[3]}
+
+    def put(self, source_url: str, content: str, backend: str) -> None:
+        key = normalize_url(source_url)
+        size = len(content.encode("utf-8"))
+        if not key or size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._delete(key)
+            self._conn.execute(
+                "INSERT INTO markdown_cache (url_key, source_url, content, content_hash, backend, fetched_at, last_access, size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, source_url, content, content_hash(content), backend, now, now, size)
+            )
+            self._total_bytes += size
+            self._evict()
+            self._conn.commit()
+
+    def _delete(self, key: str) -> None:
+        row = self._conn.execute("SELECT size FROM markdown_cache WHERE url_key = ?", (key,)).fetchone()
+        if row:
+            self._conn.execute("DELETE FROM markdown_cache WHERE url_key = ?", (key,))
+            self._total_bytes -= row[0]
+
+    def _evict(self) -> None:
+        if self._total_bytes <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in self._conn.execute(
+            "SELECT url_key, size FROM markdown_cache ORDER BY last_access ASC"
+        ).fetchall():
+            if self._total_bytes <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM markdown_cache WHERE url_key = ?", (key,))
+            self._total_bytes -= size
+            evicted += 1
+        logger.debug(f"Markdown-Cache: {evicted} Einträge verdrängt")
+
+    def purge_expired(self) -> int:
+        if not self.ttl_seconds:
+            return 0
+        with self._lock:
+            cutoff = time.time() - self.ttl_seconds
+            cur = self._conn.execute("DELETE FROM markdown_cache WHERE fetched_at < ?", (cutoff,))
+            self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM markdown_cache").fetchone()[0]
+            self._conn.commit()
+            return cur.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_cache: Optional[MarkdownCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_markdown_cache() -> MarkdownCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = MarkdownCache()
+            _cache.purge_expired()
+        return _cache
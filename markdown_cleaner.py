@@ -0,0 +1,143 @@
+# markdown_cleaner.py
+# Entfernt wiederkehrende Boilerplate (Navigation, Cookie-Banner, Footer) aus Job-Markdown
+# und kürzt jedes Dokument auf ein Token-Budget, bevor es in den Prompt geht.
+
+import os
+import re
+import logging
+from array import array
+from collections import Counter, deque
+from typing import Deque, Dict, Tuple
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# === Cleaner Config ===
+# Eine Zeile gilt als Boilerplate, wenn sie in mindestens MIN_BOILERPLATE_DOCS Dokumenten
+# derselben Domain und in mindestens BOILERPLATE_DOC_RATIO dieser Dokumente vorkommt.
+MIN_BOILERPLATE_DOCS = int(os.getenv("MIN_BOILERPLATE_DOCS", 3))
+BOILERPLATE_DOC_RATIO = float(os.getenv("BOILERPLATE_DOC_RATIO", 0.5))
+MAX_PROMPT_TOKENS = int(os.getenv("MAX_PROMPT_TOKENS", 6000))
+# Gezählt wird über die letzten BOILERPLATE_WINDOW_DOCS Dokumente des Laufs (0 = über alle), damit der
+# Speicher bei langen Läufen nicht mit der Zahl der Dokumente wächst
+BOILERPLATE_WINDOW_DOCS = int(os.getenv("BOILERPLATE_WINDOW_DOCS", 500))
+# Kürzere Zeilen ohne Link bleiben immer stehen: wiederkehrende Feldwerte wie "Vollzeit", "Unbefristet"
+# oder ein Ort sind genau das, was der Prompt für employment_type/city braucht
+BOILERPLATE_MIN_CHARS = int(os.getenv("BOILERPLATE_MIN_CHARS", 40))
+CHARS_PER_TOKEN = 4
+
+_whitespace = re.compile(r"\s+")
+_blank_runs = re.compile(r"\n{3,}")
+_link = re.compile(r"\]\(|https?://")
+
+
+def estimate_tokens(text: str) -> int:
+    """Grobe Schätzung (~4 Zeichen pro Token), reicht für Budget und Kostenbericht."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def domain_of(url: str) -> str:
+    host = (urlsplit(url or "").hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def line_key(line: str) -> int:
+    """Hash der normalisierten Zeile (0 für Leerzeilen); Zahlen statt Strings halten die Zählung klein."""
+    normalized = _whitespace.sub(" ", line).strip().lower()
+    return hash(normalized) if normalized else 0
+
+
+def may_be_boilerplate(line: str, min_chars: int = BOILERPLATE_MIN_CHARS) -> bool:
+    """Nur Zeilen mit Link (Navigation, Footer) oder ab `min_chars` Zeichen können Boilerplate sein."""
+    return len(line.strip()) >= min_chars or bool(_link.search(line))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if max_tokens <= 0 or len(text) <= max_chars:
+        return text
+    cut = text.rfind("\n", 0, max_chars)
+    return text[:cut if cut > max_chars // 2 else max_chars].rstrip()
+
+
+class BoilerplateStripper:
+    """Lernt pro Domain, welche Zeilen in vielen Dokumenten eines Laufs wiederkehren, und entfernt sie.
+
+    Mit `window` zählen nur die letzten `window` beobachteten Dokumente (über alle Domains); ältere werden
+    wieder abgezogen. Pro Dokument bleiben dafür nur die Hashes seiner Zeilen im Speicher."""
+
+    def __init__(self, min_docs: int = MIN_BOILERPLATE_DOCS, min_ratio: float = BOILERPLATE_DOC_RATIO,
+                 max_tokens: int = MAX_PROMPT_TOKENS, window: int = BOILERPLATE_WINDOW_DOCS,
+                 min_chars: int = BOILERPLATE_MIN_CHARS):
+        self.min_docs = min_docs
+        self.min_chars = min_chars
+        self.min_ratio = min_ratio
+        self.max_tokens = max_tokens
+        self.window = window
+        self._line_docs: Dict[str, Counter] = {}
+        self._doc_counts: Counter = Counter()
+        self._recent: Deque[Tuple[str, array]] = deque()
+        self.stats: Counter = Counter()
+
+    def observe(self, domain: str, text: str) -> None:
+        keys = {line_key(line) for line in text.splitlines() if may_be_boilerplate(line, self.min_chars)}
+        keys.discard(0)
+        self._line_docs.setdefault(domain, Counter()).update(keys)
+        self._doc_counts[domain] += 1
+        if not self.window:
+            return
+        self._recent.append((domain, array("q", keys)))
+        if len(self._recent) > self.window:
+            self._forget(*self._recent.popleft())
+
+    def _forget(self, domain: str, keys: array) -> None:
+        counts = self._line_docs[domain]
+        for key in keys:
+            counts[key] -= 1
+            if not counts[key]:
+                del counts[key]
+        self._doc_counts[domain] -= 1
+        if not self._doc_counts[domain]:
+            del self._doc_counts[domain]
+            del self._line_docs[domain]
+
+    def is_boilerplate(self, domain: str, key: int) -> bool:
+        docs = self._doc_counts[domain]
+        if docs < self.min_docs:
+            return False
+        count = self._line_docs[domain][key]
+        return count >= self.min_docs and count / docs >= self.min_ratio
+
+    def clean(self, domain: str, text: str) -> str:
+        # Überschriften und kurze Zeilen ohne Link bleiben stehen, auch wenn sie wiederkehren
+        kept = [
+            line for line in text.splitlines()
+            if line.lstrip().startswith("#") or not may_be_boilerplate(line, self.min_chars)
+            or not self.is_boilerplate(domain, line_key(line))
+        ]
+        cleaned = _blank_runs.sub("\n\n", "\n".join(kept)).strip()
+
+        capped = truncate_to_tokens(cleaned, self.max_tokens)
+        if len(capped) < len(cleaned):
+            self.stats["truncated"] += 1
+
+        self.stats["documents"] += 1
+        self.stats["bytes_in"] += len(text.encode("utf-8"))
+        self.stats["bytes_out"] += len(capped.encode("utf-8"))
+        self.stats["tokens_in"] += estimate_tokens(text)
+        self.stats["tokens_out"] += estimate_tokens(capped)
+        return capped
+
+    def log_summary(self) -> None:
+        if not self.stats["documents"]:
+            return
+        saved_bytes = self.stats["bytes_in"] - self.stats["bytes_out"]
+        saved_tokens = self.stats["tokens_in"] - self.stats["tokens_out"]
+        share = saved_tokens / self.stats["tokens_in"] * 100 if self.stats["tokens_in"] else 0
+        logger.info(
+            f"🧹 Bereinigt: {self.stats['documents']} Dokumente, {saved_bytes} Bytes und "
+            f"~{saved_tokens} Tokens gespart ({share:.1f}%), {self.stats['truncated']} gekürzt"
+        )
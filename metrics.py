@@ -0,0 +1,198 @@
+# metrics.py
+# Prozessweite Zähler, Histogramme und Timer für alle Stufen; Export als JSON-Zusammenfassung pro Lauf
+# und als Prometheus-Textfile (für den textfile-Collector des node_exporters).
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+METRICS_DIR = os.getenv("METRICS_DIR", "metrics")
+METRICS_PREFIX = "jobpipe_"
+# Anzahl JSON-Zusammenfassungen, die pro Stufe aufbewahrt werden (ältere werden beim Export gelöscht)
+METRICS_KEEP_RUNS = int(os.getenv("METRICS_KEEP_RUNS", 50))
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BATCH_DURATION_BUCKETS = (60, 300, 900, 1800, 3600, 7200, 14400, 28800, 57600, 86400)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, q: float) -> float:
+        """Obergrenze des Buckets, in dem das Quantil liegt (über dem letzten Bucket: Maximum)."""
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        if not self.count:
+            return {"count": 0}
+        return {"count": self.count, "sum": round(self.sum, 6), "avg": round(self.sum / self.count, 6),
+                "min": round(self.min, 6), "max": round(self.max, 6),
+                "p50": self.quantile(0.5), "p95": self.quantile(0.95)}
+
+
+class Metrics:
+    """Threadsichere Registry; Metriken werden beim ersten Zugriff angelegt."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.counters: Dict[str, Dict[LabelKey, float]] = {}
+        self.gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self.histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self.gauges.setdefault(name, {})[_labels(labels)] = value
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS, **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram(buckets)
+            series[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, buckets: Sequence[float] = LATENCY_BUCKETS, **labels) -> Iterator[Dict[str, object]]:
+        """Misst die Dauer des Blocks in Sekunden; Labels können im Block über das gelieferte Dict ergänzt werden."""
+        extra: Dict[str, object] = {}
+        start = time.perf_counter()
+        try:
+            yield extra
+        finally:
+            self.observe(name, time.perf_counter() - start, buckets, **labels, **extra)
+
+    def summary(self) -> Dict[str, object]:
+        def render(series: Dict[LabelKey, object], value) -> Dict[str, object]:
+            return {",".join(f"{k}={v}" for k, v in key) or "_": value(item) for key, item in series.items()}
+
+        with self._lock:
+            return {
+                "started_at": self.started_at,
+                "duration_seconds": round(time.time() - self.started_at, 3),
+                "counters": {name: render(series, lambda v: v) for name, series in sorted(self.counters.items())},
+                "gauges": {name: render(series, lambda v: v) for name, series in sorted(self.gauges.items())},
+                "histograms": {name: render(series, Histogram.summary) for name, series in sorted(self.histograms.items())},
+            }
+
+    def prometheus(self, stage: str) -> str:
+        """Textfile einer Stufe. Jede Serie trägt das Label `stage`, damit die Dateien aller Stufen im selben
+        Verzeichnis keine doppelten Serien erzeugen. Zähler gelten nur für den letzten Lauf und werden deshalb
+        als Gauges exportiert; Histogramme bleiben Histogramme (Rücksetzer wertet rate() als Neustart)."""
+        def fmt(name: str, key: LabelKey, value: float, extra: Optional[Tuple[str, str]] = None) -> str:
+            pairs = [("stage", stage)] + [pair for pair in key if pair[0] != "stage"] + ([extra] if extra else [])
+            labels = ",".join(f'{k}="{v}"' for k, v in pairs)
+            return f"{name}{{{labels}}} {value}"
+
+        lines: List[str] = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                full = f"{METRICS_PREFIX}{name}"
+                lines.append(f"# TYPE {full} gauge")
+                lines.extend(fmt(full, key, value) for key, value in series.items())
+            for name, series in sorted(self.gauges.items()):
+                full = f"{METRICS_PREFIX}{name}"
+                lines.append(f"# TYPE {full} gauge")
+                lines.extend(fmt(full, key, value) for key, value in series.items())
+            for name, series in sorted(self.histograms.items()):
+                full = f"{METRICS_PREFIX}{name}"
+                lines.append(f"# TYPE {full} histogram")
+                for key, hist in series.items():
+                    cumulative = 0
+                    for bound, count in zip(hist.buckets, hist.counts):
+                        cumulative += count
+                        lines.append(fmt(f"{full}_bucket", key, cumulative, ("le", str(bound))))
+                    lines.append(fmt(f"{full}_bucket", key, hist.count, ("le", "+Inf")))
+                    lines.append(fmt(f"{full}_sum", key, round(hist.sum, 6)))
+                    lines.append(fmt(f"{full}_count", key, hist.count))
+            lines.append(f"# TYPE {METRICS_PREFIX}last_run_timestamp_seconds gauge")
+            lines.append(fmt(f"{METRICS_PREFIX}last_run_timestamp_seconds", (), f"{time.time():.0f}"))
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self.started_at = time.time()
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+
+def _write_atomic(path: str, text: str) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+metrics = Metrics()
+
+inc = metrics.inc
+set_gauge = metrics.set
+observe = metrics.observe
+timer = metrics.timer
+
+
+def prune_summaries(stage: str, metrics_dir: str = METRICS_DIR, keep: int = METRICS_KEEP_RUNS) -> None:
+    """Löscht bis auf die `keep` neuesten alle JSON-Zusammenfassungen einer Stufe (Zeitstempel sortieren lexikalisch)."""
+    prefix = f"{stage}-"
+    names = sorted(name for name in os.listdir(metrics_dir) if name.startswith(prefix) and name.endswith(".json")
+                   and name[len(prefix):-len(".json")].replace("-", "").isdigit())
+    for name in names[:max(0, len(names) - keep)]:
+        os.remove(os.path.join(metrics_dir, name))
+
+
+def export(stage: str, metrics_dir: str = METRICS_DIR) -> List[str]:
+    """Schreibt <stage>.prom (wird je Lauf ersetzt) und, falls der Lauf etwas gezählt hat,
+    <stage>-<Zeitstempel>.json als Lauf-Zusammenfassung. Leerläufe aus Cron erzeugen so keine JSON-Dateien;
+    von den Zusammenfassungen bleiben pro Stufe die METRICS_KEEP_RUNS neuesten erhalten."""
+    os.makedirs(metrics_dir, exist_ok=True)
+    prom_path = os.path.join(metrics_dir, f"{stage}.prom")
+    _write_atomic(prom_path, metrics.prometheus(stage))
+    paths = [prom_path]
+    if metrics.counters:
+        json_path = os.path.join(metrics_dir, f"{stage}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+        _write_atomic(json_path, json.dumps(dict(metrics.summary(), stage=stage), ensure_ascii=False, indent=2))
+        paths.append(json_path)
+        prune_summaries(stage, metrics_dir)
+    return paths
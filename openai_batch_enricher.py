@@ -6,13 +6,17 @@ import json
 import uuid
 import logging
 import argparse
-from typing import List, Dict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import gspread
 from dotenv import load_dotenv
 from jinja2 import Template
 from oauth2client.service_account import ServiceAccountCredentials
 
+from markdown_cleaner import estimate_tokens
+
 # === ENV & Logging ===
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
@@ -25,6 +29,13 @@ PROMPT_USER_TEMPLATE_PATH = "prompts/ai_search_user_template.txt"
 GOOGLE_SERVICE_ACCOUNT_FILE = os.getenv("GOOGLE_SERVICE_ACCOUNT_FILE")
 GOOGLE_SHEET_ID = os.getenv("GOOGLE_SHEET_ID")
 PROMPT_SHEET = os.getenv("PROMPT_SHEET", "JOB_AI_PROMPTS")
+# Ab ENRICH_PARALLEL_MIN_ROWS Zeilen wird in ENRICH_WORKERS Prozessen gerendert
+ENRICH_WORKERS = int(os.getenv("ENRICH_WORKERS", os.cpu_count() or 1))
+ENRICH_PARALLEL_MIN_ROWS = int(os.getenv("ENRICH_PARALLEL_MIN_ROWS", 500))
+ENRICH_CHUNK_ROWS = 100
+
+# Im Hauptprozess und in jedem Worker einmal kompiliert (siehe init_templates)
+_templates: Dict[str, Template] = {}
 
 # === FUNCTIONS ===
 
@@ -36,75 +47,101 @@ def init_sheet():
     client = gspread.authorize(creds)
     return client.open_by_key(GOOGLE_SHEET_ID).worksheet(PROMPT_SHEET)
 
-def load_prompts() -> Dict[str, Template]:
+def load_prompt_sources() -> Dict[str, str]:
     with open(PROMPT_SYSTEM_PATH, "r", encoding="utf-8") as f:
-        system_prompt = Template(f.read())
+        system_source = f.read()
     with open(PROMPT_USER_TEMPLATE_PATH, "r", encoding="utf-8") as f:
-        user_prompt = Template(f.read())
-    return {"system": system_prompt, "user": user_prompt}
-
-def build_batch_items(rows: List[Dict], templates: Dict[str, Template]) -> List[Dict]:
-    items = []
-    for row in rows:
-        try:
-            custom_id = row.get("id") or str(uuid.uuid4())
-            user_content = templates["user"].render(**row)
-            system_content = templates["system"].render(**row)
-
-            messages = [
-                {"role": "system", "content": system_content},
-                {"role": "user", "content": user_content},
-            ]
-
-            items.append({
-                "custom_id": custom_id,
-                "method": "POST",
-                "url": "/v1/chat/completions",
-                "body": {
-                    "model": "gpt-4o",
-                    "temperature": 0.2,
-                    "messages": messages
-                }
-            })
-        except Exception as e:
-            logger.warning(f"⚠️ Fehler bei Zeile {row.get('id')}: {e}")
-    return items
-
-def save_batch_file(batch_items: List[Dict], filename: str) -> str:
-    if not os.path.exists(BATCH_DIR):
-        os.makedirs(BATCH_DIR)
-    path = os.path.join(BATCH_DIR, filename)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(batch_items, f, ensure_ascii=False, indent=2)
-    logger.info(f"💾 Batch gespeichert: {path}")
-    return path
+        user_source = f.read()
+    return {"system": system_source, "user": user_source}
+
+def init_templates(sources: Dict[str, str]) -> None:
+    global _templates
+    _templates = {name: Template(source) for name, source in sources.items()}
+
+def render_request_line(row: Dict[str, Any]) -> Optional[Tuple[str, bytes, int]]:
+    """Rendert beide Templates für eine Zeile und liefert (custom_id, JSONL-Zeile, geschätzte Tokens) oder None."""
+    try:
+        custom_id = str(row.get("id") or uuid.uuid4())
+        messages = [
+            {"role": "system", "content": _templates["system"].render(**row)},
+            {"role": "user", "content": _templates["user"].render(**row)},
+        ]
+        line = json.dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": "gpt-4o",
+                "temperature": 0.2,
+                "messages": messages
+            }
+        }) + "\n"
+        return custom_id, line.encode("utf-8"), sum(estimate_tokens(m["content"]) for m in messages)
+    except Exception as e:
+        logger.warning(f"⚠️ Fehler bei Zeile {row.get('id')}: {e}")
+        return None
+
+def iter_request_lines(rows: List[Dict[str, Any]], sources: Dict[str, str],
+                       workers: int = ENRICH_WORKERS) -> Iterator[Tuple[str, bytes, int]]:
+    """Liefert die Request-Zeilen in Sheet-Reihenfolge; große Sheets werden fensterweise im Prozesspool
+    gerendert, sodass nie mehr als ein Fenster fertiger Zeilen im Speicher liegt."""
+    if workers <= 1 or len(rows) < ENRICH_PARALLEL_MIN_ROWS:
+        init_templates(sources)
+        yield from filter(None, map(render_request_line, rows))
+        return
+
+    window = workers * ENRICH_CHUNK_ROWS * 4
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_templates, initargs=(sources,)) as executor:
+        it = iter(rows)
+        while True:
+            batch = list(islice(it, window))
+            if not batch:
+                break
+            yield from filter(None, executor.map(render_request_line, batch, chunksize=ENRICH_CHUNK_ROWS))
+
+def convert_legacy_file(path: str) -> str:
+    """Alte Retry-Dateien waren ein eingerücktes JSON-Array; sie werden einmalig nach JSONL umgeschrieben."""
+    with open(path, "r", encoding="utf-8") as f:
+        is_array = f.read(1) == "["
+    if not is_array:
+        return path
+    with open(path, "r", encoding="utf-8") as f:
+        items = json.load(f)
+    jsonl_path = os.path.join(BATCH_DIR, f"{uuid.uuid4()}.json")
+    with open(jsonl_path, "w", encoding="utf-8") as f:
+        for item in items:
+            f.write(json.dumps(item) + "\n")
+    logger.info(f"🔄 {path} nach JSONL umgeschrieben: {jsonl_path}")
+    return jsonl_path
 
 def main(dry_run=False, retry_path=None):
+    from openai_batch_submitter import write_line_shards, submit_shards, resend_batch_from_file
+    from state_store import ENRICH_KIND
+
     if retry_path:
         logger.info(f"🔁 Wiederhole Batch von Datei: {retry_path}")
-        with open(retry_path, "r", encoding="utf-8") as f:
-            batch_items = json.load(f)
-    else:
-        sheet = init_sheet()
-        rows = sheet.get_all_records()
-        templates = load_prompts()
-        batch_items = build_batch_items(rows, templates)
-
-    if not batch_items:
-        logger.warning("⚠️ Keine gültigen Batch-Einträge vorhanden.")
+        batch_path = convert_legacy_file(retry_path)
+        if not dry_run:
+            resend_batch_from_file(batch_path, kind=ENRICH_KIND)
         return
 
-    batch_filename = f"{uuid.uuid4()}.json"
-    batch_path = save_batch_file(batch_items, batch_filename)
+    sheet = init_sheet()
+    rows = sheet.get_all_records()
+    shards = write_line_shards(iter_request_lines(rows, load_prompt_sources()))
+    written = sum(len(shard["custom_ids"]) for shard in shards)
+    if not written:
+        logger.warning("⚠️ Keine gültigen Batch-Einträge vorhanden.")
+        return
+    logger.info(f"💾 {written} Requests gespeichert: {', '.join(shard['path'] for shard in shards)}")
 
+    # Als eigene Art vermerkt: Poller und Fetcher holen die Antworten, ins Job-Sheet werden sie nicht übernommen
     if not dry_run:
-        from openai_batch_submitter import submit_batch  # Dynamisch importieren
-        submit_batch(batch_items, json_path=batch_path)
+        submit_shards(shards, kind=ENRICH_KIND)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--live", action="store_true", help="Batch wirklich abschicken")
-    parser.add_argument("--retry", type=str, help="Pfad zu existierender JSON-Datei")
+    parser.add_argument("--retry", type=str, help="Pfad zu existierender Batch-Datei (JSONL, wird unverändert hochgeladen)")
     args = parser.parse_args()
 
     main(dry_run=not args.live, retry_path=args.retry)
@@ -1,30 +1,96 @@
+# openai_batch_fetcher.py
+# Lädt Ergebnis- und Fehlerdateien fertiger Batches gestreamt nach batches/
+
 import os
-import json
 import logging
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
 from dotenv import load_dotenv
 
+from state_store import get_state_store
+from openai_client import get_openai_client
+
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 logger = logging.getLogger("__main__")
 logging.basicConfig(level=logging.INFO)
 
 BATCH_DIR = "batches"
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", 4))
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def output_path_for(batch_id: str) -> str:
+    return os.path.join(BATCH_DIR, f"{batch_id}.jsonl")
+
+
+def error_path_for(batch_id: str) -> str:
+    return os.path.join(BATCH_DIR, f"{batch_id}_errors.jsonl")
+
+
+def download_file(file_id: str, output_path: str, files_client: Any = None) -> bool:
+    """Streamt eine Datei in Chunks nach `output_path` (über .part + atomarem Rename); False, wenn schon vorhanden."""
+    if os.path.exists(output_path):
+        logger.info(f"⏭️ Bereits heruntergeladen: {output_path}")
+        return False
+
+    files_client = files_client or get_openai_client()
+    tmp_path = f"{output_path}.part"
+    try:
+        with files_client.files.with_streaming_response.content(file_id) as response:
+            with open(tmp_path, "wb") as f:
+                for chunk in response.iter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+        os.replace(tmp_path, output_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    logger.info(f"📄 Gespeichert unter: {output_path}")
+    return True
+
+
+def fetch_batch_files(record: Dict[str, Any], files_client: Any = None) -> List[str]:
+    """Lädt Output- und Error-Datei eines Batches und markiert ihn als 'fetched'; liefert neu geschriebene Pfade."""
+    batch_id = record["batch_id"]
+    written = []
+    targets = [(record.get("output_file_id"), output_path_for(batch_id)),
+               (record.get("error_file_id"), error_path_for(batch_id))]
+
+    if not any(file_id for file_id, _ in targets):
+        logger.warning(f"Keine Ergebnisse vorhanden für {batch_id}")
+        return written
+
+    paths = {}
+    for file_id, path in targets:
+        if not file_id:
+            continue
+        logger.info(f"📄 Lade {os.path.basename(path)} aus File-ID: {file_id}")
+        try:
+            if download_file(file_id, path, files_client):
+                written.append(path)
+            paths[file_id] = path
+        except Exception as e:
+            logger.error(f"❌ Download von {file_id} für {batch_id} fehlgeschlagen: {e}")
+            return written  # bleibt 'completed' und wird beim nächsten Lauf erneut versucht
+
+    get_state_store().mark_fetched(
+        record["shard_id"], paths.get(record.get("output_file_id")), paths.get(record.get("error_file_id"))
+    )
+    return written
+
+
+def fetch_all(max_workers: int = DOWNLOAD_WORKERS, files_client: Any = None) -> List[str]:
+    """Lädt die Dateien aller fertigen Batches parallel herunter."""
+    records = get_state_store().batches_in_state("completed")
+    if not records:
+        logger.info("📭 Keine fertigen Batches zum Herunterladen.")
+        return []
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(records)))) as executor:
+        results = executor.map(lambda record: fetch_batch_files(record, files_client), records)
+        return [path for paths in results for path in paths]
+
 
-for fname in os.listdir(BATCH_DIR):
-    if fname.endswith("_status.json"):
-        with open(os.path.join(BATCH_DIR, fname), "r", encoding="utf-8") as f:
-            status = json.load(f)
-
-        if status.get("output_file_id"):
-            file_id = status["output_file_id"]
-            batch_id = status["id"]
-            logger.info(f"📄 Lade Ergebnisse aus File-ID: {file_id}")
-            contents = client.files.content(file_id)
-            output_path = os.path.join(BATCH_DIR, f"{batch_id}.jsonl")
-            with open(output_path, "w", encoding="utf-8") as f:
-                f.write(contents.text)
-            logger.info(f"📄 Ergebnisse gespeichert unter: {output_path}")
-        else:
-            logger.warning(f"Keine Ergebnisse vorhanden in {fname}")
\ No newline at end of file
+if __name__ == "__main__":
+    fetch_all()
@@ -1,68 +1,201 @@
 # openai_batch_poller.py
-# Überwacht laufende OpenAI-Batches und speichert Status + .meta-Datei
+# Überwacht laufende OpenAI-Batches und hält ihren Endstatus im Zustandsspeicher fest
 
 import os
-import json
 import time
+import heapq
 import logging
-from openai import OpenAI
+from typing import Any, Callable, Dict, Optional
 from dotenv import load_dotenv
 
+import metrics
+from state_store import get_state_store, SYNC_BATCH_PREFIX
+from openai_client import get_openai_client
+
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 logger = logging.getLogger("__main__")
 logging.basicConfig(level=logging.INFO)
 
-BATCH_DIR = "batches"
-POLL_INTERVAL = 10
-
-
-def poll_batch_until_done(batch_id: str):
-    while True:
-        batch = client.batches.retrieve(batch_id)
-        logger.info(f"📦 Batch {batch.id} Status: {batch.status}")
-
-        if batch.status in ["completed", "failed", "cancelled"]:
-            return batch
-
-        time.sleep(POLL_INTERVAL)
-
-
-def list_batch_files():
-    return [f for f in os.listdir(BATCH_DIR) if f.endswith(".batch_id")]
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", 10))
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", 900))
+POLL_BACKOFF_FACTOR = float(os.getenv("POLL_BACKOFF_FACTOR", 2))
+# Nach so vielen fehlgeschlagenen Abfragen in Folge wird ein Batch in diesem Lauf nicht weiter überwacht
+POLL_MAX_ERRORS = int(os.getenv("POLL_MAX_ERRORS", 20))
+
+TERMINAL_STATUSES = {"completed", "failed", "cancelled", "expired"}
+
+
+class BatchSchedule:
+    """Merkt sich Fortschritt und aktuelles Intervall eines Batches für die adaptive Abfrage."""
+
+    def __init__(self, batch_id: str, shard_id: Optional[str], now: float):
+        self.batch_id = batch_id
+        self.shard_id = shard_id
+        self.interval = POLL_INTERVAL
+        self.done = 0
+        self.seen_at = now
+        self.started_at = now
+        self.errors = 0  # fehlgeschlagene Abfragen in Folge
+
+    def next_interval(self, batch: Any, now: float) -> float:
+        counts = getattr(batch, "request_counts", None)
+        total = getattr(counts, "total", 0) or 0
+        done = (getattr(counts, "completed", 0) or 0) + (getattr(counts, "failed", 0) or 0)
+
+        if batch.status in ("validating", "finalizing"):
+            # Kurz vor einem Statuswechsel lohnt sich engmaschiges Abfragen
+            self.interval = POLL_INTERVAL
+        elif done > self.done and total:
+            # Restlaufzeit aus der bisherigen Rate schätzen und etwa zur Hälfte wieder nachsehen
+            rate = (done - self.done) / max(now - self.seen_at, 1e-6)
+            remaining = (total - done) / rate
+            self.interval = min(max(remaining / 2, POLL_INTERVAL), POLL_MAX_INTERVAL)
+        else:
+            self.interval = min(self.interval * POLL_BACKOFF_FACTOR, POLL_MAX_INTERVAL)
+
+        if done != self.done:
+            self.done = done
+            self.seen_at = now
+        return self.interval
+
+
+def completion_seconds(batch: Any, polled_seconds: float) -> float:
+    """Laufzeit laut Provider-Zeitstempeln; ohne diese die vom Poller beobachtete Zeit."""
+    created = getattr(batch, "created_at", None)
+    ended = next((getattr(batch, field, None) for field in ("completed_at", "failed_at", "expired_at", "cancelled_at")
+                  if getattr(batch, field, None)), None)
+    return float(ended - created) if created and ended else polled_seconds
+
+
+def is_permanent_error(error: Exception) -> bool:
+    """4xx außer 408/429 (z. B. 404 für gelöschte oder alte Batch-IDs, 400): erneutes Abfragen hilft nicht."""
+    status = getattr(error, "status_code", None)
+    return isinstance(status, int) and 400 <= status < 500 and status not in (408, 429)
+
+
+class _Lost:
+    """Ersatz für das Batch-Objekt eines Batches, den der Provider nicht (mehr) kennt."""
+
+    def __init__(self, batch_id: str, error: Exception):
+        self.id = batch_id
+        self.error = error
+
+    def model_dump(self) -> Dict[str, Any]:
+        return {"id": self.id, "status": "failed", "errors": str(self.error)}
+
+
+def abandon_batch(batch_id: str, shard_id: Optional[str], error: Exception) -> None:
+    """Vermerkt einen nicht abfragbaren Batch als 'failed'; seine Zeilen gibt der nächste Extract-Lauf frei."""
+    finalize_batch(_Lost(batch_id, error), shard_id)
+
+
+def finalize_batch(batch: Any, shard_id: Optional[str]) -> None:
+    """Schreibt Endstatus und File-IDs in den Zustandsspeicher."""
+    store = get_state_store()
+    if shard_id is None:
+        record = store.find_by_batch_id(batch.id)
+        if record is None:
+            logger.warning(f"⚠️ Batch {batch.id} ist nicht im Zustandsspeicher, Status wird nicht gespeichert.")
+            return
+        shard_id = record["shard_id"]
+
+    if store.mark_finished(shard_id, batch.model_dump()):
+        logger.info(f"✅ Status von {batch.id} gespeichert (Shard {shard_id})")
+
+
+def poll_batches(batches: Dict[str, Optional[str]], batches_client: Any = None,
+                 sleep: Callable[[float], None] = time.sleep, clock: Callable[[], float] = time.monotonic,
+                 on_finished: Callable[[Any, Optional[str]], None] = finalize_batch,
+                 refill: Optional[Callable[[], Dict[str, Optional[str]]]] = None,
+                 on_lost: Callable[[str, Optional[str], Exception], None] = abandon_batch,
+                 max_errors: int = POLL_MAX_ERRORS) -> Dict[str, Any]:
+    """Überwacht alle Batches gleichzeitig; jeder Batch hat sein eigenes, adaptives Abfrageintervall.
+
+    `batches` bildet Batch-ID -> Shard-ID im Zustandsspeicher ab. Fertige Batches werden sofort
+    über `on_finished` abgeschlossen, unabhängig davon, wie lange die anderen noch laufen.
+    `refill` wird nach jedem fertigen Batch aufgerufen und liefert neu gestartete Batches
+    (z. B. aus der Token-Budget-Warteschlange), die ab dann mit überwacht werden.
+    Dauerhafte Abfragefehler (siehe is_permanent_error) beenden einen Batch über `on_lost`; nach `max_errors`
+    anderen Fehlern in Folge wird er in diesem Lauf nicht weiter abgefragt und bleibt 'submitted'.
+    """
+    batches_client = batches_client or get_openai_client()
+    now = clock()
+    schedules = {batch_id: BatchSchedule(batch_id, shard_id, now) for batch_id, shard_id in batches.items()}
+    queue = [(now, batch_id) for batch_id in schedules]
+    heapq.heapify(queue)
+    finished: Dict[str, Any] = {}
+
+    while queue:
+        due, batch_id = heapq.heappop(queue)
+        wait = due - clock()
+        if wait > 0:
+            sleep(wait)
+
+        schedule = schedules[batch_id]
+        try:
+            batch = batches_client.batches.retrieve(batch_id)
+            metrics.inc("poll_requests_total")
+        except Exception as e:
+            metrics.inc("poll_errors_total")
+            schedule.errors += 1
+            if is_permanent_error(e):
+                logger.error(f"❌ Batch {batch_id} kann nicht abgefragt werden, wird als fehlgeschlagen vermerkt: {e}")
+                metrics.inc("batches_finished_total", status="lost")
+                on_lost(batch_id, schedule.shard_id, e)
+                continue
+            if schedule.errors >= max_errors:
+                logger.error(f"❌ Batch {batch_id}: {schedule.errors} Abfragen in Folge fehlgeschlagen, "
+                             f"wird erst beim nächsten Lauf wieder überwacht: {e}")
+                continue
+            schedule.interval = min(schedule.interval * POLL_BACKOFF_FACTOR, POLL_MAX_INTERVAL)
+            logger.warning(f"⚠️ Abfrage von Batch {batch_id} fehlgeschlagen, neuer Versuch in {schedule.interval:.0f}s: {e}")
+            heapq.heappush(queue, (clock() + schedule.interval, batch_id))
+            continue
+
+        schedule.errors = 0
+        now = clock()
+        if batch.status in TERMINAL_STATUSES:
+            logger.info(f"🏁 Batch {batch.id} beendet mit Status {batch.status} nach {now - schedule.started_at:.0f}s")
+            metrics.inc("batches_finished_total", status=batch.status)
+            metrics.observe("batch_completion_seconds", completion_seconds(batch, now - schedule.started_at),
+                            metrics.BATCH_DURATION_BUCKETS, status=batch.status)
+            on_finished(batch, schedule.shard_id)
+            finished[batch_id] = batch
+            for new_id, shard_id in (refill() if refill else {}).items():
+                if new_id not in schedules:
+                    schedules[new_id] = BatchSchedule(new_id, shard_id, now)
+                    heapq.heappush(queue, (now, new_id))
+            continue
+
+        interval = schedule.next_interval(batch, now)
+        logger.info(f"📦 Batch {batch.id} Status: {batch.status} ({schedule.done} erledigt), nächste Abfrage in {interval:.0f}s")
+        heapq.heappush(queue, (now + interval, batch_id))
+
+    return finished
+
+
+def list_submitted_batches() -> Dict[str, str]:
+    """Laufende Batches der Batch-API; direkt gesendete Shards (sync_-IDs) laufen im Prozess des Senders."""
+    return {record["batch_id"]: record["shard_id"] for record in get_state_store().batches_in_state("submitted")
+            if not record["batch_id"].startswith(SYNC_BATCH_PREFIX)}
+
+
+def poll_submitted() -> Dict[str, Any]:
+    """Überwacht alle laufenden Batches; frei werdendes Token-Budget wird sofort mit wartenden Shards gefüllt."""
+    from token_scheduler import get_scheduler
+
+    scheduler = get_scheduler()
+    scheduler.release()
+    tracked = list_submitted_batches()
+    if not tracked:
+        logger.info("📬 Keine laufenden Batches zum Überwachen gefunden.")
+        return {}
+
+    for batch_id in tracked:
+        logger.info(f"👀 Überwache Batch-ID: {batch_id}")
+    return poll_batches(tracked, refill=scheduler.release)
 
 
 if __name__ == "__main__":
-    batch_files = list_batch_files()
-    print(batch_files)
-    if not batch_files:
-        logger.info("📬 Keine Batch-Dateien zum Überwachen gefunden.")
-        exit(0)
-
-    for file in batch_files:
-        print(file)
-        path = os.path.join(BATCH_DIR, file)
-        with open(path, "r") as f:
-            batch_id = f.read().strip()
-
-        logger.info(f"👀 Überwache Batch-ID: {batch_id}")
-        result = poll_batch_until_done(batch_id)
-
-        # Speichere Status
-        status_path = os.path.join(BATCH_DIR, f"{batch_id}_status.json")
-        with open(status_path, "w", encoding="utf-8") as f:
-            json.dump(result.model_dump(), f, ensure_ascii=False, indent=2)
-        logger.info(f"✅ Status gespeichert unter: {os.path.basename(status_path)}")
-
-        # Schreibe Meta-Datei für spätere Archivierung
-        meta_path = os.path.join(BATCH_DIR, f"{batch_id}.meta")
-        with open(meta_path, "w", encoding="utf-8") as f:
-            input_file_name = result.input_file_id.replace("file-", "") + ".json"
-            f.write(f"{input_file_name}\n")
-            f.write(f"{batch_id}_status.json\n")
-            f.write(f"{file}\n")  # ursprüngliche .batch_id Datei
-        logger.info(f"📜 Meta-Datei geschrieben: {os.path.basename(meta_path)}")
-
-        # Entferne .batch_id Datei
-        os.remove(path)
+    poll_submitted()
@@ -2,17 +2,23 @@
 # Verarbeitet lokale Batch-Ausgabe (.jsonl) und schreibt Daten ins Google Sheet
 
 import os
-import json
+import time
+import random
 import logging
-import re
-import shutil
-import zipfile
-from typing import Dict, Any
+from collections import Counter
+from typing import Callable, Dict, Any, List, Optional, Set
 
 import gspread
+import requests
 from dotenv import load_dotenv
 from oauth2client.service_account import ServiceAccountCredentials
 from gspread import Worksheet
+from gspread.utils import rowcol_to_a1
+
+import metrics
+from state_store import get_state_store, watermark_key, JOBS_KIND
+from batch_archive import get_batch_archive
+from result_parser import iter_jsonl, parse_response_content, log_failures
 
 # === Load environment ===
 load_dotenv()
@@ -23,10 +29,18 @@ logger = logging.getLogger(__name__)
 
 # === Environment Config ===
 BATCH_DIR = "batches"
-ARCHIVE_DIR = os.path.join(BATCH_DIR, "archive")
 GOOGLE_SHEET_ID = os.getenv("GOOGLE_SHEET_ID")
 SHEET_NAME = os.getenv("SHEET_NAME", "JOB_COLLECTOR")
 GOOGLE_SERVICE_ACCOUNT_FILE = os.getenv("GOOGLE_SERVICE_ACCOUNT_FILE")
+# Anzahl Zellen pro batch_update-Aufruf (ein API-Request pro Chunk)
+SHEET_WRITE_CHUNK_SIZE = int(os.getenv("SHEET_WRITE_CHUNK_SIZE", 500))
+# Wiederholungen eines Chunks bei Quota- (429) und Serverfehlern, danach bleibt der Batch 'fetched'
+SHEET_WRITE_RETRIES = int(os.getenv("SHEET_WRITE_RETRIES", 5))
+SHEET_BACKOFF_BASE = 2.0
+SHEET_BACKOFF_MAX = 64.0
+# Fehlgeschlagene Requests werden bis zu dieser Gesamtzahl an Versuchen in Retry-Shards erneut gesendet
+MAX_REQUEST_ATTEMPTS = int(os.getenv("MAX_REQUEST_ATTEMPTS", 3))
+EXHAUSTED_STATUS = "AI failed"
 
 # === Field Mapping ===
 FIELD_MAPPING = {
@@ -47,24 +61,11 @@ def init_gsheet() -> Worksheet:
     gclient = gspread.authorize(creds)
     return gclient.open_by_key(GOOGLE_SHEET_ID).worksheet(SHEET_NAME)
 
-def load_jsonl(filepath: str):
-    with open(filepath, "r", encoding="utf-8") as f:
-        for line in f:
-            try:
-                yield json.loads(line)
-            except json.JSONDecodeError as e:
-                logger.warning(f"⚠️ Fehler beim Parsen der Zeile in {filepath}: {e}")
-
-def extract_json_from_content(content: str) -> Dict:
-    try:
-        match = re.search(r"```(?:json)?\n(.*?)\n```", content, re.DOTALL)
-        if match:
-            content = match.group(1)
-        content = content.strip()
-        return json.loads(content)
-    except Exception as e:
-        logger.warning(f"⚠️ Fehler beim Parsen der GPT-Antwort: {e}")
-        return {}
+def load_jsonl(filepath: str, failures: Optional[Counter] = None):
+    return iter_jsonl(filepath, failures)
+
+def extract_json_from_content(content: str, failures: Optional[Counter] = None) -> Dict:
+    return parse_response_content(content, failures)
 
 def flatten_value(value: Any) -> str:
     if isinstance(value, dict):
@@ -81,102 +82,317 @@ def flatten_value(value: Any) -> str:
         return "\n".join(map(str, value))
     return str(value)
 
-def update_sheet_with_results(sheet: Worksheet, results_file: str):
+def get_header_map(sheet: Worksheet) -> Dict[str, int]:
+    """Liest die Kopfzeile einmalig und liefert Spaltenname -> Spaltennummer (1-basiert)."""
+    header = sheet.row_values(1)
+    metrics.inc("sheet_api_calls_total", op="row_values")
+    return {name: idx + 1 for idx, name in enumerate(header) if name}
+
+def cell_update(row: int, col: int, value: str) -> Dict[str, Any]:
+    return {"range": rowcol_to_a1(row, col), "values": [[value]]}
+
+def build_id_index(ids: List[Any]) -> Dict[str, int]:
+    """Baut den Index id -> row_index (0-basiert, ohne Kopfzeile); bei Duplikaten gewinnt die erste Zeile."""
+    index: Dict[str, int] = {}
+    duplicates: Dict[str, List[int]] = {}
+    for idx, value in enumerate(ids):
+        job_id = str(value).strip()
+        if not job_id:
+            continue
+        if job_id in index:
+            duplicates.setdefault(job_id, [index[job_id] + 2]).append(idx + 2)
+            continue
+        index[job_id] = idx
+
+    for job_id, sheet_rows in duplicates.items():
+        logger.warning(f"⚠️ Doppelte ID {job_id} in Zeilen {', '.join(map(str, sheet_rows))}, nutze Zeile {sheet_rows[0]}")
+    return index
+
+def load_id_index(sheet: Worksheet, header_map: Dict[str, int]) -> Dict[str, int]:
+    if "id" not in header_map:
+        logger.error("❌ Spalte 'id' nicht im Sheet gefunden.")
+        return {}
+    metrics.inc("sheet_api_calls_total", op="col_values")
+    return build_id_index(sheet.col_values(header_map["id"])[1:])
+
+def resolve_claimed_rows(sheet: Worksheet, header_map: Dict[str, int], row_indices: Dict[str, int]) -> Dict[str, int]:
+    """Übernimmt die beim Claimen gespeicherten Zeilen direkt; ein einziger Lesezugriff auf den id-Ausschnitt
+    prüft, dass sich das Sheet seitdem nicht verschoben hat. Nicht bestätigte IDs fehlen im Ergebnis."""
+    if not row_indices or "id" not in header_map:
+        return {}
+    first, last = min(row_indices.values()), max(row_indices.values())
+    col = header_map["id"]
+    values = sheet.batch_get([f"{rowcol_to_a1(first + 2, col)}:{rowcol_to_a1(last + 2, col)}"])[0]
+    metrics.inc("sheet_api_calls_total", op="batch_get")
+
+    resolved = {}
+    for row_id, idx in row_indices.items():
+        offset = idx - first
+        if offset < len(values) and values[offset] and str(values[offset][0]) == row_id:
+            resolved[row_id] = idx
+    if len(resolved) < len(row_indices):
+        logger.warning(f"⚠️ {len(row_indices) - len(resolved)} beanspruchte Zeilen haben sich verschoben, suche per ID")
+    return resolved
+
+def update_sheet_with_results(sheet: Worksheet, results_file: str, chunk_size: int = SHEET_WRITE_CHUNK_SIZE,
+                              header_map: Optional[Dict[str, int]] = None, id_index: Optional[Dict[str, int]] = None,
+                              row_ids: Optional[Dict[str, List[str]]] = None, failed_ids: Optional[Set[str]] = None):
+    """Schreibt alle verwertbaren Antworten ins Sheet. Ist `failed_ids` gesetzt, landen die custom_ids ohne
+    verwertbare Antwort dort (für einen Retry-Shard), sonst werden ihre Zeilen wieder auf 'neu' gesetzt."""
     logger.info(f"📥 Verarbeite Datei: {results_file}")
-    results = list(load_jsonl(results_file))
-    all_rows = sheet.get_all_records()
+    header_map = header_map if header_map is not None else get_header_map(sheet)
+    id_index = id_index if id_index is not None else load_id_index(sheet, header_map)
+
+    missing = [col for col in list(FIELD_MAPPING.values()) + ["Status"] if col not in header_map]
+    if missing:
+        logger.warning(f"⚠️ Spalten nicht im Sheet gefunden, werden übersprungen: {', '.join(missing)}")
 
-    for result in results:
+    updates: List[Dict[str, Any]] = []
+    reopened: List[int] = []
+    row_ids = row_ids or {}
+    applied = set()
+    failures: Counter = Counter()
+
+    for result in load_jsonl(results_file, failures):
         custom_id = result.get("custom_id")
-        response = result.get("response", {})
-        body = response.get("body", {})
-        choices = body.get("choices", [])
+        response = result.get("response") or {}
+        body = response.get("body") or {}
+        choices = body.get("choices") or []
+        usage = body.get("usage") or {}
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if usage.get(kind):
+                metrics.inc("usage_tokens_total", usage[kind], kind=kind[:-len("_tokens")])
 
         if not choices:
+            failures["no_choices"] += 1
             logger.warning(f"⚠️ Keine GPT-Antwort für ID: {custom_id}")
             continue
 
-        content = choices[0].get("message", {}).get("content", "")
+        content = choices[0].get("message", {}).get("content") or ""
         if not content.strip():
+            failures["empty_content"] += 1
             logger.warning(f"⚠️ Leere GPT-Antwort für ID: {custom_id}")
             continue
 
-        json_data = extract_json_from_content(content)
+        json_data = extract_json_from_content(content, failures)
         if not json_data:
             logger.warning(f"⚠️ Konnte JSON aus Antwort nicht parsen (ID: {custom_id})")
             continue
 
-        for idx, row in enumerate(all_rows):
-            if str(row.get("id")) == custom_id:
-                logger.info(f"🔄 Aktualisiere Zeile {idx + 2} für ID {custom_id}")
-                update_fields(sheet, idx, json_data)
-                update_status(sheet, idx, "AI reviewed")
-                break
+        # Duplikate derselben Stelle bekommen dieselben Felder
+        for job_id in row_ids.get(str(custom_id)) or [str(custom_id)]:
+            idx = id_index.get(job_id)
+            if idx is None:
+                logger.warning(f"⚠️ ID {job_id} nicht im Sheet gefunden")
+                continue
+
+            logger.info(f"🔄 Aktualisiere Zeile {idx + 2} für ID {job_id}")
+            row_data = dict(json_data, id=job_id) if "id" in json_data else json_data
+            update_fields(updates, header_map, idx, row_data)
+            update_status(updates, header_map, idx, "AI reviewed")
+        applied.add(str(custom_id))
+
+        # Volle Chunks direkt schreiben, damit der Speicher nicht mit der Dateigröße wächst;
+        # der Rest der letzten Antwort wartet auf den nächsten Chunk statt einen eigenen Aufruf zu kosten
+        while len(updates) >= chunk_size:
+            flush_updates(sheet, updates[:chunk_size], chunk_size)
+            updates = updates[chunk_size:]
+
+    unanswered = [custom_id for custom_id in row_ids if custom_id not in applied]
+    if failed_ids is not None:
+        failed_ids.update(unanswered)
+    else:
+        # Beanspruchte Zeilen ohne verwertbare Antwort wieder freigeben, damit sie erneut eingeplant werden
+        reopened = [id_index[job_id] for custom_id in unanswered for job_id in row_ids[custom_id] if job_id in id_index]
+        for idx in reopened:
+            update_status(updates, header_map, idx, "neu")
 
-def update_fields(sheet: Worksheet, row_index: int, field_data: Dict[str, str]) -> None:
+    flush_updates(sheet, updates, chunk_size)
+    reopen_rows(reopened)
+    log_failures(failures, os.path.basename(results_file))
+    metrics.inc("results_applied_total", len(applied))
+    for reason, count in failures.items():
+        metrics.inc("result_failures_total", count, reason=reason)
+    return failures
+
+def reopen_rows(row_indices: List[int]) -> None:
+    """Zeilen, die wieder auf 'neu' stehen, liegen evtl. vor dem Scan-Wasserzeichen des Extract-Laufs."""
+    get_state_store().lower_watermark(watermark_key(GOOGLE_SHEET_ID, SHEET_NAME), row_indices)
+
+def update_fields(updates: List[Dict[str, Any]], header_map: Dict[str, int], row_index: int, field_data: Dict[str, str]) -> None:
     for key, sheet_col in FIELD_MAPPING.items():
-        if key in field_data:
+        if key in field_data and sheet_col in header_map:
             value = flatten_value(field_data[key])
+            updates.append(cell_update(row_index + 2, header_map[sheet_col], value))
+
+def update_status(updates: List[Dict[str, Any]], header_map: Dict[str, int], row_index: int, status: str):
+    if "Status" in header_map:
+        updates.append(cell_update(row_index + 2, header_map["Status"], status))
+
+class SheetWriteError(RuntimeError):
+    """Ein Chunk ließ sich auch nach allen Wiederholungen nicht schreiben."""
+
+def is_retryable_write(error: Exception) -> bool:
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    return status is not None and (status == 429 or status >= 500)
+
+def write_delay(attempt: int, error: Exception) -> float:
+    """Retry-After des Servers, sonst exponentieller Backoff mit Jitter (Sheets-Quota gilt pro Minute)."""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None and hasattr(response, "headers") else None
+    if retry_after:
+        try:
+            return min(float(retry_after), SHEET_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return min(SHEET_BACKOFF_BASE * 2 ** attempt, SHEET_BACKOFF_MAX) * (0.5 + random.random() / 2)
+
+def flush_updates(sheet: Worksheet, updates: List[Dict[str, Any]], chunk_size: int = SHEET_WRITE_CHUNK_SIZE,
+                  retries: int = SHEET_WRITE_RETRIES, sleep: Callable[[float], None] = time.sleep) -> None:
+    """Schreibt die Updates in Chunks. Quota- und Serverfehler werden mit Backoff wiederholt; scheitert ein
+    Chunk endgültig, wird SheetWriteError ausgelöst, damit der Batch nicht als übernommen gilt."""
+    if not updates:
+        logger.info("📭 Keine Zellen zu aktualisieren.")
+        return
+
+    chunk_size = max(1, chunk_size)
+    for start in range(0, len(updates), chunk_size):
+        chunk = updates[start:start + chunk_size]
+        for attempt in range(retries + 1):
             try:
-                cell = sheet.find(sheet_col)
-                sheet.update_cell(row_index + 2, cell.col, value)
+                sheet.batch_update(chunk, value_input_option="USER_ENTERED")
+                break
             except Exception as e:
-                logger.warning(f"⚠️ Fehler beim Aktualisieren der Zelle '{sheet_col}' in Zeile {row_index + 2}: {e}")
-
-def update_status(sheet: Worksheet, row_index: int, status: str):
-    try:
-        status_col = sheet.find("Status").col
-        sheet.update_cell(row_index + 2, status_col, status)
-    except Exception as e:
-        logger.error(f"❌ Fehler beim Setzen des Status in Zeile {row_index + 2}: {e}")
-
-def archive_batch_group(batch_id: str):
-    meta_file = os.path.join(BATCH_DIR, f"{batch_id}.meta")
-    if not os.path.exists(meta_file):
-        logger.warning(f"⚠️ Keine .meta-Datei gefunden für {batch_id}, überspringe Archivierung.")
-        return
+                metrics.inc("sheet_write_errors_total")
+                if attempt < retries and is_retryable_write(e):
+                    delay = write_delay(attempt, e)
+                    logger.warning(f"⚠️ Schreiben von {len(chunk)} Zellen fehlgeschlagen ({e}), neuer Versuch in {delay:.1f}s")
+                    sleep(delay)
+                    continue
+                logger.error(f"❌ Fehler beim Schreiben von {len(chunk)} Zellen ab Update {start + 1}: {e}")
+                raise SheetWriteError(f"{len(chunk)} Zellen ab Update {start + 1} nicht geschrieben") from e
+        metrics.inc("sheet_api_calls_total", op="batch_update")
+        metrics.inc("sheet_cells_written_total", len(chunk))
+        logger.info(f"✏️ {len(chunk)} Zellen geschrieben ({start + len(chunk)}/{len(updates)})")
 
-    if not os.path.exists(ARCHIVE_DIR):
-        os.makedirs(ARCHIVE_DIR)
-
-    zip_path = os.path.join(ARCHIVE_DIR, f"{batch_id}.zip")
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        with open(meta_file, "r") as meta:
-            for fname in meta:
-                fname = fname.strip()
-                full_path = os.path.join(BATCH_DIR, fname)
-                if os.path.exists(full_path):
-                    zipf.write(full_path, arcname=fname)
-                    os.remove(full_path)
-                    logger.info(f"📁 Archiviert: {fname}")
-    os.remove(meta_file)
-    logger.info(f"📦 Batch-Dateien gepackt nach: {zip_path}")
-
-def archive_file(filepath: str):
-    if not os.path.exists(ARCHIVE_DIR):
-        os.makedirs(ARCHIVE_DIR)
-    archive_path = shutil.make_archive(filepath, 'zip', root_dir=os.path.dirname(filepath), base_dir=os.path.basename(filepath))
-    shutil.move(archive_path, os.path.join(ARCHIVE_DIR, os.path.basename(archive_path)))
-    os.remove(filepath)
-    logger.info(f"📦 Archiviert und entfernt: {filepath}")
+def collect_request_errors(error_path: Optional[str]) -> Set[str]:
+    """custom_ids aus der Error-Datei eines Batches; die Fehlercodes werden gezählt und geloggt."""
+    failed: Set[str] = set()
+    if not error_path or not os.path.exists(error_path):
+        return failed
+    codes: Counter = Counter()
+    for entry in load_jsonl(error_path):
+        failed.add(str(entry.get("custom_id")))
+        error = entry.get("error") or ((entry.get("response") or {}).get("body") or {}).get("error") or {}
+        codes[error.get("code") or "unknown"] += 1
+    if codes:
+        log_failures(codes, os.path.basename(error_path))
+    return failed
 
-if __name__ == "__main__":
-    output_file = None
-    batch_id = None
+def schedule_retries(sheet: Worksheet, header_map: Dict[str, int], record: Dict[str, Any], failed_ids: Set[str],
+                     id_index: Dict[str, int], max_attempts: int = MAX_REQUEST_ATTEMPTS) -> Optional[str]:
+    """Sendet fehlgeschlagene Requests als kleinen Retry-Shard erneut und claimt ihre Zeilen dafür;
+    Requests, die das Versuchslimit erreicht haben, werden mit EXHAUSTED_STATUS markiert."""
+    if not failed_ids:
+        return None
+    from openai_batch_submitter import submit_retry_shard
+
+    store = get_state_store()
+    attempts = store.attempts(record["shard_id"])
+    row_ids = store.rows_by_custom_id(record["shard_id"])
+    retry = sorted(cid for cid in failed_ids if attempts.get(cid, 1) < max_attempts)
+    exhausted = sorted(failed_ids.difference(retry))
+
+    claim = None
+    if retry:
+        next_attempt = max(attempts.get(cid, 1) for cid in retry) + 1
+        claim = submit_retry_shard(record, retry, next_attempt)
+
+    # Ohne gestarteten Retry gehen die Zeilen wie bisher zurück auf 'neu'
+    statuses = {cid: claim or "neu" for cid in retry}
+    statuses.update((cid, EXHAUSTED_STATUS) for cid in exhausted)
+    updates: List[Dict[str, Any]] = []
+    reopened: List[int] = []
+    for custom_id, status in statuses.items():
+        for job_id in row_ids.get(custom_id) or [custom_id]:
+            if job_id in id_index:
+                update_status(updates, header_map, id_index[job_id], status)
+                if status == "neu":
+                    reopened.append(id_index[job_id])
+    flush_updates(sheet, updates)
+    reopen_rows(reopened)
+
+    if exhausted:
+        logger.warning(f"⚠️ {len(exhausted)} Requests nach {max_attempts} Versuchen aufgegeben: {', '.join(exhausted[:10])}")
+    if claim:
+        logger.info(f"🔁 {len(retry)} fehlgeschlagene Requests erneut eingeplant: {claim}")
+    return claim
 
-    for fname in os.listdir(BATCH_DIR):
-        if fname.endswith(".jsonl"):
-            output_file = os.path.join(BATCH_DIR, fname)
-            batch_id = fname.split(".")[0].replace("file-", "batch_")
-            break
+def archive_batch_group(record: Dict[str, Any]):
+    """Hängt Eingabe, Status, Output und Fehlerdatei eines Batches ans indizierte Archiv an und entfernt die Einzeldateien."""
+    name = record.get("batch_id") or record["shard_id"]
+    files = {
+        "input": record.get("input_path"),
+        "output": record.get("output_path"),
+        "error": record.get("error_path"),
+        "status": record.get("status_json"),
+    }
+    store = get_state_store()
+    lines = get_batch_archive().add_batch(name, files, store.rows_by_custom_id(record["shard_id"]))
+    for member in ("input", "output", "error"):
+        if files[member] and os.path.exists(files[member]):
+            os.remove(files[member])
+            logger.info(f"📁 Archiviert: {os.path.basename(files[member])}")
+    store.mark_archived(record["shard_id"])
+    logger.info(f"📦 {lines} Zeilen von {name} ins Archiv übernommen")
 
-    if not output_file:
+def apply_all(archive: bool = True) -> int:
+    """Schreibt alle heruntergeladenen Job-Batches ins Sheet; mit `archive` werden sie direkt danach archiviert.
+    Andere Arten (z. B. Enricher-Shards) bleiben 'fetched' und werden weder übernommen noch wiederholt."""
+    store = get_state_store()
+    records = store.batches_in_state("fetched", kind=JOBS_KIND)
+    if not records:
         logger.info("📭 Keine Batch-Ausgabedateien gefunden.")
-        exit()
+        return 0
 
     sheet = init_gsheet()
-    update_sheet_with_results(sheet, output_file)
-    archive_file(output_file)
-    if batch_id:
-        archive_batch_group(batch_id)
+    header_map = get_header_map(sheet)
+    full_index = None
+
+    for record in records:
+        row_ids = store.rows_by_custom_id(record["shard_id"])
+        claimed = store.row_indices(record["shard_id"])
+        id_index = resolve_claimed_rows(sheet, header_map, claimed)
+        if len(id_index) < sum(len(ids) for ids in row_ids.values()):
+            # Nur ohne (gültigen) Claim wird die id-Spalte einmal pro Lauf gelesen
+            full_index = full_index if full_index is not None else load_id_index(sheet, header_map)
+            id_index = {**full_index, **id_index}
+
+        failed_ids = collect_request_errors(record.get("error_path"))
+        # Scheitert das Schreiben endgültig (SheetWriteError), bleibt der Batch 'fetched' und wird nicht archiviert
+        if record.get("output_path"):
+            update_sheet_with_results(sheet, record["output_path"], header_map=header_map, id_index=id_index,
+                                      row_ids=row_ids, failed_ids=failed_ids)
+        else:
+            failed_ids.update(row_ids)
+        if not store.mark_applied(record["shard_id"]):
+            continue  # schon von einem parallelen Lauf übernommen oder freigegeben
+        # Vor dem Archivieren, solange die Eingabedatei noch neben dem Output liegt
+        schedule_retries(sheet, header_map, record, failed_ids, id_index)
+        if archive:
+            archive_batch_group(record)
     logger.info("✅ Verarbeitung abgeschlossen.")
+    return len(records)
+
+def archive_applied() -> int:
+    """Archiviert alle übernommenen, aber noch nicht archivierten Batches."""
+    records = get_state_store().batches_in_state("applied")
+    for record in records:
+        archive_batch_group(record)
+    return len(records)
+
+if __name__ == "__main__":
+    apply_all()
@@ -3,15 +3,18 @@ import json
 import uuid
 import logging
 import argparse
-from typing import List, Dict
-from prompt_loader import load_prompt, render_prompt
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import metrics
+from prompt_loader import render_template
+from state_store import get_state_store, claim_key, JOBS_KIND
+from openai_client import get_openai_client
+from markdown_cleaner import estimate_tokens, CHARS_PER_TOKEN
 
-from openai import OpenAI
 from dotenv import load_dotenv
 
 # === Load Environment Variables ===
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 # === Logger Setup ===
 logger = logging.getLogger("openai_batch_submitter")
@@ -23,42 +26,122 @@ logger.addHandler(handler)
 
 # === Output directory for batch files ===
 BATCH_DIR = "batches"
-os.makedirs(BATCH_DIR, exist_ok=True)
-
-def submit_batch(batch_items: List[Dict[str, str]], id) -> None:
-    batch_id = str(uuid.uuid4())
-    json_path = os.path.join(BATCH_DIR, f"{batch_id}.json")
-
-    system_prompt_template = load_prompt('system_prompt_template.txt')
-    context = {'id': id}
-    system_prompt = render_prompt(system_prompt_template, context)
-
-    logger.info(f"📦 Erstelle Batch-Datei: {json_path}")
-    with open(json_path, "w", encoding="utf-8") as f:
-        for item in batch_items:
-            f.write(json.dumps({
-                "custom_id": item["custom_id"],
-                "method": "POST",
-                "url": "/v1/chat/completions",
-                "body": {
-                    "model": os.getenv("OPENAI_MODEL", "gpt-4o"),
-                    "temperature": 0.3,
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": f"{system_prompt}"
-                        },
-                        {
-                            "role": "user",
-                            "content": item["content"]
-                        }
-                    ]
+
+# === Shard Limits (Provider: max. 50.000 Requests bzw. 200 MB pro Batch-Datei) ===
+MAX_BATCH_REQUESTS = int(os.getenv("MAX_BATCH_REQUESTS", 50000))
+MAX_BATCH_BYTES = int(float(os.getenv("MAX_BATCH_MB", 190)) * 1024 * 1024)
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", 4))
+
+# === Direktmodus: kleine Läufe gehen ohne Batch-API direkt an Chat Completions ===
+SYNC_ROW_THRESHOLD = int(os.getenv("SYNC_ROW_THRESHOLD", 20))
+MODES = ("auto", "batch", "sync")
+
+def build_request_line(custom_id: str, system_prompt: str, content: str) -> str:
+    return json.dumps({
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": os.getenv("OPENAI_MODEL", "gpt-4o"),
+            "temperature": 0.3,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": f"{system_prompt}"
+                },
+                {
+                    "role": "user",
+                    "content": content
                 }
-            }) + "\n")
+            ]
+        }
+    }) + "\n"
+
+def build_system_prompt() -> str:
+    """Ein statischer System-Prompt pro Lauf; die Sheet-ID jeder Antwort kommt aus der custom_id."""
+    return render_template('system_prompt_template.txt', {})
+
+def render_request_lines(items: Iterable[Tuple[str, str]], system_prompt: str) -> Iterator[Tuple[str, bytes, int]]:
+    """(custom_id, User-Prompt) → (custom_id, JSONL-Bytes, geschätzte Input-Tokens) für write_line_shards."""
+    system_tokens = estimate_tokens(system_prompt)
+    for custom_id, content in items:
+        yield (custom_id, build_request_line(custom_id, system_prompt, content).encode("utf-8"),
+               system_tokens + estimate_tokens(content))
+
+def write_line_shards(lines: Iterable[Tuple[str, bytes, int]], max_requests: int = MAX_BATCH_REQUESTS,
+                      max_bytes: int = MAX_BATCH_BYTES, resume: Optional[List[Dict[str, Any]]] = None,
+                      checkpoint: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+                      checkpoint_every: int = 0) -> List[Dict[str, Any]]:
+    """Schreibt fertige Request-Zeilen (custom_id, JSONL-Bytes, geschätzte Input-Tokens) gestreamt in
+    Shard-Dateien, die unter beiden Limits bleiben. Liefert pro Shard {"shard_id", "path", "custom_ids", "tokens", "bytes"}.
+
+    `checkpoint` bekommt alle `checkpoint_every` Zeilen den auf die Platte geschriebenen Stand; mit diesem
+    Stand als `resume` wird ein abgebrochener Lauf fortgesetzt (die letzte Datei wird auf den Stand gekürzt).
+    """
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    shards: List[Dict[str, Any]] = [dict(shard, custom_ids=list(shard["custom_ids"])) for shard in resume or []]
+    run_id = shards[0]["shard_id"].rsplit("_", 1)[0] if shards else str(uuid.uuid4())
+    shard_file = None
+    if shards:
+        shard_file = open(shards[-1]["path"], "r+b")
+        shard_file.truncate(shards[-1]["bytes"])
+        shard_file.seek(shards[-1]["bytes"])
+        logger.info(f"⏩ Setze {run_id} mit {sum(len(s['custom_ids']) for s in shards)} geschriebenen Requests fort")
+    written = 0
+
+    try:
+        for custom_id, line, tokens in lines:
+            if len(line) > max_bytes:
+                logger.warning(f"⚠️ Request {custom_id} ist größer als das Byte-Limit ({len(line)} Bytes)")
+
+            shard_count = len(shards[-1]["custom_ids"]) if shards else 0
+            if shard_file is None or shard_count >= max_requests or (shard_count and shards[-1]["bytes"] + len(line) > max_bytes):
+                if shard_file is not None:
+                    shard_file.close()
+                shard_id = f"{run_id}_{len(shards):03d}"
+                json_path = os.path.join(BATCH_DIR, f"{shard_id}.json")
+                logger.info(f"📦 Erstelle Batch-Datei: {json_path}")
+                shard_file = open(json_path, "wb")
+                shards.append({"shard_id": shard_id, "path": json_path, "custom_ids": [], "tokens": 0, "bytes": 0})
+
+            shard_file.write(line)
+            shards[-1]["custom_ids"].append(custom_id)
+            shards[-1]["tokens"] += tokens
+            shards[-1]["bytes"] += len(line)
+            written += 1
+            if checkpoint and checkpoint_every and written % checkpoint_every == 0:
+                shard_file.flush()
+                os.fsync(shard_file.fileno())
+                checkpoint(shards)
+    finally:
+        if shard_file is not None:
+            shard_file.close()
+
+    return shards
 
+def write_shards(batch_items: List[Dict[str, str]], system_prompt: str,
+                 max_requests: int = MAX_BATCH_REQUESTS, max_bytes: int = MAX_BATCH_BYTES) -> List[Dict[str, Any]]:
+    items = ((item["custom_id"], item["content"]) for item in batch_items)
+    return write_line_shards(render_request_lines(items, system_prompt), max_requests, max_bytes)
+
+def shard_id_for(json_path: str) -> str:
+    return os.path.splitext(os.path.basename(json_path))[0]
+
+def read_custom_ids(json_path: str) -> List[str]:
+    with open(json_path, "r", encoding="utf-8") as f:
+        return [json.loads(line)["custom_id"] for line in f if line.strip()]
+
+def upload_batch_file(json_path: str) -> Optional[str]:
+    """Lädt eine gebaute Batch-Datei hoch, startet den Batch und vermerkt beides im Zustandsspeicher."""
+    store = get_state_store()
+    client = get_openai_client()
+    shard_id = shard_id_for(json_path)
     try:
-        logger.info("📤 Lade Batch-Datei als OpenAI-File hoch...")
-        file_obj = client.files.create(file=open(json_path, "rb"), purpose="batch")
+        logger.info(f"📤 Lade Batch-Datei als OpenAI-File hoch: {json_path}")
+        with open(json_path, "rb") as f, metrics.timer("submit_upload_seconds"):
+            file_obj = client.files.create(file=f, purpose="batch")
+        if not store.mark_uploaded(shard_id, file_obj.id):
+            return None  # ein paralleler Lauf startet diesen Shard bereits
 
         logger.info("🚀 Starte Batch mit File-ID: %s", file_obj.id)
         batch = client.batches.create(
@@ -66,44 +149,169 @@ def submit_batch(batch_items: List[Dict[str, str]], id) -> None:
             endpoint="/v1/chat/completions",
             completion_window="24h"
         )
+        store.mark_submitted(shard_id, batch.id)
+        metrics.inc("batches_started_total", mode="batch")
+        logger.info(f"✅ Batch erstellt: {batch.id} (Shard {shard_id})")
+        return batch.id
+
+    except Exception as e:
+        logger.error("❌ Fehler beim Erstellen des Batches für %s: %s", json_path, str(e))
+        metrics.inc("submit_failures_total")
+        # Zurück in die Warteschlange, damit der Shard nicht als laufend Token-Budget belegt
+        store.update(shard_id, "built")
+        return None
 
-        batch_meta_path = os.path.join(BATCH_DIR, f"{batch.id}.batch_id")
-        with open(batch_meta_path, "w") as meta_file:
-            meta_file.write(batch.id)
-        logger.info(f"✅ Batch erstellt: {batch.id} und gespeichert in {batch_meta_path}")
+def submit_batch(batch_items: List[Dict[str, str]], aliases: Optional[Dict[str, List[str]]] = None,
+                 row_indices: Optional[Dict[str, int]] = None,
+                 max_requests: int = MAX_BATCH_REQUESTS, max_bytes: int = MAX_BATCH_BYTES,
+                 upload_workers: int = UPLOAD_WORKERS, mode: str = "auto",
+                 claim: Optional[Callable[[List[str]], None]] = None) -> List[str]:
+    """Baut, shardet und startet die Batches und liefert die Shard-IDs (siehe submit_shards).
+    `aliases` ordnet einer custom_id weitere Sheet-IDs derselben Stelle zu, `row_indices` die Sheet-IDs
+    ihren Zeilen (für Claims und das direkte Zurückschreiben).
 
-        # Schreibe Meta-Datei für spätere Archivierung
-        meta_path = os.path.join(BATCH_DIR, f"{batch_id}.meta")
-        with open(meta_path, "w", encoding="utf-8") as f:
-            f.write(f"{batch_id}.json")
+    Mit `mode="auto"` laufen Aufträge unter SYNC_ROW_THRESHOLD Requests direkt über Chat Completions;
+    die Antworten liegen dann sofort als Output-Datei im Zustand 'fetched'."""
+    if mode not in MODES:
+        raise ValueError(f"Unbekannter Modus: {mode}")
+    with metrics.timer("submit_build_seconds"):
+        shards = write_shards(batch_items, build_system_prompt(), max_requests, max_bytes)
+    return submit_shards(shards, aliases, row_indices, mode, upload_workers, claim)
 
-    except Exception as e:
-        logger.error("❌ Fehler beim Erstellen des Batches: %s", str(e))
+def submit_shards(shards: List[Dict[str, Any]], aliases: Optional[Dict[str, List[str]]] = None,
+                  row_indices: Optional[Dict[str, int]] = None, mode: str = "auto",
+                  upload_workers: int = UPLOAD_WORKERS,
+                  claim: Optional[Callable[[List[str]], None]] = None, kind: str = JOBS_KIND) -> List[str]:
+    """Vermerkt geschriebene Shards im Zustandsspeicher und startet sie: im Direktmodus sofort, sonst über
+    die Token-Budget-Warteschlange. Liefert die Shard-IDs (gestartet oder eingereiht).
+
+    `claim` beansprucht die Zeilen der Shards im Sheet. Im Direktmodus geschieht das vor dem Senden, denn
+    danach sind die Shards schon 'fetched' und ein paralleles Apply könnte die Zeilen bereits beschrieben haben;
+    sonst nach dem Start, damit die Zeilen die Batch-ID tragen. `kind` wird mit den Shards vermerkt; nur
+    JOBS_KIND wird später ins Job-Sheet übernommen."""
+    if not shards:
+        logger.warning("⚠️ Keine Batch-Einträge vorhanden, nichts hochzuladen.")
+        return []
+
+    aliases = aliases or {}
+    store = get_state_store()
+    for shard in shards:
+        rows = {custom_id: [custom_id] + aliases.get(custom_id, []) for custom_id in shard["custom_ids"]}
+        store.record_shard(shard["shard_id"], shard["path"], rows, row_indices, token_estimate=shard["tokens"], kind=kind)
+
+    request_count = sum(len(shard["custom_ids"]) for shard in shards)
+    metrics.inc("submit_shards_total", len(shards))
+    metrics.inc("submit_requests_total", request_count)
+    metrics.inc("submit_bytes_total", sum(os.path.getsize(shard["path"]) for shard in shards))
+    metrics.inc("submit_estimated_tokens_total", sum(shard["tokens"] for shard in shards))
+    logger.info(f"🧩 {request_count} Requests (~{sum(s['tokens'] for s in shards)} Tokens) auf {len(shards)} Shard(s) verteilt")
+    shard_ids = [shard["shard_id"] for shard in shards]
+    if use_sync(request_count, mode):
+        from openai_sync_runner import reserve_sync_shard
+        # Vor dem Claimen aus der Warteschlange nehmen, sonst startet ein paralleles release() sie als Batch
+        reserved = [shard for shard in shards if reserve_sync_shard(shard["shard_id"])]
+        if claim and reserved:
+            claim([shard["shard_id"] for shard in reserved])
+        start_shards([shard["path"] for shard in reserved], request_count, "sync", reserved=True)
+    else:
+        from token_scheduler import get_scheduler
+        get_scheduler().release(upload_workers)
+        if claim:
+            claim(shard_ids)
+    return shard_ids
+
+def use_sync(request_count: int, mode: str) -> bool:
+    return mode == "sync" or (mode == "auto" and request_count < SYNC_ROW_THRESHOLD)
+
+def start_shards(shard_paths: List[str], request_count: int, mode: str = "auto",
+                 upload_workers: int = UPLOAD_WORKERS, reserved: bool = False) -> List[str]:
+    """Startet gebaute Shards als Batches oder, im Direktmodus, über Chat Completions
+    (`reserved`: die Shards wurden dafür schon aus der Warteschlange genommen, siehe reserve_sync_shard)."""
+    if use_sync(request_count, mode):
+        from openai_sync_runner import run_sync_file
+        batch_ids = [run_sync_file(path, reserved=reserved) for path in shard_paths]
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, min(upload_workers, len(shard_paths)))) as executor:
+            batch_ids = list(executor.map(upload_batch_file, shard_paths))
+
+    failed = [path for path, batch_id in zip(shard_paths, batch_ids) if batch_id is None]
+    for path in failed:
+        logger.error(f"❌ Shard nicht gestartet, erneut senden mit: --resend {path}")
+    logger.info(f"✅ {len(shard_paths) - len(failed)}/{len(shard_paths)} Shards gestartet")
+    return [batch_id for batch_id in batch_ids if batch_id]
 
 
-def resend_batch_from_file(json_path: str):
+def retry_shard_id(shard_id: str, attempt: int) -> str:
+    base = shard_id.split("_retry")[0]
+    return f"{base}_retry{attempt}"
+
+def submit_retry_shard(record: Dict[str, Any], custom_ids: List[str], attempt: int,
+                       mode: str = "auto") -> Optional[str]:
+    """Baut aus den Original-Zeilen der Eingabedatei einen Shard nur mit den fehlgeschlagenen Requests
+    und startet bzw. reiht ihn ein; Zeilenzuordnung und Claim-Zeilen werden vom ursprünglichen Shard
+    übernommen. Liefert den Claim-Wert für die Zeilen (siehe state_store.claim_key) oder None."""
+    input_path = record.get("input_path")
+    if not input_path or not os.path.exists(input_path):
+        logger.error(f"❌ Eingabedatei für Shard {record['shard_id']} fehlt, kein Retry möglich")
+        return None
+
+    store = get_state_store()
+    wanted = set(custom_ids)
+    shard_id = retry_shard_id(record["shard_id"], attempt)
+    json_path = os.path.join(BATCH_DIR, f"{shard_id}.json")
+    found = []
+    found_bytes = 0
+    with open(input_path, "rb") as src, open(json_path, "wb") as dst:
+        for line in src:
+            if not line.strip():
+                continue
+            custom_id = json.loads(line)["custom_id"]
+            if custom_id in wanted:
+                dst.write(line if line.endswith(b"\n") else line + b"\n")
+                found.append(custom_id)
+                found_bytes += len(line)
+    if not found:
+        os.remove(json_path)
+        logger.warning(f"⚠️ Keine der fehlgeschlagenen Requests in {input_path} gefunden")
+        return None
+
+    rows = store.rows_by_custom_id(record["shard_id"])
+    store.record_shard(shard_id, json_path, {cid: rows.get(cid, [cid]) for cid in found},
+                       store.row_indices(record["shard_id"]), attempt=attempt,
+                       token_estimate=found_bytes // CHARS_PER_TOKEN)
+    logger.info(f"🔁 Retry-Shard {shard_id}: {len(found)} Requests (Versuch {attempt})")
+    if use_sync(len(found), mode):
+        start_shards([json_path], len(found), "sync")
+    else:
+        from token_scheduler import get_scheduler
+        get_scheduler().release()
+    retry_record = store.get(shard_id)
+    return claim_key(retry_record) if retry_record["state"] not in ("failed", "released") else None
+
+
+def submit_pending(upload_workers: int = UPLOAD_WORKERS) -> List[str]:
+    """Startet wartende Shards, soweit das Token-Budget es zulässt."""
+    from token_scheduler import get_scheduler
+    return list(get_scheduler().release(upload_workers))
+
+
+def resend_batch_from_file(json_path: str, kind: Optional[str] = None):
     if not os.path.exists(json_path):
         logger.error(f"❌ Batch-Datei nicht gefunden: {json_path}")
         return
 
+    # Zeilenzuordnung (inkl. Duplikate) bleibt erhalten, wenn der Shard schon bekannt ist
+    store = get_state_store()
+    shard_id = shard_id_for(json_path)
+    rows = store.rows_by_custom_id(shard_id) or {custom_id: [custom_id] for custom_id in read_custom_ids(json_path)}
+    known = store.get(shard_id)
+    kind = kind or (known["kind"] if known else JOBS_KIND)
+    store.record_shard(shard_id, json_path, rows, token_estimate=os.path.getsize(json_path) // CHARS_PER_TOKEN, kind=kind)
+
     logger.info(f"📤 Lade vorhandene Batch-Datei hoch: {json_path}")
-    with open(json_path, "rb") as f:
-        file = client.files.create(file=f, purpose="batch")
-
-    logger.info(f"🚀 Starte Batch mit File-ID: {file.id}")
-    batch = client.batches.create(
-        input_file_id=file.id,
-        endpoint="/v1/chat/completions",
-        completion_window="24h"
-    )
-
-    # Speicher Batch-ID für Poller
-    batch_id_path = os.path.join("batches", f"{batch.id}.batch_id")
-    with open(batch_id_path, "w") as f:
-        f.write(batch.id)
-
-    logger.info(f"✅ Batch neu gestartet mit ID: {batch.id}")
-    logger.info(f"💾 Batch-ID gespeichert unter: {batch_id_path}")
+    batch_id = upload_batch_file(json_path)
+    if batch_id:
+        logger.info(f"✅ Batch neu gestartet mit ID: {batch_id}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,22 @@
+# openai_client.py
+# Gemeinsamer OpenAI-Client, der (samt openai-Paket) erst bei der ersten echten Anfrage erzeugt wird
+
+import os
+import threading
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+_client: Optional[Any] = None
+_client_lock = threading.Lock()
+
+
+def get_openai_client() -> Any:
+    global _client
+    with _client_lock:
+        if _client is None:
+            from openai import OpenAI
+            _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        return _client
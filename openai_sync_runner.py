@@ -0,0 +1,163 @@
+# openai_sync_runner.py
+# Schickt die Requests einer Batch-Datei direkt an Chat Completions (für kleine, eilige Läufe)
+# und schreibt die Antworten im Format der Batch-Output-Dateien, damit openai_batch_results sie unverändert übernimmt.
+
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+from dotenv import load_dotenv
+
+import metrics
+from state_store import get_state_store, SYNC_BATCH_PREFIX
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+BATCH_DIR = "batches"
+SYNC_MAX_CONCURRENCY = int(os.getenv("SYNC_MAX_CONCURRENCY", 8))
+SYNC_REQUESTS_PER_MINUTE = float(os.getenv("SYNC_REQUESTS_PER_MINUTE", 300))
+SYNC_MAX_RETRIES = int(os.getenv("SYNC_MAX_RETRIES", 5))
+SYNC_BACKOFF_BASE = 1.0
+SYNC_BACKOFF_MAX = 60.0
+
+
+class TokenBucket:
+    """Begrenzt die Request-Rate: `rate` Tokens pro Sekunde, höchstens `capacity` auf Vorrat."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def retry_delay(attempt: int, error: Exception) -> float:
+    """Retry-After des Servers, sonst exponentieller Backoff mit Jitter."""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), SYNC_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return min(SYNC_BACKOFF_BASE * 2 ** attempt, SYNC_BACKOFF_MAX) * (0.5 + random.random() / 2)
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (RateLimitError, APIConnectionError, APITimeoutError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+
+async def send_request(client: AsyncOpenAI, request: Dict[str, Any], bucket: TokenBucket,
+                       semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+    """Führt einen Request aus und liefert eine Zeile im Batch-Output-Format."""
+    line_id = f"batch_req_{uuid.uuid4().hex}"
+    custom_id = request["custom_id"]
+    async with semaphore:
+        for attempt in range(SYNC_MAX_RETRIES + 1):
+            await bucket.acquire()
+            try:
+                with metrics.timer("sync_request_seconds"):
+                    completion = await client.chat.completions.create(**request["body"])
+                return {
+                    "id": line_id,
+                    "custom_id": custom_id,
+                    "response": {
+                        "status_code": 200,
+                        "request_id": getattr(completion, "_request_id", None),
+                        "body": completion.model_dump(),
+                    },
+                    "error": None,
+                }
+            except Exception as e:
+                if attempt < SYNC_MAX_RETRIES and is_retryable(e):
+                    metrics.inc("sync_retries_total", error=type(e).__name__)
+                    delay = retry_delay(attempt, e)
+                    logger.warning(f"⚠️ {custom_id}: {type(e).__name__}, neuer Versuch in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    continue
+                logger.error(f"❌ {custom_id} fehlgeschlagen: {e}")
+                status_code = getattr(e, "status_code", None)
+                return {
+                    "id": line_id,
+                    "custom_id": custom_id,
+                    "response": {"status_code": status_code, "request_id": None, "body": getattr(e, "body", None)}
+                    if status_code else None,
+                    "error": {"code": type(e).__name__, "message": str(e)},
+                }
+
+
+async def run_requests(json_path: str, output_path: str, client: Optional[AsyncOpenAI] = None,
+                       max_concurrency: int = SYNC_MAX_CONCURRENCY,
+                       requests_per_minute: float = SYNC_REQUESTS_PER_MINUTE) -> int:
+    """Arbeitet alle Zeilen aus `json_path` nebenläufig ab und schreibt jede Antwort, sobald sie da ist."""
+    # Wiederholungen übernimmt send_request (mit Token-Bucket), nicht zusätzlich das SDK
+    client = client or AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+    bucket = TokenBucket(requests_per_minute / 60, max(1, max_concurrency))
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    with open(json_path, "r", encoding="utf-8") as f:
+        requests = [json.loads(line) for line in f if line.strip()]
+
+    tmp_path = f"{output_path}.part"
+    written = 0
+    with open(tmp_path, "w", encoding="utf-8") as out:
+        for task in asyncio.as_completed([send_request(client, r, bucket, semaphore) for r in requests]):
+            out.write(json.dumps(await task, ensure_ascii=False) + "\n")
+            written += 1
+    os.replace(tmp_path, output_path)
+    return written
+
+
+def reserve_sync_shard(shard_id: str) -> bool:
+    """Nimmt einen gebauten Shard aus der Batch-Warteschlange ('submitted' mit sync_-ID), damit kein paralleler
+    Poller ihn als Batch hochlädt; False, wenn ein anderer Lauf ihn schon übernommen hat."""
+    if get_state_store().mark_submitted(shard_id, f"{SYNC_BATCH_PREFIX}{shard_id}"):
+        return True
+    logger.warning(f"⚠️ Shard {shard_id} wird schon von einem anderen Lauf gestartet, nicht direkt gesendet")
+    return False
+
+
+def run_sync_file(json_path: str, client: Optional[AsyncOpenAI] = None, reserved: bool = False) -> Optional[str]:
+    """Synchroner Ersatz für upload_batch_file: der Shard landet direkt im Zustand 'fetched'.
+    Mit `reserved` wurde der Shard schon über reserve_sync_shard übernommen (z. B. vor dem Claimen)."""
+    store = get_state_store()
+    shard_id = os.path.splitext(os.path.basename(json_path))[0]
+    batch_id = f"{SYNC_BATCH_PREFIX}{shard_id}"
+    output_path = os.path.join(BATCH_DIR, f"{batch_id}.jsonl")
+
+    if not reserved and not reserve_sync_shard(shard_id):
+        return None
+    logger.info(f"⚡ Sende {json_path} direkt an Chat Completions (ohne Batch-API)")
+    started = time.monotonic()
+    try:
+        count = asyncio.run(run_requests(json_path, output_path, client))
+    except Exception as e:
+        logger.error(f"❌ Direkter Lauf für {json_path} fehlgeschlagen: {e}")
+        store.update(shard_id, "failed")
+        return None
+
+    store.mark_fetched(shard_id, output_path, None)
+    metrics.inc("batches_started_total", mode="sync")
+    logger.info(f"✅ {count} Antworten in {time.monotonic() - started:.1f}s nach {output_path} geschrieben")
+    return batch_id
@@ -0,0 +1,124 @@
+# pipeline.py
+# Ein Einstiegspunkt für alle Stufen (für Cron): extract, submit, queue, poll, fetch, apply, archive
+#
+# Stufenmodule (und damit openai, gspread, oauth2client) werden erst importiert,
+# wenn der Zustandsspeicher zeigt, dass es für die Stufe tatsächlich Arbeit gibt.
+
+import sys
+import logging
+import argparse
+from typing import Callable, Dict
+
+import metrics
+from logger_config import setup_logger
+from state_store import get_state_store
+
+logger = logging.getLogger("pipeline")
+
+
+def has_work(*states: str) -> bool:
+    if get_state_store().batches_in_state(*states):
+        return True
+    logger.info(f"📭 Nichts zu tun (keine Batches im Zustand {', '.join(states)})")
+    return False
+
+
+def cmd_extract(args) -> None:
+    from extract_job_details import process
+    mode = "sync" if args.sync else "batch" if args.batch else "auto"
+    process(dry_run=not args.live, refresh=args.refresh, full_scan=args.full_scan, mode=mode)
+
+
+def cmd_submit(args) -> None:
+    if args.resend:
+        from openai_batch_submitter import resend_batch_from_file
+        resend_batch_from_file(args.resend)
+    elif has_work("built"):
+        from openai_batch_submitter import submit_pending
+        submit_pending()
+
+
+def cmd_queue(args) -> None:
+    import json
+    from token_scheduler import get_scheduler
+    print(json.dumps(get_scheduler().stats(), indent=2))
+
+
+def cmd_poll(args) -> None:
+    if has_work("submitted", "built"):
+        from openai_batch_poller import poll_submitted
+        poll_submitted()
+
+
+def cmd_fetch(args) -> None:
+    if has_work("completed"):
+        from openai_batch_fetcher import fetch_all
+        fetch_all()
+
+
+def cmd_apply(args) -> None:
+    if has_work("fetched"):
+        from openai_batch_results import apply_all
+        apply_all(archive=not args.no_archive)
+
+
+def cmd_archive(args) -> None:
+    if args.lookup:
+        import json
+        from batch_archive import get_batch_archive
+        for hit in get_batch_archive().lookup(args.lookup):
+            print(json.dumps(hit, ensure_ascii=False))
+    elif has_work("applied"):
+        from openai_batch_results import archive_applied
+        archive_applied()
+
+
+COMMANDS: Dict[str, Callable] = {
+    "extract": cmd_extract,
+    "submit": cmd_submit,
+    "queue": cmd_queue,
+    "poll": cmd_poll,
+    "fetch": cmd_fetch,
+    "apply": cmd_apply,
+    "archive": cmd_archive,
+}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Job-Extraktions-Pipeline")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_extract = sub.add_parser("extract", help="Neue Zeilen lesen, Markdown holen und Batches bauen")
+    p_extract.add_argument("--live", action="store_true", help="Batches wirklich starten (sonst Dry-Run)")
+    p_extract.add_argument("--refresh", action="store_true", help="Markdown-Cache ignorieren")
+    p_extract.add_argument("--full-scan", action="store_true", help="Sheet ab der ersten Zeile lesen")
+    p_extract.add_argument("--sync", action="store_true", help="Immer direkt über Chat Completions")
+    p_extract.add_argument("--batch", action="store_true", help="Immer über die Batch-API")
+
+    p_submit = sub.add_parser("submit", help="Wartende Shards starten, soweit das Token-Budget reicht")
+    p_submit.add_argument("--resend", type=str, help="Pfad zu einer bestehenden Batch-JSON-Datei")
+
+    sub.add_parser("queue", help="Warteschlangentiefe, Token-Budget und Prognose ausgeben")
+    sub.add_parser("poll", help="Laufende Batches bis zum Ende überwachen, Warteschlange nachfüllen")
+    sub.add_parser("fetch", help="Output- und Fehlerdateien fertiger Batches herunterladen")
+
+    p_apply = sub.add_parser("apply", help="Ergebnisse ins Sheet schreiben")
+    p_apply.add_argument("--no-archive", action="store_true", help="Batches danach nicht archivieren")
+
+    p_archive = sub.add_parser("archive", help="Übernommene Batches archivieren")
+    p_archive.add_argument("--lookup", metavar="JOB_ID", help="Archivierte Einträge einer Sheet-ID ausgeben")
+    return parser
+
+
+def main(argv=None) -> None:
+    setup_logger(logging.INFO)
+    args = build_parser().parse_args(argv)
+    try:
+        with metrics.timer("stage_seconds", stage=args.command):
+            COMMANDS[args.command](args)
+    finally:
+        logger.info(f"📊 Metriken geschrieben: {', '.join(metrics.export(args.command))}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,13 +1,38 @@
 import os
-from jinja2 import Template
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Tuple
+from jinja2 import Environment, Template
 
 PROMPT_DIR = os.path.join(os.path.dirname(__file__), 'prompts')
 
+# Gemeinsames Environment, damit kompilierte Templates wiederverwendet werden
+_env = Environment()
+_registry: Dict[str, Tuple[int, Template]] = {}
+_registry_lock = threading.Lock()
+
 def load_prompt(template_name: str) -> str:
     template_path = os.path.join(PROMPT_DIR, template_name)
     with open(template_path, 'r', encoding='utf-8') as file:
         return file.read()
 
+def get_template(template_name: str) -> Template:
+    """Kompiliertes Template aus der Registry; wird neu geladen, sobald sich die mtime der Datei ändert."""
+    mtime = os.stat(os.path.join(PROMPT_DIR, template_name)).st_mtime_ns
+    cached = _registry.get(template_name)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with _registry_lock:
+        template = _env.from_string(load_prompt(template_name))
+        _registry[template_name] = (mtime, template)
+    return template
+
+def render_template(template_name: str, context: Dict[str, Any]) -> str:
+    return get_template(template_name).render(context)
+
+@lru_cache(maxsize=64)
+def compile_prompt(template_str: str) -> Template:
+    return _env.from_string(template_str)
+
 def render_prompt(template_str: str, context: dict) -> str:
-    template = Template(template_str)
-    return template.render(context)
+    return compile_prompt(template_str).render(context)
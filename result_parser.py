@@ -0,0 +1,89 @@
+# result_parser.py
+# Schneller, toleranter Parser für GPT-Antworten aus Batch-Output-Dateien
+
+import re
+import json
+import logging
+from collections import Counter
+from typing import Any, Dict, Iterator, Optional
+
+try:
+    import orjson
+except ImportError:  # optionales, schnelleres JSON-Backend
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+JSON_BACKEND = "orjson" if orjson else "json"
+
+_fence = re.compile(r"```(?:json)?[ \t]*\n(.*?)\n?```", re.DOTALL)
+_decoder = json.JSONDecoder()
+
+# Fehlergründe: empty, no_json, truncated, invalid_json, not_object (+ no_choices/empty_content in den Ergebnissen)
+FAILURES: Counter = Counter()
+
+
+def loads(data: Any) -> Any:
+    """json.loads mit orjson, falls installiert; beide werfen bei Fehlern ValueError."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def iter_jsonl(filepath: str, failures: Optional[Counter] = None) -> Iterator[Dict[str, Any]]:
+    failures = FAILURES if failures is None else failures
+    with open(filepath, "rb") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield loads(line)
+            except ValueError as e:
+                failures["invalid_line"] += 1
+                logger.warning(f"⚠️ Fehler beim Parsen der Zeile {line_no} in {filepath}: {e}")
+
+
+def parse_response_content(content: str, failures: Optional[Counter] = None) -> Dict[str, Any]:
+    """Liefert das JSON-Objekt aus einer GPT-Antwort oder {} und zählt den Fehlergrund in `failures`."""
+    failures = FAILURES if failures is None else failures
+    text = (content or "").strip()
+    if not text:
+        failures["empty"] += 1
+        return {}
+
+    # Fast Path: reine JSON-Antwort ohne Regex
+    if text[0] == "{":
+        try:
+            result = loads(text)
+            if isinstance(result, dict):
+                return result
+        except ValueError:
+            pass
+
+    # Fallback: Codeblock oder Text vor/nach dem Objekt
+    match = _fence.search(text)
+    candidate = match.group(1).strip() if match else text
+    start = candidate.find("{")
+    if start == -1:
+        failures["no_json"] += 1
+        return {}
+
+    try:
+        result, _ = _decoder.raw_decode(candidate, start)
+    except json.JSONDecodeError as e:
+        reason = "truncated" if e.pos >= len(candidate) - 1 or e.msg.startswith("Unterminated") else "invalid_json"
+        failures[reason] += 1
+        logger.warning(f"⚠️ Fehler beim Parsen der GPT-Antwort ({reason}): {e}")
+        return {}
+
+    if not isinstance(result, dict):
+        failures["not_object"] += 1
+        return {}
+    return result
+
+
+def log_failures(failures: Optional[Counter] = None, label: str = "") -> None:
+    failures = FAILURES if failures is None else failures
+    if failures:
+        summary = ", ".join(f"{reason}={count}" for reason, count in failures.most_common())
+        logger.warning(f"⚠️ Nicht verwertbare Antworten{f' in {label}' if label else ''}: {summary}")
@@ -0,0 +1,350 @@
+# state_store.py
+# Lokaler Pipeline-Zustand (SQLite, WAL): Lebenszyklus jedes Batches samt Zeilen- und File-IDs
+#
+# built -> uploaded -> submitted -> completed|failed -> fetched -> applied -> archived
+# failed (oder zu lange submitted) -> released: Zeilen-Claims im Sheet wurden zurückgegeben
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+BATCH_DIR = "batches"
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", os.path.join(BATCH_DIR, "pipeline_state.sqlite"))
+
+CLAIM_PREFIX = "in_batch:"
+# Batch-IDs des Direktmodus; diese Shards laufen nicht über die Batch-API und werden nicht gepollt
+SYNC_BATCH_PREFIX = "sync_"
+
+# Art der Requests eines Shards: nur Job-Shards werden ins JOB_COLLECTOR-Sheet übernommen und wiederholt
+JOBS_KIND = "jobs"
+ENRICH_KIND = "enrich"
+
+STATES = ("built", "uploaded", "submitted", "completed", "failed", "fetched", "applied", "archived", "released")
+
+# Erlaubte Vorzustände je Zielzustand; andere Übergänge (z. B. ein zweiter Poller, der einen schon
+# übernommenen Batch erneut abschließt) werden übersprungen, statt den Batch zurückzusetzen
+TRANSITIONS = {
+    "built": ("built", "uploaded"),          # Upload oder Batch-Start fehlgeschlagen: zurück in die Warteschlange
+    "uploaded": ("built",),
+    "submitted": ("built", "uploaded"),      # Direktmodus und Altdateien überspringen den Upload
+    "completed": ("submitted",),
+    "failed": ("submitted",),
+    "fetched": ("completed", "submitted"),   # Direktmodus schreibt die Antworten selbst
+    "applied": ("fetched",),
+    "archived": ("applied",),
+    "released": ("failed", "submitted"),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    shard_id       TEXT PRIMARY KEY,
+    batch_id       TEXT UNIQUE,
+    state          TEXT NOT NULL,
+    input_path     TEXT,
+    input_file_id  TEXT,
+    output_file_id TEXT,
+    error_file_id  TEXT,
+    output_path    TEXT,
+    error_path     TEXT,
+    status_json    TEXT,
+    request_count  INTEGER NOT NULL DEFAULT 0,
+    token_estimate INTEGER NOT NULL DEFAULT 0,
+    kind           TEXT NOT NULL DEFAULT 'jobs',
+    submitted_at   REAL,
+    finished_at    REAL,
+    created_at     REAL NOT NULL,
+    updated_at     REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_batches_state ON batches (state);
+
+CREATE TABLE IF NOT EXISTS batch_rows (
+    shard_id  TEXT NOT NULL,
+    custom_id TEXT NOT NULL,
+    row_id    TEXT NOT NULL,
+    row_index INTEGER,
+    attempt   INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (shard_id, row_id)
+);
+CREATE INDEX IF NOT EXISTS idx_batch_rows_custom_id ON batch_rows (shard_id, custom_id);
+
+CREATE TABLE IF NOT EXISTS settings (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class StateStore:
+    """Dünne Schicht über SQLite; alle Stufen fragen hier ihre Arbeit ab statt batches/ zu durchsuchen."""
+
+    def __init__(self, path: str = STATE_DB_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+        self._conn.commit()
+
+    def _migrate(self) -> None:
+        batch_columns = {row[1] for row in self._conn.execute("PRAGMA table_info(batches)")}
+        for name, ddl in (("token_estimate", "INTEGER NOT NULL DEFAULT 0"), ("submitted_at", "REAL"), ("finished_at", "REAL"),
+                          ("kind", f"TEXT NOT NULL DEFAULT '{JOBS_KIND}'")):
+            if name not in batch_columns:
+                self._conn.execute(f"ALTER TABLE batches ADD COLUMN {name} {ddl}")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(batch_rows)")}
+        if "row_index" not in columns:
+            self._conn.execute("ALTER TABLE batch_rows ADD COLUMN row_index INTEGER")
+        if "attempt" not in columns:
+            self._conn.execute("ALTER TABLE batch_rows ADD COLUMN attempt INTEGER NOT NULL DEFAULT 1")
+
+    # --- Schreiben ---
+    def record_shard(self, shard_id: str, input_path: Optional[str], rows: Dict[str, List[str]],
+                     row_indices: Optional[Dict[str, int]] = None, attempt: int = 1, token_estimate: int = 0,
+                     kind: str = JOBS_KIND) -> None:
+        """Legt einen gebauten Shard an; `rows` bildet custom_id -> alle Sheet-IDs dieser Stelle ab,
+        `row_indices` Sheet-ID -> row_index (0-basiert, ohne Kopfzeile) für den direkten Zugriff beim Claimen,
+        `attempt` zählt, der wievielte Versuch dieser Requests der Shard ist, `token_estimate` die geschätzten
+        Input-Tokens (für das Token-Budget der Batch-Warteschlange), `kind` die Art der Requests (JOBS_KIND/ENRICH_KIND)."""
+        now = time.time()
+        row_indices = row_indices or {}
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO batches (shard_id, state, input_path, request_count, token_estimate, kind, created_at, updated_at) "
+                "VALUES (?, 'built', ?, ?, ?, ?, ?, ?)",
+                (shard_id, input_path, len(rows), token_estimate, kind, now, now)
+            )
+            self._conn.execute("DELETE FROM batch_rows WHERE shard_id = ?", (shard_id,))
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO batch_rows (shard_id, custom_id, row_id, row_index, attempt) VALUES (?, ?, ?, ?, ?)",
+                ((shard_id, custom_id, row_id, row_indices.get(row_id), attempt)
+                 for custom_id, row_ids in rows.items() for row_id in row_ids)
+            )
+
+    def update(self, shard_id: str, state: str, **fields: Any) -> bool:
+        """Setzt den Zustand nur, wenn der Shard in einem erlaubten Vorzustand ist (siehe TRANSITIONS);
+        liefert, ob der Übergang stattgefunden hat."""
+        if state not in STATES:
+            raise ValueError(f"Unbekannter Zustand: {state}")
+        previous = TRANSITIONS[state]
+        fields["state"] = state
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        placeholders = ", ".join("?" for _ in previous)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                f"UPDATE batches SET {assignments} WHERE shard_id = ? AND state IN ({placeholders})",
+                (*fields.values(), shard_id, *previous)
+            )
+            if cursor.rowcount:
+                return True
+            row = self._conn.execute("SELECT state FROM batches WHERE shard_id = ?", (shard_id,)).fetchone()
+        current = row[0] if row else "unbekannt"
+        logger.warning(f"⚠️ Shard {shard_id}: Übergang {current} → {state} übersprungen")
+        return False
+
+    def mark_uploaded(self, shard_id: str, input_file_id: str) -> bool:
+        return self.update(shard_id, "uploaded", input_file_id=input_file_id)
+
+    def mark_submitted(self, shard_id: str, batch_id: str) -> bool:
+        return self.update(shard_id, "submitted", batch_id=batch_id, submitted_at=time.time())
+
+    def mark_finished(self, shard_id: str, batch: Dict[str, Any]) -> bool:
+        """Endzustand vom Provider: mit Output- oder Error-Datei 'completed', sonst 'failed'."""
+        has_files = bool(batch.get("output_file_id") or batch.get("error_file_id"))
+        return self.update(
+            shard_id, "completed" if has_files else "failed",
+            output_file_id=batch.get("output_file_id"), error_file_id=batch.get("error_file_id"), finished_at=time.time(),
+            status_json=json.dumps(batch, ensure_ascii=False, default=str)
+        )
+
+    def mark_fetched(self, shard_id: str, output_path: Optional[str], error_path: Optional[str]) -> bool:
+        return self.update(shard_id, "fetched", output_path=output_path, error_path=error_path)
+
+    def mark_applied(self, shard_id: str) -> bool:
+        return self.update(shard_id, "applied")
+
+    def mark_archived(self, shard_id: str) -> bool:
+        return self.update(shard_id, "archived")
+
+    def mark_released(self, shard_id: str) -> bool:
+        return self.update(shard_id, "released")
+
+    def set_setting(self, key: str, value: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def lower_watermark(self, key: str, row_indices: Iterable[int]) -> None:
+        """Setzt das Scan-Wasserzeichen vor die erste der Zeilen (row_index, 0-basiert), die wieder 'neu' sind,
+        damit der nächste Extract-Lauf sie ohne --full-scan erneut liest."""
+        indices = list(row_indices)
+        if not indices:
+            return
+        first_row = min(indices) + 2
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+            if row is None or int(row[0]) > first_row:
+                self._conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, str(first_row)))
+
+    # --- Lesen ---
+    def batches_in_state(self, *states: str, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Batches in einem der Zustände, mit `kind` nur die dieser Art."""
+        placeholders = ", ".join("?" for _ in states)
+        kind_filter = " AND kind = ?" if kind else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM batches WHERE state IN ({placeholders}){kind_filter} ORDER BY created_at",
+                states + ((kind,) if kind else ())
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, shard_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM batches WHERE shard_id = ?", (shard_id,)).fetchone()
+        return dict(row) if row else None
+
+    def find_by_batch_id(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM batches WHERE batch_id = ?", (batch_id,)).fetchone()
+        return dict(row) if row else None
+
+    def rows_by_custom_id(self, shard_id: str) -> Dict[str, List[str]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT custom_id, row_id FROM batch_rows WHERE shard_id = ? ORDER BY rowid", (shard_id,)
+            ).fetchall()
+        mapping: Dict[str, List[str]] = {}
+        for custom_id, row_id in rows:
+            mapping.setdefault(custom_id, []).append(row_id)
+        return mapping
+
+    def row_indices(self, shard_id: str) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT row_id, row_index FROM batch_rows WHERE shard_id = ? AND row_index IS NOT NULL", (shard_id,)
+            ).fetchall()
+        return {row_id: row_index for row_id, row_index in rows}
+
+    def attempts(self, shard_id: str) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT custom_id, MAX(attempt) FROM batch_rows WHERE shard_id = ? GROUP BY custom_id", (shard_id,)
+            ).fetchall()
+        return {custom_id: attempt for custom_id, attempt in rows}
+
+    def token_totals(self, *states: str) -> int:
+        placeholders = ", ".join("?" for _ in states)
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT COALESCE(SUM(token_estimate), 0) FROM batches WHERE state IN ({placeholders})", states
+            ).fetchone()
+        return row[0]
+
+    def recent_durations(self, limit: int = 20) -> List[float]:
+        """Laufzeiten (submitted -> fertig) der zuletzt beendeten Batches in Sekunden."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT finished_at - submitted_at FROM batches WHERE finished_at IS NOT NULL AND submitted_at IS NOT NULL "
+                "ORDER BY finished_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def claims_to_release(self, ttl_seconds: float) -> List[Dict[str, Any]]:
+        """Fehlgeschlagene Batches sowie solche, die länger als `ttl_seconds` ohne Ergebnis 'submitted' sind."""
+        cutoff = time.time() - ttl_seconds
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM batches WHERE state = 'failed' OR (state = 'submitted' AND updated_at < ?) ORDER BY created_at",
+                (cutoff,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_setting(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def watermark_key(sheet_id: Optional[str], sheet_name: str) -> str:
+    """Setting mit der ersten Zeile, ab der der Extract-Lauf das Sheet nach 'neu' durchsucht."""
+    return f"scan_watermark:{sheet_id}:{sheet_name}"
+
+
+def claim_key(record: Dict[str, Any]) -> str:
+    """Status-Wert, mit dem die Zeilen eines Shards beansprucht werden; Shards, die noch in der
+    Warteschlange stehen, haben noch keine Batch-ID und werden über ihre Shard-ID beansprucht."""
+    return f"{CLAIM_PREFIX}{record.get('batch_id') or record['shard_id']}"
+
+
+def import_legacy_files(store: StateStore, batch_dir: str = BATCH_DIR) -> int:
+    """Übernimmt laufende Batches (.batch_id) und ungelesene Outputs (.jsonl) aus dem alten Dateiformat."""
+    if not os.path.isdir(batch_dir):
+        return 0
+    imported = 0
+    for fname in sorted(os.listdir(batch_dir)):
+        path = os.path.join(batch_dir, fname)
+        if fname.endswith(".batch_id"):
+            with open(path, "r") as f:
+                batch_id = f.read().strip()
+            if not store.find_by_batch_id(batch_id):
+                store.record_shard(batch_id, None, {})
+                store.mark_submitted(batch_id, batch_id)
+                imported += 1
+            os.remove(path)
+        elif fname.endswith(".jsonl") and not fname.endswith("_errors.jsonl"):
+            batch_id = fname[:-len(".jsonl")]
+            record = store.find_by_batch_id(batch_id)
+            if record is None:
+                store.record_shard(batch_id, None, {})
+                store.mark_submitted(batch_id, batch_id)
+                store.mark_fetched(batch_id, path, None)
+                imported += 1
+    if imported:
+        logger.info(f"📥 {imported} Batches aus Altdateien in den Zustandsspeicher übernommen")
+    return imported
+
+
+_store: Optional[StateStore] = None
+_store_lock = threading.Lock()
+
+
+def get_state_store() -> StateStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = StateStore()
+        return _store
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Pipeline-Zustandsspeicher")
+    parser.add_argument("--import-legacy", action="store_true", help="Einmalig .batch_id/.jsonl-Dateien aus batches/ übernehmen")
+    args = parser.parse_args()
+
+    store = get_state_store()
+    if args.import_legacy:
+        import_legacy_files(store)
+    for state in STATES:
+        count = len(store.batches_in_state(state))
+        if count:
+            print(f"{state:<10} {count}")
@@ -0,0 +1,126 @@
+# token_scheduler.py
+# Warteschlange für gebaute Batch-Shards: gestartet wird nur, solange die geschätzten Input-Tokens aller
+# laufenden Batches unter BATCH_TOKEN_BUDGET bleiben (Provider-Limit für eingereihte Tokens pro Modell).
+
+import os
+import time
+import logging
+from statistics import median
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+import metrics
+from state_store import get_state_store
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# 0 = kein Budget, alle Shards werden sofort gestartet
+BATCH_TOKEN_BUDGET = int(os.getenv("BATCH_TOKEN_BUDGET", 0))
+# Annahme für die Prognose, solange noch kein Batch beendet wurde
+DEFAULT_BATCH_HOURS = float(os.getenv("DEFAULT_BATCH_HOURS", 2))
+
+QUEUED_STATES = ("built",)
+LIVE_STATES = ("uploaded", "submitted")
+
+
+class TokenBudgetScheduler:
+    """Gibt wartende Shards in Erstellungsreihenfolge frei, sobald ihre Tokens ins Budget passen."""
+
+    def __init__(self, budget: int = BATCH_TOKEN_BUDGET):
+        self.budget = budget
+        self.store = get_state_store()
+
+    def queued(self) -> List[Dict[str, Any]]:
+        return [record for record in self.store.batches_in_state(*QUEUED_STATES) if record.get("input_path")]
+
+    def outstanding_tokens(self) -> int:
+        return self.store.token_totals(*LIVE_STATES)
+
+    def next_release(self) -> List[Dict[str, Any]]:
+        """Shards, die jetzt gestartet werden dürfen. Die Reihenfolge bleibt erhalten: ein zu großer Shard
+        blockiert die nachfolgenden, bis genug Kapazität frei ist (ein Shard über dem gesamten Budget
+        startet, sobald nichts anderes mehr läuft)."""
+        queue = self.queued()
+        if not self.budget:
+            return queue
+
+        outstanding = self.outstanding_tokens()
+        released = []
+        for record in queue:
+            tokens = record["token_estimate"]
+            if outstanding + tokens > self.budget and (outstanding or released):
+                break
+            if tokens > self.budget:
+                logger.warning(f"⚠️ Shard {record['shard_id']} ({tokens} Tokens) ist größer als das Budget {self.budget}")
+            released.append(record)
+            outstanding += tokens
+        return released
+
+    def release(self, upload_workers: Optional[int] = None) -> Dict[str, str]:
+        """Startet die freigegebenen Shards über die Batch-API; liefert batch_id -> shard_id."""
+        from openai_batch_submitter import start_shards, UPLOAD_WORKERS
+
+        records = self.next_release()
+        if records:
+            start_shards([record["input_path"] for record in records], sum(r["request_count"] for r in records),
+                         mode="batch", upload_workers=upload_workers or UPLOAD_WORKERS)
+        started = {}
+        for record in records:
+            current = self.store.get(record["shard_id"])
+            if current and current.get("batch_id") and current["state"] in LIVE_STATES:
+                started[current["batch_id"]] = current["shard_id"]
+        self.log_stats()
+        return started
+
+    def average_batch_seconds(self) -> float:
+        durations = self.store.recent_durations()
+        return median(durations) if durations else DEFAULT_BATCH_HOURS * 3600
+
+    def stats(self) -> Dict[str, Any]:
+        """Warteschlangentiefe und Prognose, bis alles abgearbeitet ist: pro Budget-Welle eine mittlere Batch-Laufzeit."""
+        queue = self.queued()
+        queued_tokens = sum(record["token_estimate"] for record in queue)
+        outstanding = self.outstanding_tokens()
+        duration = self.average_batch_seconds()
+        if not queue and not outstanding:
+            drain = 0.0
+        elif self.budget:
+            drain = max(1.0, (queued_tokens + outstanding) / self.budget) * duration
+        else:
+            drain = duration
+        metrics.set_gauge("batch_queue_depth", len(queue))
+        metrics.set_gauge("batch_queue_tokens", queued_tokens)
+        metrics.set_gauge("batch_outstanding_tokens", outstanding)
+        metrics.set_gauge("batch_queue_drain_seconds", round(drain, 1))
+        return {
+            "queue_depth": len(queue),
+            "queued_requests": sum(record["request_count"] for record in queue),
+            "queued_tokens": queued_tokens,
+            "outstanding_tokens": outstanding,
+            "budget": self.budget,
+            "projected_drain_seconds": drain,
+        }
+
+    def log_stats(self) -> None:
+        stats = self.stats()
+        budget = stats["budget"] or "∞"
+        logger.info(
+            f"🧮 Warteschlange: {stats['queue_depth']} Shards ({stats['queued_tokens']} Tokens), "
+            f"laufend {stats['outstanding_tokens']}/{budget} Tokens, "
+            f"abgearbeitet in ~{stats['projected_drain_seconds'] / 3600:.1f}h"
+        )
+
+
+def get_scheduler() -> TokenBudgetScheduler:
+    return TokenBudgetScheduler()
+
+
+if __name__ == "__main__":
+    import json
+
+    logging.basicConfig(level=logging.INFO)
+    stats = get_scheduler().stats()
+    stats["projected_drain_at"] = time.strftime("%Y-%m-%d %H:%M", time.localtime(time.time() + stats["projected_drain_seconds"]))
+    print(json.dumps(stats, indent=2))